@@ -0,0 +1,94 @@
+# Copyright (c) 2014-2020 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time and memory taken to build the VM cache from synthetic property
+collector results, with and without shared record classes.
+
+Usage, from the repository root:
+    python -m benchmarks.cache_build [count ...]
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from mock import patch
+from pyVmomi import vim
+
+from vsphere_plugin_common import clients
+from vsphere_plugin_common.clients import VsphereClient
+
+DEFAULT_COUNTS = (1000, 10000, 50000)
+
+
+class _NoRecordTypes(dict):
+    """Never reuse a record class, as before they were shared."""
+
+    def get(self, *_):
+        return None
+
+    def __setitem__(self, *_):
+        pass
+
+
+def synthetic_vms(count):
+    return [
+        {
+            'name': 'vm-{0}'.format(i),
+            'summary': None,
+            'config.hardware.device': [],
+            'config.hardware.memoryMB': 1024,
+            'config.hardware.numCPU': 2,
+            'datastore': [vim.Datastore('datastore-1')],
+            'guest.guestState': 'running',
+            'guest.net': [],
+            'network': [vim.Network('network-1')],
+            'obj': vim.VirtualMachine('vm-{0}'.format(i)),
+        }
+        for i in range(count)
+    ]
+
+
+def build_cache(results):
+    client = VsphereClient()
+    with patch.object(VsphereClient, '_collect_properties',
+                      return_value=results):
+        gc.collect()
+        tracemalloc.start()
+        start = time.time()
+        vms = client._get_vms(use_cache=False)
+        elapsed = time.time() - start
+        memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    assert len(vms) == len(results)
+    return elapsed, memory
+
+
+def main(counts):
+    print('{0:>8} {1:>8} {2:>10} {3:>12}'.format(
+        'objects', 'classes', 'seconds', 'peak MiB'))
+    for count in counts:
+        results = synthetic_vms(count)
+        for label, record_types in (('per-obj', _NoRecordTypes()),
+                                    ('shared', {})):
+            with patch.object(clients, '_record_types', record_types):
+                elapsed, memory = build_cache(results)
+            print('{0:>8} {1:>8} {2:>10.3f} {3:>12.1f}'.format(
+                count, label, elapsed, memory / 1024.0 / 1024.0))
+
+
+if __name__ == '__main__':
+    main([int(count) for count in sys.argv[1:]] or DEFAULT_COUNTS)
@@ -0,0 +1,94 @@
+# Copyright (c) 2014-2020 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Time taken by the client setup done by _with_client before every
+operation: merging the plugin properties and loading the connection
+config, with the login patched out. Compares parsing the config every
+time with the memoized config.
+
+Usage, from the repository root:
+    python -m benchmarks.client_setup [iterations]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from mock import patch
+
+from vsphere_plugin_common import utils
+from vsphere_plugin_common.clients import Config, VsphereClient
+
+DEFAULT_ITERATIONS = 10000
+
+CONNECTION_CONFIG = """
+host: vcenter.example.com
+port: 443
+username: administrator@vsphere.local
+password: secret
+datacenter_name: Datacenter
+resource_pool_name: Resources
+auto_placement: true
+allow_insecure: true
+"""
+
+PLUGIN_PROPERTIES = {
+    name: {'value': value} for name, value in (
+        ('host', 'vcenter.example.com'),
+        ('port', 443),
+        ('username', 'administrator@vsphere.local'),
+        ('password', 'secret'),
+        ('datacenter_name', 'Datacenter'),
+        ('resource_pool_name', 'Resources'),
+        ('auto_placement', True),
+        ('allow_insecure', True),
+        ('certificate_path', ''),
+    )
+}
+
+
+def setup_client(iterations, memoized):
+    start = time.time()
+    for _ in range(iterations):
+        if not memoized:
+            Config._parsed.clear()
+        vsphere_config = utils.get_plugin_properties(PLUGIN_PROPERTIES)
+        VsphereClient().get(config=vsphere_config)
+    return time.time() - start
+
+
+def main(iterations):
+    directory = tempfile.mkdtemp()
+    try:
+        config_path = os.path.join(directory, 'connection_config.yaml')
+        with open(config_path, 'w') as config_file:
+            config_file.write(CONNECTION_CONFIG)
+        environ = {'CFY_VSPHERE_CONFIG_PATH': config_path}
+        with patch.dict('os.environ', environ), \
+                patch.object(VsphereClient, 'connect', lambda self, cfg: self):
+            print('{0:>10} {1:>10} {2:>14}'.format(
+                'config', 'seconds', 'us/operation'))
+            for label, memoized in (('parsed', False), ('memoized', True)):
+                elapsed = setup_client(iterations, memoized)
+                print('{0:>10} {1:>10.3f} {2:>14.1f}'.format(
+                    label, elapsed, elapsed / iterations * 1e6))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if sys.argv[1:] else DEFAULT_ITERATIONS)
@@ -0,0 +1,82 @@
+# Copyright (c) 2014-2020 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cold import time of each operation module listed in plugin.yaml, as paid
+by every operation subprocess the agent starts. Each module is imported
+in a fresh interpreter, and the best of several runs is reported.
+
+Usage, from the repository root:
+    python -m benchmarks.import_time [plugin.yaml] [runs]
+"""
+
+import sys
+import subprocess
+
+import yaml
+
+DEFAULT_PLUGIN_YAML = 'plugin.yaml'
+DEFAULT_RUNS = 5
+
+IMPORT_SCRIPT = """
+import time
+start = time.time()
+import {module}
+print(time.time() - start)
+"""
+
+
+def _implementations(node):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == 'implementation' and isinstance(value, str):
+                yield value
+            else:
+                for implementation in _implementations(value):
+                    yield implementation
+    elif isinstance(node, list):
+        for item in node:
+            for implementation in _implementations(item):
+                yield implementation
+
+
+def operation_modules(plugin_yaml):
+    with open(plugin_yaml) as plugin_file:
+        blueprint = yaml.safe_load(plugin_file)
+    plugins = set(blueprint.get('plugins', {}))
+    modules = set()
+    for implementation in _implementations(blueprint):
+        plugin, _, path = implementation.partition('.')
+        if plugin in plugins:
+            modules.add(path.rsplit('.', 1)[0])
+    return sorted(modules)
+
+
+def import_time(module, runs):
+    return min(
+        float(subprocess.check_output(
+            [sys.executable, '-c', IMPORT_SCRIPT.format(module=module)]))
+        for _ in range(runs))
+
+
+def main(plugin_yaml, runs):
+    print('{0:<45} {1:>8}'.format('module', 'ms'))
+    for module in operation_modules(plugin_yaml):
+        print('{0:<45} {1:>8.1f}'.format(
+            module, import_time(module, runs) * 1000))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if sys.argv[1:] else DEFAULT_PLUGIN_YAML,
+         int(sys.argv[2]) if sys.argv[2:] else DEFAULT_RUNS)
@@ -0,0 +1,490 @@
+# Copyright (c) 2014-2020 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Replay server placements offline, over a recorded or synthetic inventory.
+A fake client serves the inventory to find_candidate_hosts and
+select_host_and_datastore. Each placement then counts towards the
+capacity left for the next one, as with plan_placements. The report
+gives the time taken by each placement and how evenly the hosts end up
+loaded.
+
+An inventory is recorded from a vCenter with --record, using the
+connection config of the plugin. It holds what placement reads, in a
+JSON file like:
+    {
+        "resource_pools": [{"id": "resgroup-1", "name": "Resources",
+                            "children": []}],
+        "clusters": [{"id": "domain-c1", "name": "cluster-1",
+                      "resource_pool": "resgroup-1",
+                      "standalone": false}],
+        "networks": [{"id": "network-1", "name": "VM Network"}],
+        "datastores": [{"id": "datastore-1", "name": "ds-1",
+                        "free_space": 1099511627776, "status": "green",
+                        "accessible": true}],
+        "hosts": [{"id": "host-1", "name": "esx-1", "cluster": "domain-c1",
+                   "memory_mb": 262144, "cpu_threads": 64,
+                   "status": "green", "connected": true,
+                   "maintenance": false, "datastores": ["datastore-1"],
+                   "networks": ["network-1"]}],
+        "vms": [{"host": "host-1", "cpus": 2, "memory_mb": 4096,
+                 "template": false}],
+        "templates": [{"name": "template", "committed": 10737418240,
+                       "uncommitted": 32212254720}]
+    }
+Distributed port groups have IDs starting with dvportgroup. Standalone
+hosts have a compute resource as their cluster. The VMs of a recorded
+host are one entry, with the totals of _get_host_usage. Requests are a
+JSON list of {"cpus", "memory", "template", "resource_pool", "networks"}
+with networks as [{"name", "switch_distributed"}].
+
+Usage, from the repository root:
+    python -m benchmarks.placement_sim --record inventory.json
+        [--datacenter NAME] [--template NAME ...]
+    python -m benchmarks.placement_sim [--hosts N ...] [--requests N]
+    python -m benchmarks.placement_sim --inventory inventory.json
+        [--replay requests.json] [--show-placements]
+    python -m benchmarks.placement_sim --hosts 100 --save inventory.json
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+from types import SimpleNamespace
+from collections import OrderedDict
+
+from pyVmomi import vim
+
+from vsphere_plugin_common.clients import HostUsage, _ResourcePoolList
+from vsphere_plugin_common.clients.server import ServerClient
+
+DEFAULT_HOSTS = (10, 100, 1000)
+DEFAULT_REQUESTS = 100
+HOSTS_PER_CLUSTER = 16
+DATASTORES_PER_CLUSTER = 4
+TEMPLATE = 'template'
+RESOURCE_POOL = 'Resources'
+STANDARD_NETWORK = 'VM Network'
+DISTRIBUTED_NETWORK = 'dv-prod'
+
+GiB = 1024 ** 3
+
+
+class _QuietLogger(object):
+    """Drop the placement logs, which would otherwise dominate the time."""
+
+    def _ignore(self, *_, **__):
+        pass
+
+    debug = info = warn = warning = error = _ignore
+
+
+class FakeServerClient(ServerClient):
+    """
+        ServerClient placing servers on an inventory loaded from JSON,
+        without a vCenter.
+    """
+
+    def __init__(self, inventory):
+        super(FakeServerClient, self).__init__(ctx_logger=_QuietLogger())
+        pools = {
+            pool['id']: SimpleNamespace(id=pool['id'], name=pool['name'])
+            for pool in inventory['resource_pools']
+        }
+        for pool in inventory['resource_pools']:
+            pools[pool['id']].resourcePool = [
+                pools[child] for child in pool.get('children', [])]
+        clusters = {
+            cluster['id']: SimpleNamespace(
+                id=cluster['id'],
+                name=cluster['name'],
+                obj=(vim.ComputeResource if cluster.get('standalone')
+                     else vim.ClusterComputeResource)(cluster['id']),
+                resourcePool=pools[cluster['resource_pool']],
+            )
+            for cluster in inventory['clusters']
+        }
+        networks = {
+            network['id']: SimpleNamespace(
+                id=network['id'], name=network['name'])
+            for network in inventory['networks']
+        }
+        self.datastores = [
+            SimpleNamespace(
+                id=datastore['id'],
+                name=datastore['name'],
+                overallStatus=datastore.get('status', 'green'),
+                summary=SimpleNamespace(
+                    accessible=datastore.get('accessible', True),
+                    freeSpace=datastore['free_space'],
+                ),
+            )
+            for datastore in inventory['datastores']
+        ]
+        datastores = {datastore.id: datastore
+                      for datastore in self.datastores}
+        self.hosts = [
+            SimpleNamespace(
+                id=host['id'],
+                name=host['name'],
+                parent=clusters[host['cluster']],
+                overallStatus=host.get('status', 'green'),
+                summary=SimpleNamespace(runtime=SimpleNamespace(
+                    connectionState=(
+                        'connected' if host.get('connected', True)
+                        else 'disconnected'),
+                    inMaintenanceMode=host.get('maintenance', False),
+                )),
+                hardware=SimpleNamespace(
+                    memorySize=host['memory_mb'] * 1024 * 1024,
+                    cpuInfo=SimpleNamespace(
+                        numCpuThreads=host['cpu_threads']),
+                ),
+                datastore=[datastores[ds] for ds in host['datastores']],
+                network=[networks[net] for net in host['networks']],
+            )
+            for host in inventory['hosts']
+        ]
+        self.clusters = list(clusters.values())
+        self.templates = {
+            template['name']: SimpleNamespace(
+                name=template['name'],
+                summary=SimpleNamespace(storage=SimpleNamespace(
+                    committed=template['committed'],
+                    uncommitted=template['uncommitted'],
+                )),
+            )
+            for template in inventory['templates']
+        }
+
+        # The totals _get_host_usage would aggregate from the VMs
+        usage = {}
+        for vm in inventory['vms']:
+            memory, cpus = usage.get(vm['host'], (0, 0))
+            if not vm.get('template'):
+                memory += vm['memory_mb']
+            usage[vm['host']] = HostUsage(memory, cpus + vm['cpus'])
+        self._cache['host_usage'] = usage
+        self._cache['reserved_space'] = {}
+        self._cache['resource_pool'] = _ResourcePoolList(pools.values())
+
+    def _get_hosts(self, *_, **__):
+        return self.hosts
+
+    def _get_clusters(self, *_, **__):
+        return self.clusters
+
+    def _get_datastores(self, *_, **__):
+        return self.datastores
+
+    def place(self, request):
+        template = self.templates[request['template']]
+        host, datastore = self._place_server(
+            datacenter=None,
+            resource_pool_name=request['resource_pool'],
+            cpus=request['cpus'],
+            memory=request['memory'],
+            networks=request.get('networks') or [],
+            template=template,
+            allowed_hosts=request.get('allowed_hosts'),
+            allowed_clusters=request.get('allowed_clusters'),
+            allowed_datastores=request.get('allowed_datastores'),
+        )
+        self._add_placed_usage(
+            host, datastore, request['cpus'], request['memory'],
+            self._get_vm_disk_usage(template, request['memory']))
+        return host, datastore
+
+    def host_ratios(self):
+        """
+            vCPUs assigned per CPU thread, and the share of memory assigned,
+            of every usable host.
+        """
+        usage = self._cache['host_usage']
+        ratios = []
+        for host in self.hosts:
+            if not self.host_is_usable(host):
+                continue
+            memory, cpus = usage.get(host.id, (0, 0))
+            ratios.append((
+                cpus / host.hardware.cpuInfo.numCpuThreads,
+                memory / (host.hardware.memorySize // 1024 // 1024),
+            ))
+        return ratios
+
+
+def record_inventory(client, template_names):
+    """
+        Record the inventory of a connected ServerClient, in the format
+        loaded by FakeServerClient.
+    """
+    hosts = client._get_hosts()
+    parents = OrderedDict()
+    networks = OrderedDict()
+    datastores = OrderedDict()
+    for host in hosts:
+        parents.setdefault(host.parent.id, host.parent)
+        for network in host.network:
+            networks.setdefault(network.id, network)
+        for datastore in host.datastore:
+            datastores.setdefault(datastore.id, datastore)
+
+    templates = []
+    for name in template_names:
+        # Templates may be kept in another datacenter
+        with client._scoped(None):
+            template = client._get_obj_by_name(
+                vim.VirtualMachine, name, projections=['summary'])
+        if template is None:
+            raise ValueError(
+                'VM template {0} could not be found.'.format(name))
+        templates.append({
+            'name': name,
+            'committed': template.summary.storage.committed,
+            'uncommitted': template.summary.storage.uncommitted,
+        })
+
+    return {
+        'resource_pools': [
+            {'id': pool.id, 'name': pool.name,
+             'children': [child.id for child in pool.resourcePool]}
+            for pool in client._get_resource_pools()
+        ],
+        'clusters': [
+            {'id': parent.id, 'name': parent.name,
+             'resource_pool': parent.resourcePool.id,
+             'standalone': not isinstance(
+                 parent.obj, vim.ClusterComputeResource)}
+            for parent in parents.values()
+        ],
+        'networks': [
+            {'id': network.id, 'name': network.name}
+            for network in networks.values()
+        ],
+        'datastores': [
+            {'id': datastore.id, 'name': datastore.name,
+             'free_space': datastore.summary.freeSpace,
+             'status': str(datastore.overallStatus),
+             'accessible': bool(datastore.summary.accessible)}
+            for datastore in datastores.values()
+        ],
+        'hosts': [
+            {'id': host.id, 'name': host.name, 'cluster': host.parent.id,
+             'memory_mb': host.hardware.memorySize // 1024 // 1024,
+             'cpu_threads': host.hardware.cpuInfo.numCpuThreads,
+             'status': str(host.overallStatus),
+             'connected': (
+                 host.summary.runtime.connectionState == 'connected'),
+             'maintenance': bool(host.summary.runtime.inMaintenanceMode),
+             'datastores': [datastore.id for datastore in host.datastore],
+             'networks': [network.id for network in host.network]}
+            for host in hosts
+        ],
+        'vms': [
+            {'host': host_id, 'cpus': usage.cpus,
+             'memory_mb': usage.memory, 'template': False}
+            for host_id, usage in client._get_host_usage().items()
+        ],
+        'templates': templates,
+    }
+
+
+def synthetic_inventory(hosts, seed=0):
+    """
+        Hosts in clusters of HOSTS_PER_CLUSTER, each cluster sharing its
+        own datastores, with a random load of VMs. Some hosts are in
+        maintenance, and some lack the distributed network.
+    """
+    rand = random.Random(seed)
+    inventory = {
+        'resource_pools': [],
+        'clusters': [],
+        'networks': [
+            {'id': 'network-1', 'name': STANDARD_NETWORK},
+            {'id': 'dvportgroup-1', 'name': DISTRIBUTED_NETWORK},
+        ],
+        'datastores': [],
+        'hosts': [],
+        'vms': [],
+        'templates': [
+            {'name': TEMPLATE, 'committed': 10 * GiB,
+             'uncommitted': 30 * GiB},
+        ],
+    }
+    for index in range(hosts):
+        cluster_index, host_index = divmod(index, HOSTS_PER_CLUSTER)
+        if host_index == 0:
+            pool_id = 'resgroup-{0}'.format(cluster_index)
+            inventory['resource_pools'].append(
+                {'id': pool_id, 'name': RESOURCE_POOL, 'children': []})
+            inventory['clusters'].append({
+                'id': 'domain-c{0}'.format(cluster_index),
+                'name': 'cluster-{0}'.format(cluster_index),
+                'resource_pool': pool_id,
+            })
+            datastore_ids = []
+            for ds_index in range(DATASTORES_PER_CLUSTER):
+                datastore_id = 'datastore-{0}-{1}'.format(
+                    cluster_index, ds_index)
+                datastore_ids.append(datastore_id)
+                inventory['datastores'].append({
+                    'id': datastore_id,
+                    'name': 'ds-{0}-{1}'.format(cluster_index, ds_index),
+                    'free_space': rand.randint(1, 20) * 1024 * GiB,
+                    'status': rand.choice(['green'] * 19 + ['red']),
+                    'accessible': True,
+                })
+        host_id = 'host-{0}'.format(index)
+        inventory['hosts'].append({
+            'id': host_id,
+            'name': 'esx-{0}'.format(index),
+            'cluster': 'domain-c{0}'.format(cluster_index),
+            'memory_mb': rand.choice([256, 512, 768]) * 1024,
+            'cpu_threads': rand.choice([32, 48, 64, 96]),
+            'status': 'green',
+            'connected': True,
+            'maintenance': rand.random() < 0.02,
+            'datastores': datastore_ids,
+            'networks': (['network-1', 'dvportgroup-1']
+                         if rand.random() < 0.8 else ['network-1']),
+        })
+        for _ in range(rand.randint(0, 40)):
+            inventory['vms'].append({
+                'host': host_id,
+                'cpus': rand.choice([1, 2, 4, 8]),
+                'memory_mb': rand.choice([1, 2, 4, 8, 16]) * 1024,
+                'template': False,
+            })
+    return inventory
+
+
+def synthetic_requests(count, seed=0):
+    rand = random.Random(seed)
+    return [
+        {
+            'cpus': rand.choice([1, 2, 4, 8]),
+            'memory': rand.choice([1, 2, 4, 8, 16]) * 1024,
+            'template': TEMPLATE,
+            'resource_pool': RESOURCE_POOL,
+            'networks': [
+                {'name': STANDARD_NETWORK, 'switch_distributed': False},
+            ] + ([{'name': DISTRIBUTED_NETWORK, 'switch_distributed': True}]
+                 if rand.random() < 0.5 else []),
+        }
+        for _ in range(count)
+    ]
+
+
+def _spread(values):
+    mean = sum(values) / len(values)
+    deviation = (sum((value - mean) ** 2 for value in values) /
+                 len(values)) ** 0.5
+    return min(values), max(values), deviation
+
+
+def simulate(inventory, requests, show_placements=False):
+    client = FakeServerClient(inventory)
+    timings = []
+    for index, request in enumerate(requests):
+        start = time.time()
+        host, datastore = client.place(request)
+        timings.append(time.time() - start)
+        if show_placements:
+            print('{0:>6} {1:>3} vCPU {2:>6} MB -> {3} {4}'.format(
+                index, request['cpus'], request['memory'],
+                host.name, datastore.name))
+
+    timings.sort()
+    cpu_ratios, memory_ratios = zip(*client.host_ratios())
+    return {
+        'hosts': len(client.hosts),
+        'placements': len(timings),
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'p50_ms': timings[len(timings) // 2] * 1000,
+        'max_ms': timings[-1] * 1000,
+        'cpu_ratio': _spread(cpu_ratios),
+        'memory_ratio': _spread(memory_ratios),
+    }
+
+
+def report(results):
+    print('{0:>6} {1:>6} {2:>9} {3:>9} {4:>9}  {5:>20}  {6:>20}'.format(
+        'hosts', 'placed', 'mean ms', 'p50 ms', 'max ms',
+        'vCPU/thread min-max sd', 'memory min-max sd'))
+    for result in results:
+        print('{0:>6} {1:>6} {2:>9.2f} {3:>9.2f} {4:>9.2f}  '
+              '{5[0]:>6.2f}-{5[1]:<6.2f} {5[2]:>6.3f}  '
+              '{6[0]:>6.2f}-{6[1]:<6.2f} {6[2]:>6.3f}'.format(
+                  result['hosts'], result['placements'], result['mean_ms'],
+                  result['p50_ms'], result['max_ms'],
+                  result['cpu_ratio'], result['memory_ratio']))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--inventory',
+                        help='recorded inventory JSON to place servers on')
+    parser.add_argument('--record',
+                        help='record the inventory of the vCenter in the '
+                             'connection config to this file')
+    parser.add_argument('--datacenter',
+                        help='only record the inventory of this datacenter')
+    parser.add_argument('--template', nargs='+', default=[TEMPLATE],
+                        help='templates to record')
+    parser.add_argument('--hosts', type=int, nargs='+',
+                        default=DEFAULT_HOSTS,
+                        help='sizes of the synthetic inventories')
+    parser.add_argument('--replay', help='JSON list of requests to place')
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS,
+                        help='number of synthetic requests')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save',
+                        help='write the synthetic inventory to this file')
+    parser.add_argument('--show-placements', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.record:
+        client = ServerClient(ctx_logger=_QuietLogger()).get()
+        with client._datacenter_scope(args.datacenter):
+            inventory = record_inventory(client, args.template)
+        with open(args.record, 'w') as inventory_file:
+            json.dump(inventory, inventory_file, indent=2)
+        return
+
+    if args.replay:
+        with open(args.replay) as requests_file:
+            requests = json.load(requests_file)
+    else:
+        requests = synthetic_requests(args.requests, args.seed)
+
+    if args.inventory:
+        with open(args.inventory) as inventory_file:
+            inventories = [json.load(inventory_file)]
+    else:
+        inventories = [synthetic_inventory(hosts, args.seed)
+                       for hosts in args.hosts]
+    if args.save:
+        with open(args.save, 'w') as inventory_file:
+            json.dump(inventories[-1], inventory_file, indent=2)
+        return
+
+    report([simulate(inventory, requests, args.show_placements)
+            for inventory in inventories])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,166 @@
+# Copyright (c) 2014-2020 Cloudify Platform Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Check that placing servers on a recorded inventory picks the same hosts
+and datastores as ServerClient does on the inventory it was recorded
+from. Kept with the benchmark, out of the plugin unit tests.
+
+Usage, from the repository root:
+    python -m pytest benchmarks/test_placement_sim.py
+"""
+
+import json
+import unittest
+
+from mock import Mock, MagicMock
+from pyVmomi import vim
+
+from cloudify.state import current_ctx
+
+from vsphere_plugin_common.clients import HostUsage
+from vsphere_plugin_common.clients.server import ServerClient
+
+from benchmarks import placement_sim
+
+GiB = 1024 ** 3
+
+
+def _named(obj_id, name):
+    obj = Mock()
+    obj.id = obj_id
+    obj.name = name
+    return obj
+
+
+def _resource_pool(pool_id):
+    pool = _named(pool_id, placement_sim.RESOURCE_POOL)
+    pool.resourcePool = []
+    return pool
+
+
+def _parent(obj, resource_pool):
+    parent = _named(obj._moId, 'cluster-' + obj._moId)
+    parent.obj = obj
+    parent.resourcePool = resource_pool
+    return parent
+
+
+def _datastore(index, free_space):
+    datastore = _named('datastore-{0}'.format(index),
+                       'ds-{0}'.format(index))
+    datastore.overallStatus = 'green'
+    datastore.summary.accessible = True
+    datastore.summary.freeSpace = free_space
+    return datastore
+
+
+def _host(host_id, parent, memory, cpus, datastores, networks,
+          maintenance=False):
+    host = MagicMock()
+    host.id = host_id
+    host.name = 'esx-' + host_id
+    host.parent = parent
+    host.datastore = datastores
+    host.network = networks
+    host.hardware.memorySize = memory * 1024 ** 2
+    host.hardware.cpuInfo.numCpuThreads = cpus
+    host.overallStatus = 'green'
+    host.summary.runtime.connectionState = 'connected'
+    host.summary.runtime.inMaintenanceMode = maintenance
+    return host
+
+
+class PlacementSimulatorTests(unittest.TestCase):
+
+    def setUp(self):
+        super(PlacementSimulatorTests, self).setUp()
+        current_ctx.set(MagicMock())
+        self.addCleanup(current_ctx.clear)
+
+    def test_simulator_matches_server_client(self):
+        pools = [_resource_pool('resgroup-{0}'.format(index))
+                 for index in range(1, 4)]
+        parents = [
+            _parent(vim.ClusterComputeResource('domain-c1'), pools[0]),
+            _parent(vim.ClusterComputeResource('domain-c2'), pools[1]),
+            _parent(vim.ComputeResource('domain-s1'), pools[2]),
+        ]
+        standard = _named('network-1', placement_sim.STANDARD_NETWORK)
+        distributed = _named('dvportgroup-1',
+                             placement_sim.DISTRIBUTED_NETWORK)
+        datastores = [
+            _datastore(index, free_space * GiB)
+            for index, free_space in enumerate((2048, 512, 1024, 4096), 1)
+        ]
+        hosts = [
+            _host('host-1', parents[0], 65536, 16, datastores[:2],
+                  [standard, distributed]),
+            _host('host-2', parents[0], 65536, 16, datastores[:2],
+                  [standard, distributed]),
+            _host('host-3', parents[1], 131072, 32, [datastores[2]],
+                  [standard]),
+            _host('host-4', parents[2], 262144, 64, [datastores[3]],
+                  [standard, distributed], maintenance=True),
+        ]
+        template = Mock()
+        template.name = placement_sim.TEMPLATE
+        template.summary.storage.committed = 10 * GiB
+        template.summary.storage.uncommitted = 30 * GiB
+
+        client = ServerClient()
+        client._get_hosts = Mock(return_value=hosts)
+        client._get_resource_pools = Mock(return_value=pools)
+        client._get_obj_by_name = Mock(return_value=template)
+        client._cache['host_usage'] = {
+            'host-1': HostUsage(memory=16384, cpus=8),
+            'host-2': HostUsage(memory=49152, cpus=4),
+            'host-3': HostUsage(memory=8192, cpus=40),
+        }
+        client._cache['reserved_space'] = {}
+
+        inventory = json.loads(json.dumps(placement_sim.record_inventory(
+            client, [placement_sim.TEMPLATE])))
+        simulator = placement_sim.FakeServerClient(inventory)
+
+        networks = [{'name': placement_sim.STANDARD_NETWORK,
+                     'switch_distributed': False}]
+        dv_networks = networks + [
+            {'name': placement_sim.DISTRIBUTED_NETWORK,
+             'switch_distributed': True}]
+        placed = []
+        for cpus, memory, vm_networks in (
+                (4, 8192, networks), (2, 4096, dv_networks),
+                (8, 16384, networks), (1, 2048, dv_networks),
+                (4, 8192, networks), (2, 4096, networks)):
+            host, datastore = client._place_server(
+                datacenter=None,
+                resource_pool_name=placement_sim.RESOURCE_POOL,
+                cpus=cpus, memory=memory, networks=vm_networks,
+                template=template)
+            client._add_placed_usage(
+                host, datastore, cpus, memory,
+                client._get_vm_disk_usage(template, memory))
+            simulated_host, simulated_datastore = simulator.place({
+                'cpus': cpus, 'memory': memory,
+                'template': placement_sim.TEMPLATE,
+                'resource_pool': placement_sim.RESOURCE_POOL,
+                'networks': vm_networks})
+            self.assertEqual(
+                (simulated_host.id, simulated_datastore.id),
+                (host.id, datastore.id))
+            placed.append(host.id)
+
+        # The inventory leads to more than one host being picked
+        self.assertGreater(len(set(placed)), 1)
@@ -354,6 +354,7 @@ def create(ctx, connection_config, target, ovf_name, ovf_source,
             'lease state is done couldn\'t upload files')
 
     ovf_handle.upload_disks(lease, client.si.content)
+    client._invalidate_snapshots('datastore')
     created_vm = client._get_obj_by_name(vim.VirtualMachine, ovf_name,
                                          use_cache=False)
     ctx.instance.runtime_properties[VSPHERE_SERVER_ID] = created_vm.id
@@ -31,12 +31,18 @@ from __future__ import division
 
 # Stdlib imports
 import os
+import re
 import ssl
+import json
+import socket
 import time
-import yaml
 import atexit
+import numbers
 from copy import copy
-from collections import namedtuple
+from inspect import getcallargs
+from functools import wraps, partial
+from contextlib import contextmanager
+from collections import namedtuple, OrderedDict
 try:
     from collections import MutableMapping
 except ImportError:
@@ -44,8 +50,12 @@ except ImportError:
 
 
 # Third party imports
-from pyVmomi import vim, vmodl
-from pyVim.connect import SmartConnect, SmartConnectNoSSL, Disconnect
+from pyVmomi import vim, vmodl, VmomiSupport, SoapStubAdapter
+from pyVim.connect import (
+    Connect,
+    Disconnect,
+    SmartConnect,
+    SmartConnectNoSSL)
 
 # Cloudify imports
 from cloudify import ctx
@@ -56,15 +66,24 @@ from ..constants import (
     NETWORK_ID,
     ASYNC_TASK_ID,
     TASK_CHECK_SLEEP,
+    ASYNC_TASK_ENTITY,
     ASYNC_RESOURCE_ID,
+    SESSION_CACHE_DIR,
+    API_VERSION_CACHE_DIR,
+    SNAPSHOT_CACHE_DIR,
+    SNAPSHOT_CACHE_TTL,
+    COLLECTOR_PAGE_SIZE,
     DEFAULT_CONFIG_PATH
 )
 from .._compat import (
     unquote,
-    text_type
+    text_type,
+    string_types,
+    HTTPException
 )
 from ..utils import (
     logger,
+    locked_file,
 )
 
 
@@ -74,6 +93,9 @@ class Config(object):
     # Hard-coded to old path so old manager blueprints aren't broken
     CONNECTION_CONFIG_PATH_DEFAULT = '/root/connection_config.yaml'
 
+    # Parsed config files, keyed by path
+    _parsed = {}
+
     _path_options = [
         {'source': '/root/connection_config.yaml', 'warn': True},
         {'source': '~/connection_config.yaml', 'warn': True},
@@ -109,24 +131,36 @@ class Config(object):
         cfg = {}
         config_path = self._find_config_file()
         try:
-            with open(config_path) as f:
-                cfg = yaml.safe_load(f.read())
-        except IOError:
+            stat = os.stat(config_path)
+            # Parsed configs are kept for the process, and parsed again only
+            # when the file changes
+            version = (stat.st_ino, stat.st_size, stat.st_mtime)
+            cached = self._parsed.get(config_path)
+            if cached and cached[0] == version:
+                cfg = cached[1]
+            else:
+                import yaml
+                with open(config_path) as f:
+                    cfg = yaml.safe_load(f.read())
+                self._parsed[config_path] = (version, cfg)
+        except (IOError, OSError):
             logger().warn(
                 "Unable to read configuration file {config_path}.".format(
                     config_path=config_path))
 
-        return cfg
+        # Callers update the config they get
+        return copy(cfg) if isinstance(cfg, dict) else cfg
 
 
 class _ContainerView(object):
 
-    def __init__(self, obj_type, service_instance):
+    def __init__(self, obj_type, service_instance, container=None):
         self.si = service_instance
         self.obj_type = obj_type
+        self.container = container
 
     def __enter__(self):
-        container = self.si.content.rootFolder
+        container = self.container or self.si.content.rootFolder
         self.view_ref = self.si.content.viewManager.CreateContainerView(
             container=container,
             type=self.obj_type,
@@ -138,6 +172,542 @@ class _ContainerView(object):
         self.view_ref.Destroy()
 
 
+@contextmanager
+def _locked_cache_file(path):
+    """
+        Lock a file shared between operations, creating its directory.
+        The body still runs unlocked if the file cannot be locked.
+    """
+    lock = None
+    try:
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        lock = locked_file(path)
+        lock.__enter__()
+    except (IOError, OSError) as err:
+        lock = None
+        logger().debug('{path} cannot be locked: {err}'.format(
+            path=path, err=text_type(err)))
+    try:
+        yield
+    finally:
+        if lock is not None:
+            lock.__exit__(None, None, None)
+
+
+class _InventorySnapshot(object):
+    """
+        On-disk copy of the properties collected for one entity type, so
+        that operations running within ttl seconds of each other do not all
+        retrieve the same inventory.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+
+    def locked(self):
+        """
+            Hold the snapshot while it is loaded, and refreshed if needed, so
+            that concurrent operations retrieve the inventory only once.
+        """
+        return _locked_cache_file(self.path)
+
+    def load(self, props, stub):
+        try:
+            with open(self.path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (IOError, OSError, ValueError):
+            return None
+        if snapshot.get('properties') != list(props) or \
+                time.time() - snapshot.get('created', 0) > self.ttl:
+            return None
+        return [
+            {key: self._load_value(value, stub)
+             for key, value in properties.items()}
+            for properties in snapshot['objects']
+        ]
+
+    def save(self, props, results):
+        try:
+            snapshot = {
+                'created': time.time(),
+                'properties': list(props),
+                'objects': [
+                    {key: self._dump_value(value)
+                     for key, value in properties.items()}
+                    for properties in results
+                ],
+            }
+        except TypeError:
+            # Only simple values and references can be stored
+            return
+        temp_path = '{path}.{pid}'.format(path=self.path, pid=os.getpid())
+        try:
+            with open(temp_path, 'w') as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError) as err:
+            logger().debug(
+                'Inventory snapshot {path} cannot be saved: {err}'.format(
+                    path=self.path, err=text_type(err)))
+
+    def invalidate(self):
+        try:
+            with locked_file(self.path):
+                os.remove(self.path)
+        except (IOError, OSError):
+            pass
+
+    def _dump_value(self, value):
+        if isinstance(value, VmomiSupport.ManagedObject):
+            return {'_moref': [type(value).__name__, value._moId]}
+        if isinstance(value, list):
+            return [self._dump_value(item) for item in value]
+        if value is None or isinstance(
+                value, (numbers.Number, string_types)):
+            return value
+        raise TypeError(type(value).__name__)
+
+    def _load_value(self, value, stub):
+        if isinstance(value, dict):
+            type_name, obj_id = value['_moref']
+            return VmomiSupport.GetVmodlType(type_name)(obj_id, stub)
+        if isinstance(value, list):
+            return [self._load_value(item, stub) for item in value]
+        return value
+
+
+class _SessionCache(object):
+    """
+        vCenter session cookie saved on disk, so that operations connecting
+        to the same vCenter as the same user share one login.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def locked(self):
+        # Only one operation logs in when the session has expired
+        return _locked_cache_file(self.path)
+
+    def load(self):
+        try:
+            with open(self.path) as session_file:
+                session = json.load(session_file)
+            return session['cookie'], session['version']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, stub):
+        temp_path = '{path}.{pid}'.format(path=self.path, pid=os.getpid())
+        try:
+            # The cookie is as good as the password, keep it private
+            session_file = os.fdopen(os.open(
+                temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w')
+            with session_file:
+                json.dump({'cookie': stub.cookie, 'version': stub.version},
+                          session_file)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError) as err:
+            logger().debug(
+                'Session {path} cannot be saved: {err}'.format(
+                    path=self.path, err=text_type(err)))
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except (IOError, OSError):
+            pass
+
+
+class _PlacementReservations(object):
+    """
+        Resources chosen by placements whose clones have not finished yet,
+        saved on disk so that concurrent operations placing servers on the
+        same vCenter count them. Reservations expire after ttl seconds.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+
+    def locked(self):
+        return _locked_cache_file(self.path)
+
+    def load(self):
+        """
+            Get the live reservations by reservation ID.
+        """
+        try:
+            with open(self.path) as reservations_file:
+                reservations = json.load(reservations_file)
+        except (IOError, OSError, ValueError):
+            return {}
+        now = time.time()
+        return {
+            reservation_id: reservation
+            for reservation_id, reservation in reservations.items()
+            if isinstance(reservation, dict) and
+            reservation.get('expires', 0) > now
+        }
+
+    def reserve(self, reservation_id, host, datastore, cpus, memory, disk):
+        with self.locked():
+            self.add(reservation_id, host, datastore, cpus, memory, disk)
+
+    def add(self, reservation_id, host, datastore, cpus, memory, disk):
+        """
+            Save a reservation, for callers which already hold locked(),
+            e.g. while choosing the host it is for.
+        """
+        reservations = self.load()
+        reservations[reservation_id] = {
+            'host': host,
+            'datastore': datastore,
+            'cpus': cpus,
+            'memory': memory,
+            'disk': disk,
+            'expires': time.time() + self.ttl,
+        }
+        self._save(reservations)
+
+    def release(self, reservation_id):
+        with self.locked():
+            reservations = self.load()
+            reservations.pop(reservation_id, None)
+            self._save(reservations)
+
+    def usage(self, exclude=None):
+        """
+            Get the reserved HostUsage by host ID, and the reserved disk
+            space in bytes by datastore ID, leaving out the reservation
+            with ID exclude.
+        """
+        hosts = {}
+        datastores = {}
+        for reservation_id, reservation in self.load().items():
+            if reservation_id == exclude:
+                continue
+            memory, cpus = hosts.get(reservation['host'], (0, 0))
+            hosts[reservation['host']] = HostUsage(
+                memory + reservation['memory'], cpus + reservation['cpus'])
+            datastores[reservation['datastore']] = \
+                datastores.get(reservation['datastore'], 0) + \
+                reservation['disk']
+        return hosts, datastores
+
+    def _save(self, reservations):
+        temp_path = '{path}.{pid}'.format(path=self.path, pid=os.getpid())
+        try:
+            with open(temp_path, 'w') as reservations_file:
+                json.dump(reservations, reservations_file)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError) as err:
+            logger().debug(
+                'Placement reservations {path} cannot be saved: {err}'.format(
+                    path=self.path, err=text_type(err)))
+
+
+class _FinishedTask(object):
+    """
+        A task found in the task history after the server removed it,
+        with the same _moId and info as the task had.
+    """
+
+    def __init__(self, info):
+        self._moId = info.task._moId
+        self.info = info
+
+
+class _PropertyStore(object):
+    """
+        Raw properties collected so far for every object of one type, so
+        that asking for more properties only retrieves the missing ones.
+    """
+
+    def __init__(self):
+        self.paths = set()
+        self.objects = OrderedDict()
+        # Objects to collect again, because they changed or were not there
+        # when some of the paths were collected
+        self.stale = set()
+
+
+class _ScopeState(object):
+    """Entity caches of one collection scope, see VsphereClient._scoped."""
+
+    def __init__(self):
+        self.cache = {}
+        # VM properties behind the projections, see _get_vm_projection
+        self.vm_properties = _PropertyStore()
+        # Incremental cache filters by entity name, see _get_tracked_entity
+        self.tracked = {}
+
+
+class _TrackedEntities(object):
+    """
+        Properties of the objects of one entity type, kept up to date from
+        the updates reported for a property collector filter.
+    """
+
+    def __init__(self, view_ref, filter_ref):
+        self.view_ref = view_ref
+        self.filter_ref = filter_ref
+        # Object ID to properties, in the order the objects were reported
+        self.objects = OrderedDict()
+        # IDs of the objects which changed since the records were updated
+        self.changed = OrderedDict()
+        # IDs of the objects of the other entities of the scope which
+        # changed since then, for the records which map to them
+        self.changed_elsewhere = set()
+        # Records of the objects, updated in place, see _get_tracked_entity
+        self.results = None
+
+    def apply(self, object_update):
+        obj_id = object_update.obj._moId
+        self.changed[obj_id] = None
+
+        if object_update.kind == 'leave':
+            self.objects.pop(obj_id, None)
+            return
+
+        if object_update.kind == 'enter':
+            self.objects[obj_id] = {}
+        properties = self.objects.setdefault(obj_id, {})
+        properties['obj'] = object_update.obj
+        for change in object_update.changeSet or []:
+            if change.op in ('remove', 'indirectRemove'):
+                properties.pop(change.name, None)
+            else:
+                properties[change.name] = change.val
+
+
+class _EntityList(list):
+    """
+        List of cached platform entities, indexed by ID and by lower case
+        name. The indexes are built on the first lookup.
+    """
+
+    _by_id = None
+    _by_name = None
+    _positions = None
+
+    @property
+    def by_id(self):
+        if self._by_id is None:
+            self._by_id = {}
+            for entity in self:
+                # The first entity found wins, as it would with a list scan
+                self._by_id.setdefault(entity.id, entity)
+        return self._by_id
+
+    @property
+    def by_name(self):
+        if self._by_name is None:
+            self._by_name = {}
+            for entity in self:
+                # Names are not unique, e.g. between datacenters
+                self._by_name.setdefault(
+                    entity.name.lower(), []).append(entity)
+        return self._by_name
+
+    @property
+    def positions(self):
+        """
+            Position of each entity ID. The first entity with an ID wins,
+            as it would with a list scan.
+        """
+        if self._positions is None:
+            self._positions = {}
+            for position, entity in enumerate(self):
+                self._positions.setdefault(entity.id, position)
+        return self._positions
+
+    def add(self, entity):
+        """
+            Append entity, and add it to the indexes built so far.
+        """
+        self.append(entity)
+        if self._by_id is not None:
+            self._by_id.setdefault(entity.id, entity)
+        if self._positions is not None:
+            self._positions.setdefault(entity.id, len(self) - 1)
+        if self._by_name is not None:
+            self._by_name.setdefault(
+                entity.name.lower(), []).append(entity)
+
+    def replace(self, position, entity):
+        """
+            Replace the entity at position with a newer record of the same
+            object, and update the indexes built so far.
+        """
+        old = self[position]
+        self[position] = entity
+        if self._by_id is not None and self._by_id.get(old.id) is old:
+            self._by_id[entity.id] = entity
+        if self._by_name is not None:
+            if old.name.lower() == entity.name.lower():
+                named = self._by_name[old.name.lower()]
+                for index, named_entity in enumerate(named):
+                    if named_entity is old:
+                        named[index] = entity
+            else:
+                # Renames are rare, so the index is built again
+                self._by_name = None
+
+
+class _ResourcePoolList(_EntityList):
+    """
+        Cached resource pools, with the descendants of each pool computed
+        once.
+    """
+
+    def __init__(self, *args):
+        super(_ResourcePoolList, self).__init__(*args)
+        self._descendants = {}
+
+    def descendants(self, pool):
+        """
+            All of the pools below pool, each pool followed by its own
+            descendants.
+        """
+        if pool.id not in self._descendants:
+            descendants = []
+            stack = list(reversed(pool.resourcePool))
+            while stack:
+                child = stack.pop()
+                descendants.append(child)
+                stack.extend(reversed(child.resourcePool))
+            self._descendants[pool.id] = descendants
+        return list(self._descendants[pool.id])
+
+
+class _MappingResolver(object):
+    """
+        Loads the entities for one of the other entity mappings of a query
+        the first time any of the objects built by that query needs them,
+        so that all of those objects share a single fetch, and a single
+        index of the entities by ID.
+    """
+
+    def __init__(self, loader=None, entities=None):
+        self._loader = loader
+        self._entities = entities
+        self._positions = None
+        # Entities given up front are mapped when each object is built
+        self.eager = loader is None
+
+    @property
+    def entities(self):
+        if self._entities is None:
+            self._entities = self._loader()
+        return self._entities
+
+    @property
+    def positions(self):
+        """
+            Position of each entity ID in entities. The first entity with
+            an ID wins, as it would with a list scan.
+        """
+        if isinstance(self.entities, _EntityList):
+            # Cached lists keep this index between queries
+            return self.entities.positions
+        if self._positions is None:
+            self._positions = {}
+            for position, entity in enumerate(self.entities):
+                self._positions.setdefault(entity.id, position)
+        return self._positions
+
+
+class _LazyMapping(object):
+    """
+        Placeholder for the entities a cached object refers to, which are
+        looked up when the attribute is first accessed.
+    """
+
+    def __init__(self, resolve):
+        self._resolve = resolve
+        self._resolved = False
+        self._value = None
+
+    def resolve(self):
+        if not self._resolved:
+            self._value = self._resolve()
+            self._resolved = True
+            self._resolve = None
+        return self._value
+
+    def __repr__(self):
+        if self._resolved:
+            return repr(self._value)
+        return '<unresolved mapping>'
+
+
+def _resolve_lazy(value):
+    if isinstance(value, _LazyMapping):
+        return value.resolve()
+    return value
+
+
+def _lazy_getitem(record, index):
+    if isinstance(index, slice):
+        return tuple(record)[index]
+    return _resolve_lazy(tuple.__getitem__(record, index))
+
+
+def _lazy_iter(record):
+    for value in tuple.__iter__(record):
+        yield _resolve_lazy(value)
+
+
+def _lazy_field(field):
+    def get(record):
+        return _resolve_lazy(field.__get__(record, type(record)))
+    return property(get, doc=field.__doc__)
+
+
+def _make_lazy_record_type(record_type, lazy_keys):
+    """
+        Subclass a namedtuple so that the given fields resolve their
+        _LazyMapping on access, by attribute, by index or by iterating
+        over the record, as _asdict and _replace do.
+    """
+    attrs = {
+        '__slots__': (),
+        '__getitem__': _lazy_getitem,
+        '__iter__': _lazy_iter,
+    }
+    for key in lazy_keys:
+        attrs[key] = _lazy_field(getattr(record_type, key))
+    return type(record_type.__name__, (record_type,), attrs)
+
+
+# Record classes for cached objects, keyed by name, fields and lazy fields
+_record_types = {}
+
+
+def _get_record_type(obj_name, fields, lazy_fields=()):
+    """
+        Get the record class for cached objects with these fields, so that
+        all objects of the same shape share one class.
+    """
+    key = (obj_name, fields, lazy_fields)
+    record_type = _record_types.get(key)
+    if record_type is None:
+        record_type = namedtuple(obj_name, fields)
+        if lazy_fields:
+            record_type = _make_lazy_record_type(record_type, lazy_fields)
+        _record_types[key] = record_type
+    return record_type
+
+
+# Memory (MB) and vCPUs assigned to the VMs of a host, as aggregated by
+# VsphereClient._get_host_usage
+HostUsage = namedtuple('HostUsage', ['memory', 'cpus'])
+
+
 class CustomValues(MutableMapping):
     """dict interface to ManagedObject customValue"""
 
@@ -193,13 +763,168 @@ class CustomValues(MutableMapping):
         raise ValueError(k)
 
 
+def _datacenter_scoped(method):
+    """
+        Collect the entities used by method only under the datacenter named
+        by its datacenter_name argument.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        datacenter_name = getcallargs(
+            method, self, *args, **kwargs).get('datacenter_name')
+        with self._datacenter_scope(datacenter_name):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class VsphereClient(object):
 
+    # Type and properties collected for each cached platform entity,
+    # keyed by cache name
+    _entity_properties = {
+        'vm_folder': (vim.Folder, ['name', 'parent']),
+        'cluster': (vim.ClusterComputeResource, ['name', 'resourcePool']),
+        'datacenter': (vim.Datacenter, ['name', 'vmFolder']),
+        'datastore': (vim.Datastore, [
+            'name',
+            'overallStatus',
+            'summary.accessible',
+            'summary.freeSpace',
+        ]),
+        'resource_pool': (vim.ResourcePool, ['name', 'resourcePool']),
+        'network': (vim.Network, ['name', 'host']),
+        'dv_pg_extra_detail': (vim.dvs.DistributedVirtualPortgroup, [
+            'key',
+            'config.distributedVirtualSwitch',
+        ]),
+        'dvswitch': (vim.dvs.VmwareDistributedVirtualSwitch,
+                     ['name', 'uuid']),
+        'vm': (vim.VirtualMachine, [
+            'name',
+            'summary',
+            'config.hardware.device',
+            'config.hardware.memoryMB',
+            'config.hardware.numCPU',
+            'datastore',
+            'guest.guestState',
+            'guest.net',
+            'network',
+        ]),
+        'compute': (vim.ComputeResource, ['name', 'resourcePool']),
+        'host': (vim.HostSystem, [
+            'name',
+            'parent',
+            'hardware.memorySize',
+            'hardware.cpuInfo.numCpuThreads',
+            'overallStatus',
+            'network',
+            'summary.runtime.connectionState',
+            'summary.runtime.inMaintenanceMode',
+            'vm',
+            'datastore',
+            'config.network.vswitch',
+            'configManager',
+        ]),
+    }
+
+    # Entities which can be kept up to date by the incremental cache
+    _trackable_entities = (
+        'vm_folder',
+        'cluster',
+        'datacenter',
+        'datastore',
+        'dvswitch',
+        'vm',
+        'compute',
+        'host',
+    )
+
+    # Named subsets of the VM properties, for callers which do not need
+    # all of them. identity is always included.
+    _vm_projections = {
+        'identity': ['name'],
+        'placement': ['datastore', 'network'],
+        'hardware': [
+            'config.hardware.device',
+            'config.hardware.memoryMB',
+            'config.hardware.numCPU',
+        ],
+        'guest': ['guest.guestState', 'guest.net'],
+        'summary': ['summary'],
+    }
+
+    # VM properties aggregated by _get_host_usage
+    _vm_capacity_properties = [
+        'runtime.host',
+        'summary.config.numCpu',
+        'summary.config.memorySizeMB',
+        'summary.config.template',
+    ]
+
+    # Task properties watched while waiting for tasks
+    _task_properties = ['info.state', 'info.error', 'info.result']
+
     def __init__(self, ctx_logger=None):
         self.cfg = {}
-        self._cache = {}
+        # Container of the collections, None for the whole inventory
+        self._scope = None
+        self._scopes = {}
+        # Property lists converted by _get_props_dict
+        self._props_dicts = {}
+        # Results of the last batched collection, consumed by
+        # _collect_properties
+        self._collected = {}
+        # Incremental cache state, see _get_tracked_entity
+        self._update_collector = None
+        self._update_version = ''
         self._logger = ctx_logger or logger()
 
+    @property
+    def _scope_state(self):
+        scope_id = self._scope._moId if self._scope is not None else None
+        state = self._scopes.get(scope_id)
+        if state is None:
+            state = self._scopes[scope_id] = _ScopeState()
+        return state
+
+    @property
+    def _cache(self):
+        return self._scope_state.cache
+
+    @property
+    def _vm_properties(self):
+        return self._scope_state.vm_properties
+
+    @_vm_properties.setter
+    def _vm_properties(self, vm_properties):
+        self._scope_state.vm_properties = vm_properties
+
+    @contextmanager
+    def _scoped(self, scope):
+        """
+            Collect entities only under scope, a managed object such as a
+            datacenter, or from the whole inventory if scope is None.
+            Each scope has caches of its own.
+        """
+        previous = self._scope
+        self._scope = scope
+        try:
+            yield
+        finally:
+            self._scope = previous
+
+    @contextmanager
+    def _datacenter_scope(self, datacenter_name):
+        """
+            Collect entities only under the named datacenter, or keep the
+            current scope if there is no such datacenter.
+        """
+        datacenter = None
+        if datacenter_name:
+            datacenter = self._get_obj_by_name(vim.Datacenter, datacenter_name)
+        with self._scoped(datacenter.obj if datacenter else self._scope):
+            yield
+
     def get(self, config=None, *_, **__):
         static_config = Config().get()
         self.cfg.update(static_config)
@@ -297,17 +1022,23 @@ class VsphereClient(object):
                     'from the same blueprint running with reduced '
                     'security.'
                 )
-                self.si = SmartConnectNoSSL(host=host,
-                                            user=username,
-                                            pwd=password,
-                                            port=int(port))
-            else:
-                self.si = SmartConnect(host=host,
-                                       user=username,
-                                       pwd=password,
-                                       port=int(port),
-                                       sslContext=ssl_context)
-            atexit.register(Disconnect, self.si)
+            version_path = self._get_api_version_path(cfg)
+            session = self._get_session_cache(cfg)
+            if not session:
+                self.si = self._login(host, username, password, port,
+                                      allow_insecure, ssl_context,
+                                      version_path)
+                atexit.register(Disconnect, self.si)
+                return self
+            # The saved session is shared, so it is not logged out at exit
+            with session.locked():
+                self.si = self._reattach_session(
+                    session, host, port, allow_insecure, ssl_context)
+                if not self.si:
+                    self.si = self._login(host, username, password, port,
+                                          allow_insecure, ssl_context,
+                                          version_path)
+                    session.save(self.si._stub)
             return self
         except vim.fault.InvalidLogin:
             raise NonRecoverableError(
@@ -326,6 +1057,133 @@ class VsphereClient(object):
             else:
                 raise
 
+    def _login(self, host, username, password, port, allow_insecure,
+               ssl_context, version_path=None):
+        """
+            Log in with the API version saved in version_path by an earlier
+            connection to this vCenter, and negotiate it again if it is not
+            known yet or the server does not accept it any more.
+        """
+        version = None
+        if version_path:
+            try:
+                with open(version_path) as version_file:
+                    version = version_file.read().strip()
+            except (IOError, OSError):
+                pass
+
+        if version:
+            try:
+                return Connect(host=host,
+                               user=username,
+                               pwd=password,
+                               port=int(port),
+                               version=version,
+                               sslContext=(
+                                   ssl._create_unverified_context()
+                                   if allow_insecure else ssl_context))
+            except vim.fault.InvalidLogin:
+                raise
+            except (vmodl.MethodFault, HTTPException) as err:
+                self._logger.debug(
+                    'API version {version} was rejected, negotiating it '
+                    'again: {err}'.format(version=version,
+                                          err=text_type(err)))
+                try:
+                    os.remove(version_path)
+                except (IOError, OSError):
+                    pass
+                version = None
+
+        if allow_insecure:
+            si = SmartConnectNoSSL(host=host,
+                                   user=username,
+                                   pwd=password,
+                                   port=int(port))
+        else:
+            si = SmartConnect(host=host,
+                              user=username,
+                              pwd=password,
+                              port=int(port),
+                              sslContext=ssl_context)
+        if version_path and si._stub.version != version:
+            temp_path = '{path}.{pid}'.format(
+                path=version_path, pid=os.getpid())
+            try:
+                version_dir = os.path.dirname(version_path)
+                if not os.path.isdir(version_dir):
+                    os.makedirs(version_dir, 0o700)
+                with open(temp_path, 'w') as version_file:
+                    version_file.write(si._stub.version)
+                os.rename(temp_path, version_path)
+            except (IOError, OSError) as err:
+                self._logger.debug(
+                    'API version cannot be saved: {err}'.format(
+                        err=text_type(err)))
+        return si
+
+    def _get_api_version_path(self, cfg):
+        """
+            Get the file keeping the API version negotiated with this host
+            and port, or None if versions are not saved between connections.
+        """
+        if not cfg.get('api_version_cache'):
+            return None
+        return os.path.join(
+            os.path.expanduser(
+                cfg.get('api_version_cache_dir') or API_VERSION_CACHE_DIR),
+            re.sub(r'[^\w.-]', '_', '{host}_{port}'.format(
+                host=cfg.get('host'), port=cfg.get('port', 443))))
+
+    def _get_session_cache(self, cfg):
+        """
+            Get the saved session for this host, port and username, or None
+            if sessions are not shared between operations.
+        """
+        if not cfg.get('session_cache'):
+            return None
+        name = re.sub(r'[^\w.@-]', '_', '{host}_{port}_{user}'.format(
+            host=cfg.get('host'),
+            port=cfg.get('port', 443),
+            user=cfg.get('username'),
+        ))
+        return _SessionCache(os.path.join(
+            os.path.expanduser(
+                cfg.get('session_cache_dir') or SESSION_CACHE_DIR),
+            '{name}.json'.format(name=name),
+        ))
+
+    def _reattach_session(self, session, host, port, allow_insecure,
+                          ssl_context):
+        """
+            Connect with the saved session cookie, if the session is still
+            logged in.
+        """
+        saved = session.load()
+        if not saved:
+            return None
+        cookie, version = saved
+        if allow_insecure:
+            ssl_context = ssl._create_unverified_context()
+        stub = SoapStubAdapter(host=host,
+                               port=int(port),
+                               version=version,
+                               sslContext=ssl_context)
+        stub.cookie = cookie
+        si = vim.ServiceInstance('ServiceInstance', stub)
+        try:
+            if si.content.sessionManager.currentSession:
+                self._logger.debug('Reusing the saved vSphere session.')
+                return si
+        except (vmodl.MethodFault, HTTPException, socket.error,
+                ssl.SSLError) as err:
+            # Logging in again reports any lasting connection error
+            self._logger.debug(
+                'Saved vSphere session cannot be used: {err}'.format(
+                    err=text_type(err)))
+        session.discard()
+        return None
+
     def is_server_suspended(self, server):
         return server.summary.runtime.powerState.lower() == "suspended"
 
@@ -356,6 +1214,17 @@ class VsphereClient(object):
             )
         return the_dict
 
+    def _get_props_dict(self, props_list):
+        """
+            _convert_props_list_to_dict, converting each list only once.
+        """
+        key = tuple(props_list)
+        props_dict = self._props_dicts.get(key)
+        if props_dict is None:
+            props_dict = self._convert_props_list_to_dict(props_list)
+            self._props_dicts[key] = props_dict
+        return props_dict
+
     def _merge_props_dicts(self, dict1, dict2):
         new_dict = {}
         keys = set(list(dict1.keys()) + list(dict2.keys()))
@@ -396,11 +1265,7 @@ class VsphereClient(object):
         object_keys.extend(props_dict.get('_values', []))
         if root_object:
             object_keys.extend(['id', 'obj'])
-        object_keys = set(object_keys)
-        obj = namedtuple(
-            obj_name,
-            object_keys,
-        )
+        object_keys = tuple(sorted(set(object_keys)))
 
         args = {}
         for key in props_dict.get('_values', []):
@@ -409,41 +1274,33 @@ class VsphereClient(object):
             args['id'] = platform_results['obj']._moId
             args['obj'] = platform_results['obj']
 
+        lazy_keys = []
         if root_object and other_entity_mappings:
             for map_type in ('static', 'dynamic', 'single'):
                 mappings = other_entity_mappings.get(map_type, {})
                 for mapping, other_entities in mappings.items():
                     if map_type == 'single':
-                        mapped = None
-                        map_id = args[mapping]._moId
-                        for entity in other_entities:
-                            if entity.id == map_id:
-                                mapped = entity
-                                break
+                        map_ids = args[mapping]._moId
                     else:
-                        mapping_ids = [
+                        map_ids = [
                             map_obj._moId for map_obj in args[mapping]
                         ]
 
-                        mapped = [
-                            other_entity for other_entity in other_entities
-                            if other_entity.id in mapping_ids
-                        ]
-
-                        if map_type == 'static' and \
-                                len(mapped) != len(args[mapping]):
-                            mapped = None
-
-                    if mapped is None:
-                        raise OperationRetry(
-                            'Platform {entity} configuration changed '
-                            'while building {obj_name} cache.'.format(
-                                entity=mapping,
-                                obj_name=obj_name,
-                            )
+                    if not isinstance(other_entities, _MappingResolver):
+                        other_entities = _MappingResolver(
+                            entities=other_entities)
+                    if other_entities.eager:
+                        args[mapping] = self._map_other_entities(
+                            obj_name, map_type, mapping, map_ids,
+                            other_entities,
                         )
-
-                    args[mapping] = mapped
+                    else:
+                        args[mapping] = _LazyMapping(partial(
+                            self._map_other_entities,
+                            obj_name, map_type, mapping, map_ids,
+                            other_entities,
+                        ))
+                        lazy_keys.append(mapping)
 
         for key in just_keys:
             sub_object_name = '{name}_{sub}'.format(
@@ -463,185 +1320,517 @@ class VsphereClient(object):
         if 'name' in args:
             args['name'] = self._get_normalised_name(args['name'], False)
 
+        obj = _get_record_type(obj_name, object_keys, tuple(lazy_keys))
+
         result = obj(
             **args
         )
 
         return result
 
+    def _map_other_entities(self, obj_name, map_type, mapping, map_ids,
+                            resolver):
+        positions = resolver.positions
+        if map_type == 'single':
+            mapped = None
+            if map_ids in positions:
+                mapped = resolver.entities[positions[map_ids]]
+        else:
+            # Keep the order of the other entities, as a scan would
+            mapped = [
+                resolver.entities[position] for position in sorted(set(
+                    positions[map_id] for map_id in map_ids
+                    if map_id in positions
+                ))
+            ]
+
+            if map_type == 'static' and len(mapped) != len(map_ids):
+                mapped = None
+
+        if mapped is None:
+            raise OperationRetry(
+                'Platform {entity} configuration changed '
+                'while building {obj_name} cache.'.format(
+                    entity=mapping,
+                    obj_name=obj_name,
+                )
+            )
+
+        return mapped
+
+    def _make_mapping_resolvers(self, other_entity_mappings):
+        if not other_entity_mappings:
+            return other_entity_mappings
+        # Loaders are shared by every object of this query, so the
+        # other entities are fetched at most once, and only if needed.
+        # They run against the scope and the cached entities of the query,
+        # however late the objects are read.
+        scope = self._scope
+        cache = dict(self._cache)
+        return {
+            map_type: {
+                mapping: (
+                    _MappingResolver(partial(
+                        self._load_mapped_entities, scope, cache, loader))
+                    if callable(loader)
+                    else _MappingResolver(entities=loader))
+                for mapping, loader in mappings.items()
+            }
+            for map_type, mappings in other_entity_mappings.items()
+        }
+
+    def _load_mapped_entities(self, scope, cache, loader):
+        """
+            Run the loader of a mapping in the scope its objects were built
+            in, with the entities that were cached when they were built.
+            Anything else the loader collects is kept in the scope cache.
+        """
+        with self._scoped(scope):
+            state = self._scope_state
+            current = state.cache
+            state.cache = dict(current)
+            state.cache.update(cache)
+            try:
+                return loader()
+            finally:
+                loaded = state.cache
+                state.cache = current
+                for key, value in loaded.items():
+                    if cache.get(key) is not value:
+                        current[key] = value
+
+    def _build_cached_object(self, entity_name, props_dict, result,
+                             other_entity_mappings, skip_broken_objects):
+        """
+            Make the cached object for one platform result, or return None
+            if it is broken and skip_broken_objects is set.
+        """
+        try:
+            return self._make_cached_object(
+                obj_name=entity_name,
+                props_dict=props_dict,
+                platform_results=result,
+                other_entity_mappings=other_entity_mappings,
+            )
+        except KeyError as err:
+            message = (
+                'Could not retrieve all details for {type} object. '
+                '{err} was missing.'.format(
+                    type=entity_name,
+                    err=text_type(err)
+                )
+            )
+            if hasattr(result, 'name'):
+                message += (
+                    ' Object name was {name}.'.format(name=result.name)
+                )
+            if hasattr(result, '_moId'):
+                message += (
+                    ' Object ID was {id}.'.format(id=result._moId)
+                )
+            if skip_broken_objects:
+                self._logger.warn(message)
+            else:
+                raise NonRecoverableError(message)
+
     def _get_entity(self,
                     entity_name,
                     props,
                     vimtype,
                     use_cache=True,
                     other_entity_mappings=None,
-                    skip_broken_objects=False):
+                    skip_broken_objects=False,
+                    object_id=None):
 
         if entity_name in self._cache and use_cache:
+            if object_id:
+                entity = self._cache[entity_name].by_id.get(object_id)
+                return [entity] if entity else []
             return self._cache[entity_name]
 
-        platform_results = self._collect_properties(
-            vimtype,
-            path_set=props,
-        )
+        if self._incremental_cache_enabled() and (
+                entity_name in self._scope_state.tracked or not object_id):
+            results = self._get_tracked_entity(
+                entity_name, props, vimtype, other_entity_mappings,
+                skip_broken_objects)
+            if object_id:
+                entity = results.by_id.get(object_id)
+                return [entity] if entity else []
+            return results
+
+        snapshot = None
+        if not object_id:
+            snapshot = self._get_inventory_snapshot(entity_name)
+        if snapshot:
+            with snapshot.locked():
+                platform_results = None
+                if use_cache:
+                    platform_results = snapshot.load(props, self.si._stub)
+                if platform_results is None:
+                    platform_results = self._collect_properties(
+                        vimtype,
+                        path_set=props,
+                    )
+                    snapshot.save(props, platform_results)
+        else:
+            platform_results = self._collect_properties(
+                vimtype,
+                path_set=props,
+                object_id=object_id,
+                stream=True,
+            )
 
-        props_dict = self._convert_props_list_to_dict(props)
+        props_dict = self._get_props_dict(props)
+        other_entity_mappings = self._make_mapping_resolvers(
+            other_entity_mappings)
 
         results = []
         for result in platform_results:
+            entity = self._build_cached_object(
+                entity_name, props_dict, result, other_entity_mappings,
+                skip_broken_objects)
+            if entity is not None:
+                results.append(entity)
+
+        if object_id:
+            # Only one object was retrieved, so just refresh it in an
+            # existing cache instead of replacing the whole cache.
+            if entity_name in self._cache:
+                self._cache[entity_name] = _EntityList([
+                    entity for entity in self._cache[entity_name]
+                    if entity.id != object_id
+                ] + results)
+            return results
+
+        results = _EntityList(results)
+        self._cache[entity_name] = results
+
+        return results
+
+    def _get_inventory_snapshot(self, entity_name):
+        """
+            Get the on-disk snapshot for entity_name, or None if snapshots
+            are disabled or this entity type should stay live.
+        """
+        if not self.cfg.get('snapshot_cache'):
+            return None
+        ttl = dict(SNAPSHOT_CACHE_TTL)
+        ttl.update(self.cfg.get('snapshot_cache_ttl') or {})
+        if not ttl.get(entity_name, 0) > 0:
+            return None
+
+        vcenter = re.sub(r'[^\w.-]', '_', '{host}_{port}'.format(
+            host=self.cfg.get('host'),
+            port=self.cfg.get('port', 443),
+        ))
+        if self._scope is not None:
+            vcenter = os.path.join(vcenter, self._scope._moId)
+        return _InventorySnapshot(
+            path=os.path.join(
+                os.path.expanduser(
+                    self.cfg.get('snapshot_cache_dir') or SNAPSHOT_CACHE_DIR),
+                vcenter,
+                '{name}.json'.format(name=entity_name),
+            ),
+            ttl=ttl[entity_name],
+        )
+
+    def _invalidate_snapshots(self, *entity_names):
+        """
+            Discard the on-disk snapshots of entity types changed by a task,
+            so that the next operation retrieves them again.
+            The snapshots taken within each datacenter are discarded too, as
+            the caller may not know which datacenters the change affects.
+        """
+        for entity_name in entity_names:
+            with self._scoped(None):
+                snapshot = self._get_inventory_snapshot(entity_name)
+            if not snapshot:
+                continue
+            snapshot.invalidate()
+            directory, name = os.path.split(snapshot.path)
             try:
-                results.append(
-                    self._make_cached_object(
-                        obj_name=entity_name,
-                        props_dict=props_dict,
-                        platform_results=result,
-                        other_entity_mappings=other_entity_mappings,
-                    )
-                )
-            except KeyError as err:
-                message = (
-                    'Could not retrieve all details for {type} object. '
-                    '{err} was missing.'.format(
-                        type=entity_name,
-                        err=text_type(err)
-                    )
-                )
-                if hasattr(result, 'name'):
-                    message += (
-                        ' Object name was {name}.'.format(name=result.name)
-                    )
-                if hasattr(result, '_moId'):
-                    message += (
-                        ' Object ID was {id}.'.format(id=result._moId)
-                    )
-                if skip_broken_objects:
-                    self._logger.warn(message)
-                else:
-                    raise NonRecoverableError(message)
+                scopes = os.listdir(directory)
+            except (IOError, OSError):
+                continue
+            for scope in scopes:
+                if os.path.isdir(os.path.join(directory, scope)):
+                    _InventorySnapshot(
+                        path=os.path.join(directory, scope, name),
+                        ttl=snapshot.ttl,
+                    ).invalidate()
 
-        self._cache[entity_name] = results
+    def _incremental_cache_enabled(self):
+        return bool(self.cfg.get('incremental_cache'))
 
+    def _track_entities(self, entity_name, vimtype, props):
+        """
+            Start keeping the raw properties of entity_name up to date with
+            a property collector filter, for the objects in the current
+            scope. The objects are reported by the next _apply_updates.
+        """
+        tracked_entities = self._scope_state.tracked
+        if entity_name in tracked_entities:
+            return tracked_entities[entity_name]
+
+        if self._update_collector is None:
+            # A collector of our own, so that the versions only cover the
+            # filters created here.
+            self._update_collector = \
+                self.si.content.propertyCollector.CreatePropertyCollector()
+            self._update_version = ''
+            atexit.register(self._stop_tracking)
+
+        # The view must stay alive for as long as the filter is used
+        view_ref = self.si.content.viewManager.CreateContainerView(
+            container=(self._scope if self._scope is not None
+                       else self.si.content.rootFolder),
+            type=[vimtype],
+            recursive=True,
+        )
+        filter_ref = self._update_collector.CreateFilter(
+            self._make_filter_spec(
+                self._make_view_object_spec(view_ref), vimtype, props),
+            partialUpdates=False,
+        )
+        tracked = _TrackedEntities(view_ref, filter_ref)
+        tracked_entities[entity_name] = tracked
+        return tracked
+
+    def _iter_tracked(self):
+        for state in self._scopes.values():
+            for tracked in state.tracked.values():
+                yield tracked
+
+    def _apply_updates(self):
+        """
+            Apply every change reported since the last version to the
+            tracked entities, without waiting for new changes.
+        """
+        tracked_filters = {
+            tracked.filter_ref._moId: (state, tracked)
+            for state in self._scopes.values()
+            for tracked in state.tracked.values()
+        }
+        options = vmodl.query.PropertyCollector.WaitOptions()
+        options.maxWaitSeconds = 0
+        options.maxObjectUpdates = self._get_collector_page_size()
+
+        while True:
+            update_set = self._update_collector.WaitForUpdatesEx(
+                self._update_version, options)
+            if update_set is None:
+                # Nothing changed
+                return
+            self._update_version = update_set.version
+            for filter_update in update_set.filterSet or []:
+                found = tracked_filters.get(filter_update.filter._moId)
+                if found is None:
+                    continue
+                state, tracked = found
+                for object_update in filter_update.objectSet or []:
+                    tracked.apply(object_update)
+                    for other in state.tracked.values():
+                        if other is not tracked:
+                            other.changed_elsewhere.add(
+                                object_update.obj._moId)
+            if not update_set.truncated:
+                return
+
+    def _get_tracked_entity(self, entity_name, props, vimtype,
+                            other_entity_mappings, skip_broken_objects,
+                            record_name=None):
+        """
+            Get the entities from the incremental cache. Only the changes
+            since the previous call are retrieved, and only the records of
+            the objects which changed are rebuilt. They are updated in the
+            same list, so its indexes stay built. The records which map to
+            objects of other entities that changed are rebuilt as well, so
+            that their mappings resolve to the newer records.
+        """
+        tracked = self._track_entities(entity_name, vimtype, props)
+        self._apply_updates()
+
+        results = tracked.results
+        if results is None:
+            results = _EntityList()
+            changed = list(tracked.objects)
+        else:
+            changed = list(tracked.changed)
+            if other_entity_mappings and tracked.changed_elsewhere:
+                changed.extend(
+                    obj_id for obj_id, properties in tracked.objects.items()
+                    if obj_id not in tracked.changed and
+                    self._maps_to_any(properties, other_entity_mappings,
+                                      tracked.changed_elsewhere))
+        tracked.changed_elsewhere.clear()
+        if tracked.results is not None and not changed:
+            self._cache[entity_name] = results
+            return results
+
+        props_dict = self._get_props_dict(props)
+        other_entity_mappings = self._make_mapping_resolvers(
+            other_entity_mappings)
+
+        removed = set()
+        for obj_id in changed:
+            entity = None
+            if obj_id in tracked.objects:
+                entity = self._build_cached_object(
+                    record_name or entity_name, props_dict,
+                    tracked.objects[obj_id], other_entity_mappings,
+                    skip_broken_objects)
+            position = results.positions.get(obj_id)
+            if entity is None:
+                if position is not None:
+                    removed.add(position)
+            elif position is None:
+                results.add(entity)
+            else:
+                results.replace(position, entity)
+        if removed:
+            # A new list, as callers may be going through the current one
+            results = _EntityList(
+                entity for position, entity in enumerate(results)
+                if position not in removed)
+
+        tracked.changed.clear()
+        tracked.results = results
+        self._cache[entity_name] = results
         return results
 
-    def _build_resource_pool_object(self, base_pool_id, resource_pools):
+    def _maps_to_any(self, properties, other_entity_mappings, obj_ids):
+        """
+            Check if the mappings of a tracked object refer to any of the
+            objects in obj_ids.
+        """
+        for mappings in other_entity_mappings.values():
+            for mapping in mappings:
+                mapped = properties.get(mapping)
+                if mapped is None:
+                    continue
+                if isinstance(mapped, VmomiSupport.ManagedObject):
+                    mapped = [mapped]
+                if any(map_obj._moId in obj_ids for map_obj in mapped):
+                    return True
+        return False
+
+    def _stop_tracking(self):
+        if self._update_collector is None:
+            return
+        try:
+            # This also destroys the filters
+            self._update_collector.DestroyPropertyCollector()
+            for tracked in self._iter_tracked():
+                tracked.view_ref.Destroy()
+        except Exception as err:
+            self._logger.debug(
+                'Could not clean up the incremental cache: {err}'.format(
+                    err=text_type(err)))
+        self._update_collector = None
+        for state in self._scopes.values():
+            state.tracked = {}
+
+    def _build_resource_pool_tree(self, resource_pools):
+        """
+            Build every resource pool object in one pass. Each pool is
+            created once, and shared between the returned list and the
+            resourcePool children of its parent.
+        """
         rp_object = namedtuple(
             'resource_pool',
             ['name', 'resourcePool', 'id', 'obj'],
         )
 
-        this_pool = None
-        for pool in resource_pools:
-            if pool['obj']._moId == base_pool_id:
-                this_pool = pool
-                break
-        if this_pool is None:
-            raise OperationRetry(
-                'Resource pools changed while getting resource pool details.'
+        pools = _ResourcePoolList()
+        for item in resource_pools:
+            pool = rp_object(
+                name=self._get_normalised_name(item['name'], False),
+                id=item['obj']._moId,
+                resourcePool=[],
+                obj=item['obj'],
             )
+            pools.append(pool)
+
+        for item, pool in zip(resource_pools, pools):
+            for child in item['resourcePool']:
+                child_pool = pools.by_id.get(child._moId)
+                if child_pool is None:
+                    raise OperationRetry(
+                        'Resource pools changed while getting resource '
+                        'pool details.'
+                    )
+                pool.resourcePool.append(child_pool)
 
-        if 'name' in this_pool:
-            this_pool['name'] = self._get_normalised_name(this_pool['name'],
-                                                          False)
-
-        base_object = rp_object(
-            name=this_pool['name'],
-            id=this_pool['obj']._moId,
-            resourcePool=[],
-            obj=this_pool['obj'],
-        )
-
-        for item in this_pool['resourcePool']:
-            base_object.resourcePool.append(self._build_resource_pool_object(
-                base_pool_id=item._moId,
-                resource_pools=resource_pools,
-            ))
-
-        return base_object
+        return pools
 
     def _get_resource_pools(self, use_cache=True):
         if 'resource_pool' in self._cache and use_cache:
             return self._cache['resource_pool']
 
-        properties = [
-            'name',
-            'resourcePool',
-        ]
+        vimtype, properties = self._entity_properties['resource_pool']
 
         results = self._collect_properties(
-            vim.ResourcePool,
+            vimtype,
             path_set=properties,
         )
 
-        resource_pools = []
-        for item in results:
-            resource_pools.append(self._build_resource_pool_object(
-                base_pool_id=item['obj']._moId,
-                resource_pools=results
-            ))
-
+        resource_pools = self._build_resource_pool_tree(results)
         self._cache['resource_pool'] = resource_pools
 
         return resource_pools
 
-    def _get_vm_folders(self, use_cache=True):
-        properties = [
-            'name',
-            'parent'
-        ]
+    def _get_vm_folders(self, use_cache=True, object_id=None):
+        vimtype, properties = self._entity_properties['vm_folder']
 
         return self._get_entity(
             entity_name='vm_folder',
             props=properties,
-            vimtype=vim.Folder,
+            vimtype=vimtype,
             use_cache=use_cache,
+            object_id=object_id,
         )
 
-    def _get_clusters(self, use_cache=True):
-        properties = [
-            'name',
-            'resourcePool',
-        ]
+    def _get_clusters(self, use_cache=True, object_id=None):
+        vimtype, properties = self._entity_properties['cluster']
 
         return self._get_entity(
             entity_name='cluster',
             props=properties,
-            vimtype=vim.ClusterComputeResource,
+            vimtype=vimtype,
             use_cache=use_cache,
+            object_id=object_id,
             other_entity_mappings={
                 'single': {
-                    'resourcePool': self._get_resource_pools(
+                    'resourcePool': lambda: self._get_resource_pools(
                         use_cache=use_cache,
                     ),
                 },
             },
         )
 
-    def _get_datacenters(self, use_cache=True):
-        properties = [
-            'name',
-            'vmFolder',
-        ]
-
-        return self._get_entity(
-            entity_name='datacenter',
-            props=properties,
-            vimtype=vim.Datacenter,
-            use_cache=use_cache,
-        )
+    def _get_datacenters(self, use_cache=True, object_id=None):
+        vimtype, properties = self._entity_properties['datacenter']
+
+        # Datacenters are not inside any scope
+        with self._scoped(None):
+            return self._get_entity(
+                entity_name='datacenter',
+                props=properties,
+                vimtype=vimtype,
+                use_cache=use_cache,
+                object_id=object_id,
+            )
 
-    def _get_datastores(self, use_cache=True):
-        properties = [
-            'name',
-            'overallStatus',
-            'summary.accessible',
-            'summary.freeSpace',
-        ]
+    def _get_datastores(self, use_cache=True, object_id=None):
+        vimtype, properties = self._entity_properties['datastore']
 
         return self._get_entity(
             entity_name='datastore',
             props=properties,
-            vimtype=vim.Datastore,
-            use_cache=use_cache
+            vimtype=vimtype,
+            use_cache=use_cache,
+            object_id=object_id,
         )
 
     def _get_connected_network_name(self, network):
@@ -699,10 +1888,7 @@ class VsphereClient(object):
         if 'network' in self._cache and use_cache:
             return self._cache['network']
 
-        properties = [
-            'name',
-            'host',
-        ]
+        vimtype, properties = self._entity_properties['network']
         net_object = namedtuple(
             'network',
             ['name', 'id', 'host', 'obj'],
@@ -717,8 +1903,9 @@ class VsphereClient(object):
         )
 
         results = self._collect_properties(
-            vim.Network,
+            vimtype,
             path_set=properties,
+            stream=True,
         )
 
         extra_dv_port_group_details = self._get_extra_dv_port_group_details(
@@ -751,30 +1938,37 @@ class VsphereClient(object):
 
             networks.append(network)
 
+        networks = _EntityList(networks)
         self._cache['network'] = networks
+        # The filtered network lists are rebuilt from the new networks
+        self._cache.pop('dv_network', None)
+        self._cache.pop('standard_network', None)
 
         return networks
 
     def _get_dv_networks(self, use_cache=True):
-        return [
-            network for network in self._get_networks(use_cache)
-            if self._port_group_is_distributed(network)
-        ]
+        networks = self._get_networks(use_cache)
+        if 'dv_network' not in self._cache:
+            self._cache['dv_network'] = _EntityList(
+                network for network in networks
+                if self._port_group_is_distributed(network)
+            )
+        return self._cache['dv_network']
 
     def _get_standard_networks(self, use_cache=True):
-        return [
-            network for network in self._get_networks(use_cache)
-            if not self._port_group_is_distributed(network)
-        ]
+        networks = self._get_networks(use_cache)
+        if 'standard_network' not in self._cache:
+            self._cache['standard_network'] = _EntityList(
+                network for network in networks
+                if not self._port_group_is_distributed(network)
+            )
+        return self._cache['standard_network']
 
     def _get_extra_dv_port_group_details(self, use_cache=True):
         if 'dv_pg_extra_detail' in self._cache and use_cache:
             return self._cache['dv_pg_extra_detail']
 
-        properties = [
-            'key',
-            'config.distributedVirtualSwitch',
-        ]
+        vimtype, properties = self._entity_properties['dv_pg_extra_detail']
 
         config_object = namedtuple(
             'dv_port_group_config',
@@ -782,8 +1976,9 @@ class VsphereClient(object):
         )
 
         results = self._collect_properties(
-            vim.dvs.DistributedVirtualPortgroup,
+            vimtype,
             path_set=properties,
+            stream=True,
         )
 
         dvswitches = self._get_dvswitches(use_cache)
@@ -796,11 +1991,7 @@ class VsphereClient(object):
                 ctx.logger.info(
                     'Get extra DV port group details. '
                     'Ignoring item {item}'.format(item=item))
-            dvswitch = None
-            for dvs in dvswitches:
-                if dvswitch_id == dvs.id:
-                    dvswitch = dvs
-                    break
+            dvswitch = dvswitches.by_id.get(dvswitch_id)
             if dvswitch is None:
                 raise OperationRetry(
                     'DVswitches on platform changed while getting port '
@@ -816,152 +2007,293 @@ class VsphereClient(object):
 
         return extra_details
 
-    def _get_dvswitches(self, use_cache=True):
-        properties = [
-            'name',
-            'uuid',
-        ]
+    def _get_dvswitches(self, use_cache=True, object_id=None):
+        vimtype, properties = self._entity_properties['dvswitch']
 
         return self._get_entity(
             entity_name='dvswitch',
             props=properties,
-            vimtype=vim.dvs.VmwareDistributedVirtualSwitch,
+            vimtype=vimtype,
             use_cache=use_cache,
+            object_id=object_id,
         )
 
-    def _get_vms(self, use_cache=True, skip_broken_vms=True):
-        properties = [
-            'name',
-            'summary',
-            'config.hardware.device',
-            'config.hardware.memoryMB',
-            'config.hardware.numCPU',
-            'datastore',
-            'guest.guestState',
-            'guest.net',
-            'network',
-        ]
+    def _get_vms(self, use_cache=True, skip_broken_vms=True,
+                 object_id=None, projections=None):
+        """
+            Get the VMs. With projections (see _vm_projections) the VMs
+            only have the properties of those projections, unless all of
+            their properties are cached already.
+        """
+        vimtype, properties = self._entity_properties['vm']
+        cached = use_cache and 'vm' in self._cache
+        if object_id:
+            if self._vm_properties.paths and not cached:
+                # The VM is about to change, or has just changed
+                self._vm_properties.stale.add(object_id)
+                self._drop_vm_projections()
+        elif (projections or self._vm_properties.paths) and not cached \
+                and not self._get_inventory_snapshot('vm'):
+            return self._get_vm_projection(
+                projections or list(self._vm_projections),
+                use_cache,
+                skip_broken_vms,
+            )
 
         return self._get_entity(
             entity_name='vm',
             props=properties,
-            vimtype=vim.VirtualMachine,
+            vimtype=vimtype,
             use_cache=use_cache,
+            object_id=object_id,
             other_entity_mappings={
                 'static': {
-                    'network': self._get_networks(use_cache=use_cache),
-                    'datastore': self._get_datastores(use_cache=use_cache),
+                    'network': lambda: self._get_networks(
+                        use_cache=use_cache),
+                    'datastore': lambda: self._get_datastores(
+                        use_cache=use_cache),
                 },
             },
             # VMs still being cloned won't return everything we need
             skip_broken_objects=skip_broken_vms,
         )
 
-    def _get_computes(self, use_cache=True):
-        properties = [
-            'name',
-            'resourcePool',
+    def _get_vm_projection(self, projections, use_cache, skip_broken_vms):
+        """
+            Get the VMs with the properties of the given projections, only
+            collecting the properties which were not collected yet.
+        """
+        vimtype, properties = self._entity_properties['vm']
+        names = sorted(set(projections) | {'identity'})
+        paths = [
+            path for path in properties
+            if any(path in self._vm_projections[name] for name in names)
         ]
+        if len(paths) == len(properties):
+            # All projections are the same as the full VMs
+            cache_key = 'vm'
+        else:
+            cache_key = 'vm:{names}'.format(names='+'.join(names))
+
+        mappings = {
+            name: getter for name, getter in (
+                ('network', lambda: self._get_networks(use_cache=use_cache)),
+                ('datastore',
+                 lambda: self._get_datastores(use_cache=use_cache)),
+            ) if name in paths
+        }
+        other_entity_mappings = {'static': mappings} if mappings else None
+
+        if self._incremental_cache_enabled():
+            if use_cache and cache_key in self._cache:
+                return self._cache[cache_key]
+            # Each projection is tracked with only its own properties
+            return self._get_tracked_entity(
+                cache_key, paths, vimtype, other_entity_mappings,
+                skip_broken_vms, record_name='vm')
+
+        if not use_cache:
+            self._vm_properties = _PropertyStore()
+            self._drop_vm_projections()
+        elif cache_key in self._cache:
+            return self._cache[cache_key]
+        self._update_vm_properties(vimtype, properties, paths)
+
+        other_entity_mappings = self._make_mapping_resolvers(
+            other_entity_mappings)
+        props_dict = self._get_props_dict(paths)
+
+        results = []
+        for result in self._vm_properties.objects.values():
+            entity = self._build_cached_object(
+                'vm', props_dict, result, other_entity_mappings,
+                skip_broken_vms)
+            if entity is not None:
+                results.append(entity)
+        results = _EntityList(results)
+        self._cache[cache_key] = results
+        return results
+
+    def _update_vm_properties(self, vimtype, properties, paths):
+        store = self._vm_properties
+        missing = [path for path in paths if path not in store.paths]
+        if missing:
+            objects = OrderedDict()
+            for result in self._collect_properties(
+                    vimtype, path_set=missing, stream=True):
+                object_id = result['obj']._moId
+                merged = store.objects.get(object_id)
+                if merged is None:
+                    merged = {}
+                    if store.paths:
+                        # New VM, which lacks the paths collected before
+                        store.stale.add(object_id)
+                merged.update(result)
+                objects[object_id] = merged
+            store.objects = objects
+            store.paths.update(missing)
+            self._drop_vm_projections()
+
+        if store.stale:
+            path_set = [path for path in properties if path in store.paths]
+            for object_id in store.stale:
+                results = self._collect_properties(
+                    vimtype, path_set=path_set, object_id=object_id)
+                if results:
+                    store.objects[object_id] = results[0]
+                else:
+                    store.objects.pop(object_id, None)
+            store.stale.clear()
+            self._drop_vm_projections()
+
+    def _drop_vm_projections(self):
+        for key in [key for key in self._cache if key.startswith('vm:')]:
+            del self._cache[key]
+
+    def _get_host_usage(self, use_cache=True):
+        """
+            Get the memory and vCPUs assigned to the VMs of each host, as a
+            dict of HostUsage by host ID.
+            Only the few VM properties needed are collected, in one pass.
+            Templates do not count towards memory, as they are never
+            powered on.
+        """
+        if use_cache and 'host_usage' in self._cache:
+            return self._cache['host_usage']
+
+        usage = {}
+        for vm in self._collect_properties(
+                vim.VirtualMachine,
+                path_set=self._vm_capacity_properties,
+                stream=True):
+            host = vm.get('runtime.host')
+            if host is None:
+                continue
+            memory, cpus = usage.get(host._moId, (0, 0))
+            try:
+                cpus += int(vm.get('summary.config.numCpu'))
+            except Exception:
+                self._logger.warning(
+                    "Incorrect value for numCpu. "
+                    "It is {0} but integer value is expected".format(
+                        vm.get('summary.config.numCpu')))
+            if not vm.get('summary.config.template'):
+                try:
+                    memory += int(vm.get('summary.config.memorySizeMB'))
+                except Exception:
+                    self._logger.warning(
+                        'Incorrect value for memorySizeMB. It is {0}, but '
+                        'integer value is expected'.format(
+                            vm.get('summary.config.memorySizeMB')))
+            usage[host._moId] = HostUsage(memory, cpus)
+
+        self._cache['host_usage'] = usage
+        return usage
+
+    def _get_computes(self, use_cache=True, object_id=None):
+        vimtype, properties = self._entity_properties['compute']
 
         return self._get_entity(
             entity_name='compute',
             props=properties,
-            vimtype=vim.ComputeResource,
+            vimtype=vimtype,
             use_cache=use_cache,
+            object_id=object_id,
             other_entity_mappings={
                 'single': {
-                    'resourcePool': self._get_resource_pools(
+                    'resourcePool': lambda: self._get_resource_pools(
                         use_cache=use_cache,
                     ),
                 },
             },
         )
 
-    def _get_hosts(self, use_cache=True):
-        properties = [
-            'name',
-            'parent',
-            'hardware.memorySize',
-            'hardware.cpuInfo.numCpuThreads',
-            'overallStatus',
-            'network',
-            'summary.runtime.connectionState',
-            'summary.runtime.inMaintenanceMode',
-            'vm',
-            'datastore',
-            'config.network.vswitch',
-            'configManager',
-        ]
+    def _get_hosts(self, use_cache=True, object_id=None):
+        vimtype, properties = self._entity_properties['host']
 
         # A host's parent can be either a cluster or a compute, so we handle
         # both here.
         return self._get_entity(
             entity_name='host',
             props=properties,
-            vimtype=vim.HostSystem,
+            vimtype=vimtype,
             use_cache=use_cache,
+            object_id=object_id,
             other_entity_mappings={
                 'single': {
-                    'parent': self._get_clusters(
+                    'parent': lambda: self._get_clusters(
                         use_cache=use_cache) + self._get_computes(
                         use_cache=use_cache),
                 },
                 'dynamic': {
-                    'vm': self._get_vms(use_cache=use_cache),
-                    'network': self._get_networks(use_cache=use_cache),
+                    'vm': lambda: self._get_vms(
+                        use_cache=use_cache, projections=['summary']),
+                    'network': lambda: self._get_networks(
+                        use_cache=use_cache),
                 },
                 'static': {
-                    'datastore': self._get_datastores(use_cache=use_cache),
+                    'datastore': lambda: self._get_datastores(
+                        use_cache=use_cache),
                 },
             },
             skip_broken_objects=True,
         )
 
     def _get_hosts_in_tree(self, host_folder):
-        def get_vmware_hosts(tree_node):
-            # Traverse the tree to find any hosts.
-            hosts = []
-
-            if hasattr(tree_node, "host"):
-                # If we find hosts under this node we are done.
-                hosts.extend(list(tree_node.host))
-
-            elif hasattr(tree_node, "childEntity"):
-                # If there are no hosts look under its children
-                for entity in tree_node.childEntity:
-                    hosts.extend(get_vmware_hosts(entity))
-
-            return hosts
-
-        # Get all of the hosts in this hosts folder, that includes looking
-        # in subfolders and clusters.
-        vmware_hosts = get_vmware_hosts(host_folder)
+        """
+            Get the hosts under host_folder, including those in subfolders
+            and clusters, found by the property collector in one call.
+        """
+        filter_spec = self._make_filter_spec(
+            self._make_host_tree_object_spec(host_folder),
+            vim.HostSystem,
+            ['name'],
+        )
+        vmware_host_ids = [
+            properties['obj']._GetMoId()
+            for properties in self._retrieve_pages(filter_spec)]
 
         # Cloudify uses a slightly different style of object to the raw VMWare
         # API. To convert one to the other look up object IDs and compare.
-        vmware_host_ids = [host._GetMoId() for host in vmware_hosts]
-
-        cloudify_host_dict = {cloudify_host.obj._GetMoId(): cloudify_host
-                              for cloudify_host in self._get_hosts()}
+        cloudify_host_dict = self._get_hosts().by_id
 
         # some hosts might be disconnected so they won't have valid dicts
         # though they are visible as part of vmware_hosts
-        cloudify_hosts = []
-        for id in vmware_host_ids:
-            try:
-                cloudify_hosts.append(cloudify_host_dict[id])
-            except KeyError:
-                continue
+        return [cloudify_host_dict[host_id] for host_id in vmware_host_ids
+                if host_id in cloudify_host_dict]
+
+    def _make_host_tree_object_spec(self, host_folder):
+        # Start inventory navigation at the hosts folder, then go down
+        # through the subfolders to the hosts of each compute resource
+        # and cluster.
+        compute_traversal = vmodl.query.PropertyCollector.TraversalSpec()
+        compute_traversal.name = 'traverseComputeHosts'
+        compute_traversal.type = vim.ComputeResource
+        compute_traversal.path = 'host'
+        compute_traversal.skip = False
+
+        folder_traversal = vmodl.query.PropertyCollector.TraversalSpec()
+        folder_traversal.name = 'traverseFolders'
+        folder_traversal.type = vim.Folder
+        folder_traversal.path = 'childEntity'
+        folder_traversal.skip = False
+        folder_traversal.selectSet = [
+            vmodl.query.PropertyCollector.SelectionSpec(
+                name=folder_traversal.name),
+            compute_traversal,
+        ]
 
-        return cloudify_hosts
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
+        obj_spec.obj = host_folder
+        obj_spec.skip = True
+        obj_spec.selectSet = [folder_traversal]
+        return obj_spec
 
     def _convert_vmware_port_group_to_cloudify(self, port_group):
         port_group_id = port_group._moId
 
-        for cloudify_port_group in self._get_networks():
-            if cloudify_port_group.obj._moId == port_group_id:
-                break
-        else:
+        cloudify_port_group = self._get_networks().by_id.get(port_group_id)
+        if cloudify_port_group is None:
             raise RuntimeError(
                 "Couldn't find cloudify representation of port group {name}"
                 .format(name=port_group.name))
@@ -998,7 +2330,8 @@ class VsphereClient(object):
                     vimtype=vimtype))
         return getter_method
 
-    def _collect_properties(self, obj_type, path_set=None):
+    def _collect_properties(self, obj_type, path_set=None, object_id=None,
+                            stream=False):
         """
         Collect properties for managed objects from a view ref
         Check the vSphere API documentation for example on retrieving
@@ -1010,56 +2343,245 @@ class VsphereClient(object):
                                             navigation
             obj_type      (pyVmomi.vim.*): Type of managed object
             path_set               (list): List of properties to retrieve
+            object_id               (str): Only retrieve the object with
+                                           this ID, instead of every object
+                                           of obj_type
+            stream                 (bool): Return a generator which
+                                           retrieves the objects one page
+                                           at a time
         Returns:
             A list of properties for the managed objects
         """
-        with _ContainerView([obj_type], self.si) as view_ref:
-            collector = self.si.content.propertyCollector
-
-            # Create object specification to define the starting point of
-            # inventory navigation
-            obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
-            obj_spec.obj = view_ref
-            obj_spec.skip = True
-
-            # Create a traversal specification to identify the path for
-            # collection
-            traversal_spec = vmodl.query.PropertyCollector.TraversalSpec()
-            traversal_spec.name = 'traverseEntities'
-            traversal_spec.path = 'view'
-            traversal_spec.skip = False
-            traversal_spec.type = view_ref.__class__
-            obj_spec.selectSet = [traversal_spec]
+        data = None
+        if not object_id:
+            # Use the results of a batched collection if there are any
+            data = self._collected.pop(
+                (obj_type, tuple(path_set or ())), None)
+        if data is None:
+            data = self._iter_properties(obj_type, path_set, object_id)
+        elif stream:
+            data = iter(data)
+        if stream:
+            return data
+        return list(data)
+
+    def _collect_properties_batch(self, specs):
+        """
+        Collect properties for several types of managed objects in a single
+        property collector retrieval, using one view ref.
 
-            # Identify the properties to the retrieved
-            property_spec = vmodl.query.PropertyCollector.PropertySpec()
-            property_spec.type = obj_type
+        Args:
+            specs (list): (obj_type, path_set) pairs, with the same meaning
+                          as for _collect_properties
+        Returns:
+            A dict of the list of properties for each (obj_type, path_set)
+            pair, with path_set as a tuple
+        """
+        results = {}
+        obj_types = []
+        for obj_type, path_set in specs:
+            results[(obj_type, tuple(path_set or ()))] = []
+            if obj_type not in obj_types:
+                obj_types.append(obj_type)
+        if not specs:
+            return results
+
+        with _ContainerView(obj_types, self.si, self._scope) as view_ref:
+            filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+            filter_spec.objectSet = [self._make_view_object_spec(view_ref)]
+            filter_spec.propSet = [
+                self._make_property_spec(obj_type, path_set)
+                for obj_type, path_set in self._merge_path_sets(specs)
+            ]
+
+            for properties in self._retrieve_pages(filter_spec):
+                obj = properties['obj']
+                # Objects can match several specs, e.g. a cluster is also a
+                # compute resource, so each spec gets its own properties.
+                for (obj_type, path_set), data in results.items():
+                    if not isinstance(obj, obj_type):
+                        continue
+                    if path_set:
+                        item = {
+                            prop: properties[prop] for prop in path_set
+                            if prop in properties
+                        }
+                        item['obj'] = obj
+                    else:
+                        item = dict(properties)
+                    data.append(item)
 
-            if not path_set:
-                property_spec.all = True
+        return results
 
-            property_spec.pathSet = path_set
+    def _merge_path_sets(self, specs):
+        # A filter can only have one property spec for each type
+        merged = []
+        path_sets = {}
+        for obj_type, path_set in specs:
+            if obj_type not in path_sets:
+                path_sets[obj_type] = []
+                merged.append(obj_type)
+            if not path_set or path_sets[obj_type] is None:
+                path_sets[obj_type] = None
+            else:
+                path_sets[obj_type].extend(
+                    prop for prop in path_set
+                    if prop not in path_sets[obj_type])
+        return [(obj_type, path_sets[obj_type]) for obj_type in merged]
+
+    def _get_prefetch_getters(self):
+        return {
+            'vm_folder': self._get_vm_folders,
+            'cluster': self._get_clusters,
+            'datacenter': self._get_datacenters,
+            'datastore': self._get_datastores,
+            'resource_pool': self._get_resource_pools,
+            'network': self._get_networks,
+            'dv_pg_extra_detail': self._get_extra_dv_port_group_details,
+            'dvswitch': self._get_dvswitches,
+            'vm': self._get_vms,
+            'compute': self._get_computes,
+            'host': self._get_hosts,
+        }
+
+    def _prefetch_entities(self, entity_names=None):
+        """
+            Fill the caches of the given entities (all of them by default)
+            from a single batched property collection, instead of one
+            collection per entity type.
+        """
+        getters = self._get_prefetch_getters()
+        entity_names = [
+            name for name in entity_names or getters
+            if name not in self._cache
+        ]
+        if not entity_names:
+            return
+
+        batch = []
+        for name in entity_names:
+            vimtype, properties = self._entity_properties[name]
+            if name == 'datacenter' and self._scope is not None:
+                # Datacenters are collected outside of any scope
+                continue
+            elif self._incremental_cache_enabled() and \
+                    name in self._trackable_entities:
+                # These are all reported by the first update instead
+                self._track_entities(name, vimtype, properties)
+            elif self._get_inventory_snapshot(name):
+                # These are only retrieved if their snapshot is stale
+                continue
+            else:
+                batch.append((vimtype, properties))
 
-            # Add the object and property specification to the
-            # property filter specification
-            filter_spec = vmodl.query.PropertyCollector.FilterSpec()
-            filter_spec.objectSet = [obj_spec]
-            filter_spec.propSet = [property_spec]
+        self._collected = self._collect_properties_batch(batch)
+        try:
+            for name in entity_names:
+                getters[name]()
+        finally:
+            # Never serve these results to a later collection
+            self._collected = {}
+
+    def _iter_properties(self, obj_type, path_set=None, object_id=None):
+        if object_id:
+            # Start inventory navigation at the object itself, so that only
+            # this object is retrieved.
+            obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
+            obj_spec.obj = obj_type(object_id, self.si._stub)
+            obj_spec.skip = False
 
-            # Retrieve properties
-            props = collector.RetrieveContents([filter_spec])
+            filter_spec = self._make_filter_spec(obj_spec, obj_type, path_set)
+            try:
+                for properties in self._retrieve_pages(filter_spec):
+                    yield properties
+            except vmodl.fault.ManagedObjectNotFound:
+                return
+        else:
+            with _ContainerView([obj_type], self.si, self._scope) \
+                    as view_ref:
+                filter_spec = self._make_filter_spec(
+                    self._make_view_object_spec(view_ref), obj_type, path_set)
 
-        data = []
-        for obj in props:
-            properties = {}
-            for prop in obj.propSet:
-                properties[prop.name] = prop.val
+                # The view must stay alive until the last page is retrieved
+                for properties in self._retrieve_pages(filter_spec):
+                    yield properties
 
-            properties['obj'] = obj.obj
+    def _get_collector_page_size(self):
+        return int(self.cfg.get('collector_page_size') or
+                   COLLECTOR_PAGE_SIZE)
 
-            data.append(properties)
+    def _retrieve_pages(self, filter_spec):
+        """
+            Retrieve the objects matching filter_spec, one page of at most
+            collector_page_size objects at a time.
+            Each object is yielded as a dict of its properties, with the
+            object itself in 'obj'.
+        """
+        collector = self.si.content.propertyCollector
+        options = vmodl.query.PropertyCollector.RetrieveOptions()
+        options.maxObjects = self._get_collector_page_size()
 
-        return data
+        page = collector.RetrievePropertiesEx([filter_spec], options)
+        token = None
+        try:
+            while page:
+                token = page.token
+                objects = page.objects
+                # Don't keep the raw page around once it has been yielded
+                page = None
+                for obj in objects:
+                    properties = {}
+                    for prop in obj.propSet or []:
+                        properties[prop.name] = prop.val
+
+                    properties['obj'] = obj.obj
+
+                    yield properties
+                objects = None
+
+                if token:
+                    page = collector.ContinueRetrievePropertiesEx(token)
+                    token = None
+        finally:
+            if token:
+                # The caller stopped before the last page
+                collector.CancelRetrievePropertiesEx(token)
+
+    def _make_view_object_spec(self, view_ref):
+        # Create object specification to define the starting point
+        # of inventory navigation
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
+        obj_spec.obj = view_ref
+        obj_spec.skip = True
+
+        # Create a traversal specification to identify the path for
+        # collection
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec()
+        traversal_spec.name = 'traverseEntities'
+        traversal_spec.path = 'view'
+        traversal_spec.skip = False
+        traversal_spec.type = view_ref.__class__
+        obj_spec.selectSet = [traversal_spec]
+        return obj_spec
+
+    def _make_property_spec(self, obj_type, path_set=None):
+        # Identify the properties to the retrieved
+        property_spec = vmodl.query.PropertyCollector.PropertySpec()
+        property_spec.type = obj_type
+
+        if not path_set:
+            property_spec.all = True
+
+        property_spec.pathSet = path_set
+        return property_spec
+
+    def _make_filter_spec(self, obj_spec, obj_type, path_set=None):
+        # Add the object and property specification to the
+        # property filter specification
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = [obj_spec]
+        filter_spec.propSet = [self._make_property_spec(obj_type, path_set)]
+        return filter_spec
 
     def _get_entity_datacenter(self, obj):
         if isinstance(obj, vim.Datacenter):
@@ -1075,10 +2597,17 @@ class VsphereClient(object):
         return datacenter
 
     def _get_obj_by_name(self, vimtype, name, use_cache=True,
-                         datacenter_name=None):
+                         datacenter_name=None, projections=None):
 
-        entities = self._get_getter_method(vimtype)(use_cache)
+        if projections:
+            # Only VMs have projections
+            entities = self._get_getter_method(vimtype)(
+                use_cache, projections=projections)
+        else:
+            entities = self._get_getter_method(vimtype)(use_cache)
         name = self._get_normalised_name(name)
+        if isinstance(entities, _EntityList):
+            entities = entities.by_name.get(name, [])
         for entity in entities:
             if name == entity.name.lower():
                 # check if we are looking inside specific datacenter
@@ -1090,12 +2619,156 @@ class VsphereClient(object):
                 else:
                     return entity
 
+    def _get_single_getter_method(self, vimtype):
+        """
+            Get the getter method for vimtypes which can be retrieved one
+            object at a time, or None if the whole inventory of this type
+            must be retrieved.
+        """
+        return {
+            vim.VirtualMachine: self._get_vms,
+            vim.ClusterComputeResource: self._get_clusters,
+            vim.Datastore: self._get_datastores,
+            vim.Datacenter: self._get_datacenters,
+            vim.dvs.VmwareDistributedVirtualSwitch: self._get_dvswitches,
+            vim.HostSystem: self._get_hosts,
+            vim.Folder: self._get_vm_folders,
+            vim.ComputeResource: self._get_computes}.get(vimtype)
+
     def _get_obj_by_id(self, vimtype, id, use_cache=True):
-        entities = self._get_getter_method(vimtype)(use_cache)
+        getter_method = self._get_single_getter_method(vimtype)
+        if getter_method:
+            entities = getter_method(use_cache, object_id=id)
+        else:
+            entities = self._get_getter_method(vimtype)(use_cache)
+        if isinstance(entities, _EntityList):
+            return entities.by_id.get(id)
         for entity in entities:
             if entity.id == id:
                 return entity
 
+    def _get_task_by_id(self, task_id, entity=None):
+        """
+            Get the task with this id by rebuilding its moref on the current
+            connection. The server removes tasks some time after they finish,
+            so those are looked up in the task history of their entity.
+        """
+        task = vim.Task(task_id, self.si._stub)
+        try:
+            task.info
+        except vmodl.fault.ManagedObjectNotFound:
+            self._logger.debug(
+                'Task {task_id} has expired, checking the task history.'
+                .format(task_id=task_id))
+        else:
+            return task
+        if not entity:
+            return None
+
+        entity_type, entity_id = entity
+        filter_spec = vim.TaskFilterSpec()
+        filter_spec.entity = vim.TaskFilterSpec.ByEntity(
+            entity=VmomiSupport.GetWsdlType('urn:vim25', entity_type)(
+                entity_id, self.si._stub),
+            recursion=vim.TaskFilterSpec.RecursionOption.self)
+        try:
+            collector = \
+                self.si.content.taskManager.CreateCollectorForTasks(
+                    filter_spec)
+        except vmodl.fault.ManagedObjectNotFound:
+            # The entity is gone too, e.g. after a destroy task
+            return None
+        try:
+            # A new collector starts at its latest page, which holds the most
+            # recent tasks, and reading goes back from there
+            infos = collector.latestPage
+            while infos:
+                for info in infos:
+                    if info.task._moId == task_id:
+                        return _FinishedTask(info)
+                infos = collector.ReadPreviousTasks(
+                    self._get_collector_page_size())
+            return None
+        finally:
+            collector.DestroyCollector()
+
+    def _wait_for_task_state(self, task, max_wait_time, instance=None):
+        """
+            Wait for task to leave the queued and running states.
+            Returns False if it has not finished after max_wait_time seconds
+            and the wait should be retried later, which only happens when
+            there is an instance to save the task for.
+        """
+        if not isinstance(task, vim.Task) or not getattr(self, 'si', None):
+            return self._poll_task_state(task, max_wait_time, instance)
+
+        try:
+            collector = \
+                self.si.content.propertyCollector.CreatePropertyCollector()
+        except vmodl.MethodFault as err:
+            self._logger.debug(
+                'Could not watch task {task_id}, polling it: {err}'.format(
+                    task_id=task._moId, err=text_type(err)))
+            return self._poll_task_state(task, max_wait_time, instance)
+
+        try:
+            obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
+            obj_spec.obj = task
+            obj_spec.skip = False
+            # The filter is destroyed with the collector
+            collector.CreateFilter(
+                self._make_filter_spec(
+                    obj_spec, vim.Task, self._task_properties),
+                partialUpdates=False,
+            )
+
+            version = ''
+            state = None
+            deadline = time.time() + max_wait_time
+            options = vmodl.query.PropertyCollector.WaitOptions()
+            while True:
+                update_set = collector.WaitForUpdatesEx(version, options)
+                if update_set:
+                    version = update_set.version
+                    for filter_update in update_set.filterSet or []:
+                        for object_update in filter_update.objectSet or []:
+                            for change in object_update.changeSet or []:
+                                if change.name == 'info.state':
+                                    state = change.val
+                if version and state not in (vim.TaskInfo.State.queued,
+                                             vim.TaskInfo.State.running):
+                    return True
+
+                remaining = int(deadline - time.time())
+                self._logger.debug(
+                    'Task state {state} left {step} seconds'.format(
+                        state=state, step=max(remaining, 0)))
+                if instance and remaining <= 0:
+                    return False
+                # Without an instance we wait until the task finishes, but
+                # still wake up to log progress.
+                options.maxWaitSeconds = min(
+                    max(remaining, 1) if instance else TASK_CHECK_SLEEP,
+                    TASK_CHECK_SLEEP)
+        finally:
+            collector.DestroyPropertyCollector()
+
+    def _poll_task_state(self, task, max_wait_time, instance=None):
+        retry_count = max_wait_time // TASK_CHECK_SLEEP
+
+        while task.info.state in (vim.TaskInfo.State.queued,
+                                  vim.TaskInfo.State.running):
+            time.sleep(TASK_CHECK_SLEEP)
+
+            self._logger.debug(
+                'Task state {state} left {step} seconds'.format(
+                    state=task.info.state,
+                    step=(retry_count * TASK_CHECK_SLEEP)))
+            if instance and retry_count <= 0:
+                return False
+            retry_count -= 1
+        return True
+
     def _wait_for_task(self,
                        task=None,
                        instance=None,
@@ -1124,38 +2797,31 @@ class VsphereClient(object):
                     task_id=task_id))
                 instance.runtime_properties[ASYNC_TASK_ID] = task_id
                 instance.runtime_properties[ASYNC_RESOURCE_ID] = resource_id
+                entity = task.info.entity
+                if isinstance(entity, VmomiSupport.ManagedObject):
+                    instance.runtime_properties[ASYNC_TASK_ENTITY] = [
+                        entity._wsdlName, entity._moId]
                 # save flag as current state before external call
                 instance.update()
 
         if not task:
-            task_obj = self._get_obj_by_id(vim.Task, task_id)
-            if not task_obj:
+            task = self._get_task_by_id(
+                task_id, instance.runtime_properties.get(ASYNC_TASK_ENTITY))
+            if not task:
                 self._logger.info(
                     'No task_id? {task_id}'.format(task_id=task_id))
-                if instance:
-                    # no such tasks
-                    del instance.runtime_properties[ASYNC_TASK_ID]
-                    # save flag as current state before external call
-                    instance.update()
+                # no such tasks
+                del instance.runtime_properties[ASYNC_TASK_ID]
+                instance.runtime_properties.pop(ASYNC_TASK_ENTITY, None)
+                # save flag as current state before external call
+                instance.update()
                 return
-            task = task_obj.obj
-
-        retry_count = max_wait_time // TASK_CHECK_SLEEP
 
-        while task.info.state in (vim.TaskInfo.State.queued,
-                                  vim.TaskInfo.State.running):
-            time.sleep(TASK_CHECK_SLEEP)
-
-            self._logger.debug(
-                'Task state {state} left {step} seconds'.format(
-                    state=task.info.state,
-                    step=(retry_count * TASK_CHECK_SLEEP)))
+        if not self._wait_for_task_state(task, max_wait_time, instance):
             # check async
-            if instance and retry_count <= 0:
-                raise OperationRetry(
-                    'Task {task_id} is not finished yet.'.format(
-                        task_id=task._moId))
-            retry_count -= 1
+            raise OperationRetry(
+                'Task {task_id} is not finished yet.'.format(
+                    task_id=task._moId))
 
         # we correctly finished, and need to cleanup
         if instance:
@@ -1163,6 +2829,7 @@ class VsphereClient(object):
                 task_id=task_id))
             del instance.runtime_properties[ASYNC_TASK_ID]
             del instance.runtime_properties[ASYNC_RESOURCE_ID]
+            instance.runtime_properties.pop(ASYNC_TASK_ENTITY, None)
             # save flag as current state before external call
             instance.update()
 
@@ -18,7 +18,6 @@ from __future__ import division
 # Stdlib imports
 
 # Third party imports
-import netaddr
 from pyVmomi import vim
 
 # Cloudify imports
@@ -329,6 +328,7 @@ class NetworkClient(VsphereClient):
                         subnet_address = pool.ipv4Config.subnetAddress
                         netmask = pool.ipv4Config.netmask
                         if subnet_address and netmask:
+                            import netaddr
                             return text_type(netaddr.IPNetwork(
                                 '{network}/{netmask}'
                                 .format(network=subnet_address,
@@ -383,31 +383,34 @@ class NetworkClient(VsphereClient):
         pool.ipv4Config.range = ippool['range']
         pool.ipv4Config.dhcpServerAvailable = ippool.get('dhcp', False)
         pool.ipv4Config.ipPoolEnabled = ippool.get('enabled', True)
-        # add networks to pool
-        for network in networks:
-            network_name = network.runtime_properties["network_name"]
-            self._logger.debug("Attach network {network} to {pool}."
-                               .format(network=network_name,
-                                       pool=ippool['name']))
-            if network.runtime_properties.get("switch_distributed"):
-                # search vim.dvs.DistributedVirtualPortgroup
-                dv_port_group = self._get_obj_by_name(
-                    vim.dvs.DistributedVirtualPortgroup,
-                    network_name,
-                )
-                pool.networkAssociation.insert(0, vim.vApp.IpPool.Association(
-                    network=dv_port_group.obj))
-            else:
-                # search all networks
-                networks = [
-                    net for net in self._collect_properties(
-                        vim.Network, path_set=["name"],
-                    ) if not net['obj']._moId.startswith('dvportgroup')]
-                # attach all networks with provided name
-                for net in networks:
-                    if net[VSPHERE_RESOURCE_NAME] == network_name:
-                        pool.networkAssociation.insert(
-                            0, vim.vApp.IpPool.Association(network=net['obj']))
+        # add networks to pool, looking them up in the datacenter only
+        with self._scoped(dc.obj):
+            for network in networks:
+                network_name = network.runtime_properties["network_name"]
+                self._logger.debug("Attach network {network} to {pool}."
+                                   .format(network=network_name,
+                                           pool=ippool['name']))
+                if network.runtime_properties.get("switch_distributed"):
+                    # search vim.dvs.DistributedVirtualPortgroup
+                    dv_port_group = self._get_obj_by_name(
+                        vim.dvs.DistributedVirtualPortgroup,
+                        network_name,
+                    )
+                    pool.networkAssociation.insert(
+                        0, vim.vApp.IpPool.Association(
+                            network=dv_port_group.obj))
+                else:
+                    # search all networks
+                    networks = [
+                        net for net in self._collect_properties(
+                            vim.Network, path_set=["name"],
+                        ) if not net['obj']._moId.startswith('dvportgroup')]
+                    # attach all networks with provided name
+                    for net in networks:
+                        if net[VSPHERE_RESOURCE_NAME] == network_name:
+                            pool.networkAssociation.insert(
+                                0, vim.vApp.IpPool.Association(
+                                    network=net['obj']))
         return self.si.content.ipPoolManager.CreateIpPool(dc=dc.obj, pool=pool)
 
     def delete_ippool(self, datacenter_name, ippool_id):
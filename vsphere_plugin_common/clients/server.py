@@ -15,8 +15,10 @@
 from __future__ import division
 
 # Stdlib imports
+import os
+import re
 import time
-from netaddr import IPNetwork
+from contextlib import contextmanager
 from pyVmomi import vim, vmodl
 
 # Cloudify imports
@@ -26,13 +28,22 @@ from cloudify.exceptions import (
     NonRecoverableError)
 
 # This package imports
-from . import VsphereClient
+from . import (
+    HostUsage,
+    VsphereClient,
+    _ResourcePoolList,
+    _datacenter_scoped,
+    _PlacementReservations,
+)
 from ..constants import (
     IP,
     TASK_CHECK_SLEEP,
     VSPHERE_SERVER_ID,
     ASYNC_RESOURCE_ID,
     VSPHERE_SNAPSHOT_ID,
+    PLACEMENT_RESERVATIONS_DIR,
+    PLACEMENT_RESERVATIONS_TTL,
+    VSPHERE_SERVER_PLACEMENT,
     VSPHERE_SERVER_CLUSTER_NAME,
     VSPHERE_SERVER_HYPERVISOR_HOSTNAME
 )
@@ -148,8 +159,11 @@ class ServerClient(VsphereClient):
                 issues.append(error)
 
         self._logger.debug('Checking template exists.')
-        template_vm = self._get_obj_by_name(vim.VirtualMachine,
-                                            template_name)
+        # Templates may be kept in another datacenter
+        with self._scoped(None):
+            template_vm = self._get_obj_by_name(vim.VirtualMachine,
+                                                template_name,
+                                                projections=['identity'])
         if template_vm is None:
             issues.append("VM template {0} could not be found.".format(
                 template_name
@@ -351,6 +365,7 @@ class ServerClient(VsphereClient):
             guest_map.adapter = vim.vm.customization.IPSettings()
             guest_map.adapter.ip = vim.vm.customization.DhcpIpGenerator()
         else:
+            from netaddr import IPNetwork
             nw = IPNetwork(network["network"])
             guest_map = vim.vm.customization.AdapterMapping()
             guest_map.adapter = vim.vm.customization.IPSettings()
@@ -383,32 +398,27 @@ class ServerClient(VsphereClient):
         self._logger.debug(
             'Removing network adapters {keys} from vm. '
             .format(keys=text_type(keys)))
-        # remove nics by key
-        for key in keys:
-            devices = []
-            for device in server.config.hardware.device:
-                # delete network interface
-                if key == device.key:
-                    nicspec = vim.vm.device.VirtualDeviceSpec()
-                    nicspec.device = device
-                    self._logger.debug(
-                        'Removing network adapter {key} from vm. '
-                        .format(key=device.key))
-                    nicspec.operation = \
-                        vim.vm.device.VirtualDeviceSpec.Operation.remove
-                    devices.append(nicspec)
-            if devices:
-                # apply changes
-                spec = vim.vm.ConfigSpec()
-                spec.deviceChange = devices
-                task = server.obj.ReconfigVM_Task(spec=spec)
-                self._wait_for_task(task)
-                # update server object
-                server = self._get_obj_by_id(
-                    vim.VirtualMachine,
-                    server.obj._moId,
-                    use_cache=False,
-                )
+        # remove all of the nics with one reconfiguration, as vSphere runs
+        # the reconfigurations of a VM one at a time anyway
+        keys = set(keys)
+        devices = []
+        for device in server.config.hardware.device:
+            # delete network interface
+            if device.key in keys:
+                nicspec = vim.vm.device.VirtualDeviceSpec()
+                nicspec.device = device
+                self._logger.debug(
+                    'Removing network adapter {key} from vm. '
+                    .format(key=device.key))
+                nicspec.operation = \
+                    vim.vm.device.VirtualDeviceSpec.Operation.remove
+                devices.append(nicspec)
+        if devices:
+            # apply changes
+            spec = vim.vm.ConfigSpec()
+            spec.deviceChange = devices
+            task = server.obj.ReconfigVM_Task(spec=spec)
+            self._wait_for_task(task)
 
     def _update_vm(self, server, cdrom_image=None, remove_networks=False):
         # update vm with attach cdrom image and remove network adapters
@@ -513,6 +523,7 @@ class ServerClient(VsphereClient):
         # hardware versions and ESXi version compatibility.
         return int(vm.config.version.lstrip("vmx-"))
 
+    @_datacenter_scoped
     def create_server(
             self,
             auto_placement,
@@ -562,6 +573,17 @@ class ServerClient(VsphereClient):
             # would work correctly
             enable_start_vm = False
 
+        placement = self._get_planned_placement(
+            ctx.instance.runtime_properties.get(VSPHERE_SERVER_PLACEMENT))
+        if not placement:
+            # Placement needs most of the inventory, so collect it all at
+            # once. VMs are collected separately, with only the properties
+            # needed.
+            self._prefetch_entities([
+                name for name in self._get_prefetch_getters()
+                if name != 'vm'])
+        reservations = self._get_placement_reservations()
+
         self._validate_inputs(
             allowed_hosts=allowed_hosts,
             allowed_clusters=allowed_clusters,
@@ -573,7 +595,12 @@ class ServerClient(VsphereClient):
         )
 
         # If cpus and memory are not specified, take values from the template.
-        template_vm = self._get_obj_by_name(vim.VirtualMachine, template_name)
+        with self._scoped(None):
+            template_vm = self._get_obj_by_name(
+                vim.VirtualMachine, template_name, projections=['identity'])
+            # Only the template needs all of its properties
+            template_vm = self._get_obj_by_id(
+                vim.VirtualMachine, template_vm.id)
         if not cpus:
             cpus = template_vm.config.hardware.numCPU
 
@@ -586,241 +613,264 @@ class ServerClient(VsphereClient):
 
         datacenter = self._get_obj_by_name(vim.Datacenter, datacenter_name)
 
-        candidate_hosts = self.find_candidate_hosts(
-            datacenter=datacenter,
-            resource_pool=resource_pool_name,
-            vm_cpus=cpus,
-            vm_memory=memory,
-            vm_networks=networks,
-            allowed_hosts=allowed_hosts,
-            allowed_clusters=allowed_clusters,
-        )
-
-        host, datastore = self.select_host_and_datastore(
-            candidate_hosts=candidate_hosts,
-            vm_memory=memory,
-            template=template_vm,
-            allowed_datastores=allowed_datastores,
-        )
-        ctx.instance.runtime_properties[
-            VSPHERE_SERVER_HYPERVISOR_HOSTNAME] = host.name
-        ctx.instance.runtime_properties[
-            VSPHERE_SERVER_CLUSTER_NAME] = host.parent.name
-        self._logger.debug(
-            'Using host {host} and datastore {ds} for deployment.'.format(
-                host=host.name,
-                ds=datastore.name,
+        # Choose the host and reserve it under one lock, so that concurrent
+        # placements count each other. A retry waits for the clone, which
+        # kept its reservation.
+        reserve = reservations is not None and not retry
+        with self._placement_locked(reservations if reserve else None):
+            if placement:
+                host, datastore = placement
+            else:
+                self._load_host_usage(reservations, ctx.instance.id)
+                host, datastore = self._place_server(
+                    datacenter=datacenter,
+                    resource_pool_name=resource_pool_name,
+                    cpus=cpus,
+                    memory=memory,
+                    networks=networks,
+                    template=template_vm,
+                    allowed_hosts=allowed_hosts,
+                    allowed_clusters=allowed_clusters,
+                    allowed_datastores=allowed_datastores,
+                )
+            if reserve:
+                # Hold the resources until the clone shows up on the host
+                reservations.add(
+                    ctx.instance.id,
+                    host=host.id,
+                    datastore=datastore.id,
+                    cpus=cpus,
+                    memory=memory,
+                    disk=self._get_vm_disk_usage(template_vm, memory),
+                )
+        try:
+            ctx.instance.runtime_properties[
+                VSPHERE_SERVER_HYPERVISOR_HOSTNAME] = host.name
+            ctx.instance.runtime_properties[
+                VSPHERE_SERVER_CLUSTER_NAME] = host.parent.name
+            self._logger.debug(
+                'Using host {host} and datastore {ds} for deployment.'.format(
+                    host=host.name,
+                    ds=datastore.name,
+                )
             )
-        )
 
-        adaptermaps = []
+            adaptermaps = []
 
-        resource_pool = self.get_resource_pool(
-            host=host, resource_pool_name=resource_pool_name)
+            resource_pool = self.get_resource_pool(
+                host=host, resource_pool_name=resource_pool_name)
 
-        if not vm_folder:
-            destfolder = datacenter.vmFolder
-        else:
-            folder = self._get_obj_by_name(vim.Folder, vm_folder,
-                                           datacenter_name=datacenter_name)
-            if not folder:
-                raise NonRecoverableError(
-                    'Could not use vm_folder "{name}" as no '
-                    'vm folder by that name exists!'.format(
-                        name=vm_folder,
+            if not vm_folder:
+                destfolder = datacenter.vmFolder
+            else:
+                folder = self._get_obj_by_name(vim.Folder, vm_folder,
+                                               datacenter_name=datacenter_name)
+                if not folder:
+                    raise NonRecoverableError(
+                        'Could not use vm_folder "{name}" as no '
+                        'vm folder by that name exists!'.format(
+                            name=vm_folder,
+                        )
                     )
-                )
-            destfolder = folder.obj
+                destfolder = folder.obj
 
-        relospec = vim.vm.RelocateSpec()
-        relospec.datastore = datastore.obj
-        relospec.pool = resource_pool.obj
-        if not auto_placement:
-            self._logger.warn(
-                'Disabled autoplacement is not recomended for a cluster.'
-            )
-            relospec.host = host.obj
-
-        # modify disk provision type
-        if disk_provision_type:
-            dl = vim.vm.RelocateSpec.DiskLocator()
-            dl.datastore = datastore.obj
-            dl.diskBackingInfo = \
-                vim.vm.device.VirtualDisk.FlatVer2BackingInfo()
-            valid_disk_type = False
-            if disk_provision_type == 'thin':
-                valid_disk_type = True
-                dl.diskBackingInfo.thinProvisioned = True
-            elif disk_provision_type == 'thickLazyZeroed':
-                valid_disk_type = True
-                dl.diskBackingInfo.eagerlyScrub = False
-                dl.diskBackingInfo.thinProvisioned = False
-            elif disk_provision_type == 'thickEagerZeroed':
-                valid_disk_type = True
-                dl.diskBackingInfo.eagerlyScrub = True
-                dl.diskBackingInfo.thinProvisioned = False
-            if valid_disk_type:
+            relospec = vim.vm.RelocateSpec()
+            relospec.datastore = datastore.obj
+            relospec.pool = resource_pool.obj
+            if not auto_placement:
+                self._logger.warn(
+                    'Disabled autoplacement is not recomended for a cluster.'
+                )
+                relospec.host = host.obj
+
+            # modify disk provision type
+            if disk_provision_type:
+                dl = vim.vm.RelocateSpec.DiskLocator()
+                dl.datastore = datastore.obj
+                dl.diskBackingInfo = \
+                    vim.vm.device.VirtualDisk.FlatVer2BackingInfo()
+                valid_disk_type = False
+                if disk_provision_type == 'thin':
+                    valid_disk_type = True
+                    dl.diskBackingInfo.thinProvisioned = True
+                elif disk_provision_type == 'thickLazyZeroed':
+                    valid_disk_type = True
+                    dl.diskBackingInfo.eagerlyScrub = False
+                    dl.diskBackingInfo.thinProvisioned = False
+                elif disk_provision_type == 'thickEagerZeroed':
+                    valid_disk_type = True
+                    dl.diskBackingInfo.eagerlyScrub = True
+                    dl.diskBackingInfo.thinProvisioned = False
+                if valid_disk_type:
+                    for device in template_vm.config.hardware.device:
+                        if hasattr(device.backing, 'fileName') and \
+                                hasattr(device.backing, 'diskMode'):
+                            dl.diskId = device.key
+                            break
+                    relospec.disk.append(dl)
+
+            # Get list of NIC MAC addresses for removal
+            if postpone_delete_networks and not enable_start_vm:
+                keys_for_remove = []
+                keys_for_remove = self._get_nic_keys_for_remove(template_vm)
+                ctx.instance.runtime_properties[
+                    '_keys_for_remove'] = keys_for_remove
+                ctx.instance.runtime_properties.dirty = True
+                ctx.instance.update()
+
+            if postpone_delete_networks and enable_start_vm:
+                self._logger.info("Using postpone_delete_networks with "
+                                  "enable_start_vm is unsupported.")
+
+            # attach cdrom image and remove all networks
+            devices = self._update_vm(
+                template_vm,
+                cdrom_image=cdrom_image,
+                remove_networks=not postpone_delete_networks)
+
+            # modify disk size if passed
+            if disk_size:
                 for device in template_vm.config.hardware.device:
-                    if hasattr(device.backing, 'fileName') and \
-                            hasattr(device.backing, 'diskMode'):
-                        dl.diskId = device.key
-                        break
-                relospec.disk.append(dl)
-
-        # Get list of NIC MAC addresses for removal
-        if postpone_delete_networks and not enable_start_vm:
-            keys_for_remove = []
-            keys_for_remove = self._get_nic_keys_for_remove(template_vm)
-            ctx.instance.runtime_properties[
-                '_keys_for_remove'] = keys_for_remove
-            ctx.instance.runtime_properties.dirty = True
-            ctx.instance.update()
-
-        if postpone_delete_networks and enable_start_vm:
-            self._logger.info("Using postpone_delete_networks with "
-                              "enable_start_vm is unsupported.")
-
-        # attach cdrom image and remove all networks
-        devices = self._update_vm(template_vm,
-                                  cdrom_image=cdrom_image,
-                                  remove_networks=not postpone_delete_networks)
-
-        # modify disk size if passed
-        if disk_size:
-            for device in template_vm.config.hardware.device:
-                if isinstance(device, vim.vm.device.VirtualDisk):
-                    diskspec = vim.vm.device.VirtualDeviceSpec()
-                    diskspec.operation = \
-                        vim.vm.device.VirtualDeviceSpec.Operation.edit
-                    diskspec.device = device
-                    diskspec.device.capacityInKB = disk_size * 1024 * 1024
-                    devices.append(diskspec)
+                    if isinstance(device, vim.vm.device.VirtualDisk):
+                        diskspec = vim.vm.device.VirtualDeviceSpec()
+                        diskspec.operation = \
+                            vim.vm.device.VirtualDeviceSpec.Operation.edit
+                        diskspec.device = device
+                        diskspec.device.capacityInKB = disk_size * 1024 * 1024
+                        devices.append(diskspec)
+
+            port_groups, distributed_port_groups = self._get_port_group_names()
+
+            netcnt = 0
+            for network in networks:
+                nicspec, guest_map = self._add_network(
+                    network, datacenter, netcnt)
+                devices.append(nicspec)
+                adaptermaps.append(guest_map)
+                netcnt += 1
+
+            vmconf = vim.vm.ConfigSpec()
+            vmconf.numCPUs = cpus
+            vmconf.memoryMB = memory
+            vmconf.cpuHotAddEnabled = cpu_hot_add
+            vmconf.memoryHotAddEnabled = memory_hot_add
+            vmconf.cpuHotRemoveEnabled = cpu_hot_remove
+            vmconf.deviceChange = devices
+
+            clonespec = vim.vm.CloneSpec()
+            clonespec.location = relospec
+            clonespec.config = vmconf
+            clonespec.powerOn = enable_start_vm
+            clonespec.template = False
 
-        port_groups, distributed_port_groups = self._get_port_group_names()
+            # add extra config
+            if extra_config and isinstance(extra_config, dict):
+                self._logger.debug('Extra config: {config}'
+                                   .format(config=text_type(extra_config)))
+                for k in extra_config:
+                    vmconf.extraConfig.append(
+                        vim.option.OptionValue(key=k, value=extra_config[k]))
 
-        netcnt = 0
-        for network in networks:
-            nicspec, guest_map = self._add_network(network, datacenter, netcnt)
-            devices.append(nicspec)
-            adaptermaps.append(guest_map)
-            netcnt += 1
-
-        vmconf = vim.vm.ConfigSpec()
-        vmconf.numCPUs = cpus
-        vmconf.memoryMB = memory
-        vmconf.cpuHotAddEnabled = cpu_hot_add
-        vmconf.memoryHotAddEnabled = memory_hot_add
-        vmconf.cpuHotRemoveEnabled = cpu_hot_remove
-        vmconf.deviceChange = devices
-
-        clonespec = vim.vm.CloneSpec()
-        clonespec.location = relospec
-        clonespec.config = vmconf
-        clonespec.powerOn = enable_start_vm
-        clonespec.template = False
-
-        # add extra config
-        if extra_config and isinstance(extra_config, dict):
-            self._logger.debug('Extra config: {config}'
-                               .format(config=text_type(extra_config)))
-            for k in extra_config:
-                vmconf.extraConfig.append(
-                    vim.option.OptionValue(key=k, value=extra_config[k]))
-
-        # if we pass 'none' value from the node properties inside os_family
-        # that means no OS on the VM template/clone
-        # this customization for guestOS would fail as no vm-tools
-        # and this would just skip it
-        if os_type != 'none' and adaptermaps:
-            self._logger.debug(
-                'Preparing OS customization spec for {server}'.format(
-                    server=vm_name,
-                )
-            )
-            customspec = vim.vm.customization.Specification()
-            customspec.nicSettingMap = adaptermaps
-
-            if os_type is None or os_type == 'linux':
-                ident = vim.vm.customization.LinuxPrep()
-                if domain:
-                    ident.domain = domain
-                ident.hostName = vim.vm.customization.FixedName()
-                ident.hostName.name = vm_name
-            elif os_type == 'windows':
-                if not windows_password:
-                    if not agent_config:
-                        agent_config = {}
-                    windows_password = agent_config.get('password')
-
-                self._validate_windows_properties(
-                    custom_sysprep,
-                    windows_organization,
-                    windows_password)
-
-                if custom_sysprep is not None:
-                    ident = vim.vm.customization.SysprepText()
-                    ident.value = custom_sysprep
-                else:
-                    # We use GMT without daylight savings if no timezone is
-                    # supplied, as this is as close to UTC as we can do
-                    if not windows_timezone:
-                        windows_timezone = 90
-
-                    ident = vim.vm.customization.Sysprep()
-                    ident.userData = vim.vm.customization.UserData()
-                    ident.guiUnattended = vim.vm.customization.GuiUnattended()
-                    ident.identification = (
-                        vim.vm.customization.Identification()
+            # if we pass 'none' value from the node properties inside os_family
+            # that means no OS on the VM template/clone
+            # this customization for guestOS would fail as no vm-tools
+            # and this would just skip it
+            if os_type != 'none' and adaptermaps:
+                self._logger.debug(
+                    'Preparing OS customization spec for {server}'.format(
+                        server=vm_name,
                     )
+                )
+                customspec = vim.vm.customization.Specification()
+                customspec.nicSettingMap = adaptermaps
+
+                if os_type is None or os_type == 'linux':
+                    ident = vim.vm.customization.LinuxPrep()
+                    if domain:
+                        ident.domain = domain
+                    ident.hostName = vim.vm.customization.FixedName()
+                    ident.hostName.name = vm_name
+                elif os_type == 'windows':
+                    if not windows_password:
+                        if not agent_config:
+                            agent_config = {}
+                        windows_password = agent_config.get('password')
+
+                    self._validate_windows_properties(
+                        custom_sysprep,
+                        windows_organization,
+                        windows_password)
+
+                    if custom_sysprep is not None:
+                        ident = vim.vm.customization.SysprepText()
+                        ident.value = custom_sysprep
+                    else:
+                        # We use GMT without daylight savings if no timezone is
+                        # supplied, as this is as close to UTC as we can do
+                        if not windows_timezone:
+                            windows_timezone = 90
+
+                        ident = vim.vm.customization.Sysprep()
+                        ident.userData = vim.vm.customization.UserData()
+                        ident.guiUnattended = \
+                            vim.vm.customization.GuiUnattended()
+                        ident.identification = (
+                            vim.vm.customization.Identification()
+                        )
 
-                    # Configure userData
-                    ident.userData.computerName = (
-                        vim.vm.customization.FixedName()
-                    )
-                    ident.userData.computerName.name = vm_name
-                    # Without these vars, customization is silently skipped
-                    # but deployment 'succeeds'
-                    ident.userData.fullName = vm_name
-                    ident.userData.orgName = windows_organization
-                    ident.userData.productId = ""
-
-                    # Configure guiUnattended
-                    ident.guiUnattended.autoLogon = False
-                    ident.guiUnattended.password = (
-                        vim.vm.customization.Password()
+                        # Configure userData
+                        ident.userData.computerName = (
+                            vim.vm.customization.FixedName()
+                        )
+                        ident.userData.computerName.name = vm_name
+                        # Without these vars, customization is silently skipped
+                        # but deployment 'succeeds'
+                        ident.userData.fullName = vm_name
+                        ident.userData.orgName = windows_organization
+                        ident.userData.productId = ""
+
+                        # Configure guiUnattended
+                        ident.guiUnattended.autoLogon = False
+                        ident.guiUnattended.password = (
+                            vim.vm.customization.Password()
+                        )
+                        ident.guiUnattended.password.plainText = True
+                        ident.guiUnattended.password.value = windows_password
+                        ident.guiUnattended.timeZone = windows_timezone
+
+                    # Adding windows options
+                    options = vim.vm.customization.WinOptions()
+                    options.changeSID = True
+                    options.deleteAccounts = False
+                    customspec.options = options
+                elif os_type == 'solaris':
+                    ident = None
+                    self._logger.info(
+                        'Customization of the Solaris OS is unsupported by '
+                        ' vSphere. Guest additions are required/supported.')
+                else:
+                    ident = None
+                    self._logger.info(
+                        'os_type {os_type} was specified, but only '
+                        '"windows", "solaris" and "linux" are supported. '
+                        'Customization is unsupported.'
+                        .format(os_type=os_type)
                     )
-                    ident.guiUnattended.password.plainText = True
-                    ident.guiUnattended.password.value = windows_password
-                    ident.guiUnattended.timeZone = windows_timezone
-
-                # Adding windows options
-                options = vim.vm.customization.WinOptions()
-                options.changeSID = True
-                options.deleteAccounts = False
-                customspec.options = options
-            elif os_type == 'solaris':
-                ident = None
-                self._logger.info(
-                    'Customization of the Solaris OS is unsupported by '
-                    ' vSphere. Guest additions are required/supported.')
-            else:
-                ident = None
-                self._logger.info(
-                    'os_type {os_type} was specified, but only "windows", '
-                    '"solaris" and "linux" are supported. Customization is '
-                    'unsupported.'
-                    .format(os_type=os_type)
-                )
 
-            if ident:
-                customspec.identity = ident
+                if ident:
+                    customspec.identity = ident
 
-                globalip = vim.vm.customization.GlobalIPSettings()
-                if dns_servers:
-                    globalip.dnsServerList = dns_servers
-                customspec.globalIPSettings = globalip
+                    globalip = vim.vm.customization.GlobalIPSettings()
+                    if dns_servers:
+                        globalip.dnsServerList = dns_servers
+                    customspec.globalIPSettings = globalip
 
-                clonespec.customization = customspec
+                    clonespec.customization = customspec
+        except Exception:
+            # Nothing is cloned yet, so nothing holds the resources
+            if reserve:
+                reservations.release(ctx.instance.id)
+            raise
         self._logger.info(
             'Cloning {server} from {template}.'.format(
                 server=vm_name, template=template_name))
@@ -840,6 +890,12 @@ class ServerClient(VsphereClient):
             else:
                 self._wait_for_task(max_wait_time=max_wait_time,
                                     resource_id=VSPHERE_SERVER_ID)
+            # The clone used space on the datastore
+            self._invalidate_snapshots('datastore')
+            if reservations:
+                reservations.release(ctx.instance.id)
+            # The plan is used up, a later create places the server again
+            ctx.instance.runtime_properties.pop(VSPHERE_SERVER_PLACEMENT, None)
 
             ctx.instance.runtime_properties['name'] = vm_name
             ctx.instance.runtime_properties.dirty = True
@@ -854,8 +910,15 @@ class ServerClient(VsphereClient):
             else:
                 self._logger.info('VM created in stopped state')
         except OperationRetry:
+            # The clone is still running, keep its reservation
             raise
         except Exception:
+            if reservations:
+                reservations.release(ctx.instance.id)
+            if ctx.instance.runtime_properties.pop(
+                    VSPHERE_SERVER_PLACEMENT, None):
+                ctx.instance.runtime_properties.dirty = True
+                ctx.instance.update()
             raise NonRecoverableError(
                 "Error during executing VM creation task. "
                 "VM name: \'{0}\'.".format(vm_name))
@@ -1094,6 +1157,7 @@ class ServerClient(VsphereClient):
             self.stop_server(server)
         task = server.obj.Destroy()
         self._wait_for_task(task, max_wait_time=max_wait_time)
+        self._invalidate_snapshots('datastore')
         self._logger.debug("Server is now deleted.")
 
     def get_server_by_name(self, name):
@@ -1137,6 +1201,16 @@ class ServerClient(VsphereClient):
                 '{clusters}'.format(
                     clusters=', '.join(valid_clusters)))
 
+        vm_nets = set([
+            (
+                self._get_normalised_name(network['name']),
+                network['switch_distributed'],
+            )
+            for network in vm_networks
+        ])
+        # Hosts of a cluster share its resource pools
+        parent_resource_pools = {}
+
         candidate_hosts = []
         for host in hosts:
             if not self.host_is_usable(host):
@@ -1168,8 +1242,10 @@ class ServerClient(VsphereClient):
                     'Host {host} will not have enough free memory if all VMs '
                     'are powered on.'.format(host=host.name))
 
-            resource_pools = self.get_host_resource_pools(host)
-            resource_pools = [pool.name for pool in resource_pools]
+            resource_pools = parent_resource_pools.get(host.parent.id)
+            if resource_pools is None:
+                resource_pools = parent_resource_pools[host.parent.id] = [
+                    pool.name for pool in self.get_host_resource_pools(host)]
             if resource_pool not in resource_pools:
                 self._logger.warn(
                     'Host {host} does not have resource pool {rp}.'.format(
@@ -1184,13 +1260,6 @@ class ServerClient(VsphereClient):
                 )
                 for network in self.get_host_networks(host)
             ])
-            vm_nets = set([
-                (
-                    self._get_normalised_name(network['name']),
-                    network['switch_distributed'],
-                )
-                for network in vm_networks
-            ])
 
             nets_not_on_host = vm_nets.difference(host_nets)
 
@@ -1307,6 +1376,10 @@ class ServerClient(VsphereClient):
                 'Only the following datastores will be used: '
                 '{datastores}'.format(datastores=', '.join(valid_datastores)))
 
+        # Datastores shared by several hosts are only rated once
+        usable_datastores = {}
+        datastore_weightings = {}
+
         for host in candidate_hosts:
             host = host[0]
             self._logger.debug('Considering host {host}'.format(
@@ -1339,7 +1412,10 @@ class ServerClient(VsphereClient):
 
             healthy_datastores = []
             for datastore in datastores:
-                if self.datastore_is_usable(datastore):
+                if datastore.id not in usable_datastores:
+                    usable_datastores[datastore.id] = \
+                        self.datastore_is_usable(datastore)
+                if usable_datastores[datastore.id]:
                     self._logger.debug(
                         'Datastore {ds} on host {host} is healthy.'.format(
                             ds=datastore.name,
@@ -1358,11 +1434,14 @@ class ServerClient(VsphereClient):
                         host=host.name))
             candidate_datastores = []
             for datastore in healthy_datastores:
-                weighting = self.calculate_datastore_weighting(
-                    datastore=datastore,
-                    vm_memory=vm_memory,
-                    template=template,
-                )
+                if datastore.id not in datastore_weightings:
+                    datastore_weightings[datastore.id] = \
+                        self.calculate_datastore_weighting(
+                            datastore=datastore,
+                            vm_memory=vm_memory,
+                            template=template,
+                        )
+                weighting = datastore_weightings[datastore.id]
                 if weighting is not None:
                     self._logger.debug(
                         'Datastore {ds} on host {host} has suitability '
@@ -1420,11 +1499,255 @@ class ServerClient(VsphereClient):
                 [candidate[0].name for candidate in candidate_hosts]))
             raise NonRecoverableError(message)
 
+    def _place_server(self,
+                      datacenter,
+                      resource_pool_name,
+                      cpus,
+                      memory,
+                      networks,
+                      template,
+                      allowed_hosts=None,
+                      allowed_clusters=None,
+                      allowed_datastores=None):
+        candidate_hosts = self.find_candidate_hosts(
+            datacenter=datacenter,
+            resource_pool=resource_pool_name,
+            vm_cpus=cpus,
+            vm_memory=memory,
+            vm_networks=networks,
+            allowed_hosts=allowed_hosts,
+            allowed_clusters=allowed_clusters,
+        )
+
+        return self.select_host_and_datastore(
+            candidate_hosts=candidate_hosts,
+            vm_memory=memory,
+            template=template,
+            allowed_datastores=allowed_datastores,
+        )
+
+    @contextmanager
+    def _placement_locked(self, reservations):
+        """
+            Hold the lock of the placement reservations, if placements are
+            reserved.
+        """
+        if reservations is None:
+            yield
+            return
+        with reservations.locked():
+            yield
+
+    @_datacenter_scoped
+    def plan_placements(self, placement_requests, datacenter_name=None):
+        """
+            Place several servers together, against the same capacity.
+            Each request is a dict with the template_name and
+            resource_pool_name of a server, and optionally its networks,
+            cpus, memory, allowed_hosts, allowed_clusters and
+            allowed_datastores. The networks are a list of dicts with the
+            "name" and "switch_distributed" of each network the server is
+            connected to, as create_server gets them.
+            The biggest servers are placed first, and every placement counts
+            towards the capacity left for the next ones.
+            Returns a placement dict for each request, in the same order.
+            If a request has an instance, its placement is also saved in the
+            instance runtime properties, for its create_server to use. It is
+            removed once the clone has been tried.
+            This is meant to be called by a workflow or script that creates
+            several servers, with the node instances of those servers, before
+            their create operations run.
+        """
+        self._prefetch_entities([
+            name for name in self._get_prefetch_getters() if name != 'vm'])
+        datacenter = None
+        if datacenter_name:
+            datacenter = self._get_obj_by_name(
+                vim.Datacenter, datacenter_name)
+
+        shapes = []
+        templates = {}
+        for request in placement_requests:
+            template_name = request['template_name']
+            if template_name not in templates:
+                # Templates may be kept in another datacenter
+                with self._scoped(None):
+                    template = self._get_obj_by_name(
+                        vim.VirtualMachine, template_name,
+                        projections=['identity'])
+                    if template is None:
+                        raise NonRecoverableError(
+                            'VM template {0} could not be found.'.format(
+                                template_name))
+                    templates[template_name] = self._get_obj_by_id(
+                        vim.VirtualMachine, template.id)
+            template = templates[template_name]
+            shapes.append((
+                request.get('cpus') or template.config.hardware.numCPU,
+                request.get('memory') or template.config.hardware.memoryMB,
+                template,
+            ))
+
+        host_usage = self._cache.get('host_usage')
+        reserved_space = self._cache.get('reserved_space')
+        placements = [None] * len(placement_requests)
+        try:
+            self._load_host_usage(self._get_placement_reservations())
+            # The placements change the totals, keep the collected ones
+            self._cache['host_usage'] = dict(self._cache['host_usage'])
+            self._cache['reserved_space'] = dict(
+                self._cache.get('reserved_space', {}))
+
+            for index in sorted(
+                    range(len(placement_requests)),
+                    key=lambda index: shapes[index][:2],
+                    reverse=True):
+                request = placement_requests[index]
+                cpus, memory, template = shapes[index]
+                host, datastore = self._place_server(
+                    datacenter=datacenter,
+                    resource_pool_name=request['resource_pool_name'],
+                    cpus=cpus,
+                    memory=memory,
+                    networks=request.get('networks') or [],
+                    template=template,
+                    allowed_hosts=request.get('allowed_hosts'),
+                    allowed_clusters=request.get('allowed_clusters'),
+                    allowed_datastores=request.get('allowed_datastores'),
+                )
+                self._add_placed_usage(
+                    host, datastore, cpus, memory,
+                    self._get_vm_disk_usage(template, memory))
+                placements[index] = {
+                    'host': host.name,
+                    'host_id': host.id,
+                    'datastore': datastore.name,
+                    'datastore_id': datastore.id,
+                }
+        finally:
+            for key, value in (('host_usage', host_usage),
+                               ('reserved_space', reserved_space)):
+                if value is None:
+                    self._cache.pop(key, None)
+                else:
+                    self._cache[key] = value
+
+        for request, placement in zip(placement_requests, placements):
+            instance = request.get('instance')
+            if instance is not None:
+                instance.runtime_properties[
+                    VSPHERE_SERVER_PLACEMENT] = placement
+                instance.update()
+        return placements
+
+    def _get_planned_placement(self, placement):
+        """
+            Get the host and datastore of a placement from plan_placements,
+            or None if there is no plan or they can no longer be used.
+        """
+        if not placement:
+            return None
+        host = self._get_obj_by_id(vim.HostSystem, placement['host_id'])
+        datastore = self._get_obj_by_id(
+            vim.Datastore, placement['datastore_id'])
+        if host is None or datastore is None or \
+                not self.host_is_usable(host) or \
+                not self.datastore_is_usable(datastore) or \
+                datastore.id not in [ds.id for ds in host.datastore]:
+            self._logger.warn(
+                'Planned host {host} and datastore {ds} cannot be used, '
+                'placing the server again.'.format(
+                    host=placement.get('host'),
+                    ds=placement.get('datastore')))
+            return None
+        self._logger.debug(
+            'Using planned host {host} and datastore {ds}.'.format(
+                host=host.name, ds=datastore.name))
+        return host, datastore
+
+    def _load_host_usage(self, reservations=None, reservation_id=None):
+        """
+            Aggregate the host totals used to rate hosts, including the
+            resources reserved by other placements.
+        """
+        self._get_host_usage()
+        if reservations:
+            # Count the servers placed by concurrent operations
+            self._add_reserved_usage(reservations, reservation_id)
+
+    def _add_placed_usage(self, host, datastore, cpus, memory, disk):
+        usage = self._cache['host_usage']
+        used_memory, used_cpus = usage.get(host.id, HostUsage(0, 0))
+        usage[host.id] = HostUsage(used_memory + memory, used_cpus + cpus)
+        reserved_space = self._cache['reserved_space']
+        reserved_space[datastore.id] = \
+            reserved_space.get(datastore.id, 0) + disk
+
+    def _get_placement_reservations(self):
+        """
+            Get the reservations of placements on this vCenter, or None if
+            placements are not reserved.
+        """
+        if not self.cfg.get('placement_reservations'):
+            return None
+        name = re.sub(r'[^\w.-]', '_', '{host}_{port}'.format(
+            host=self.cfg.get('host'),
+            port=self.cfg.get('port', 443),
+        ))
+        return _PlacementReservations(
+            path=os.path.join(
+                os.path.expanduser(
+                    self.cfg.get('placement_reservations_dir') or
+                    PLACEMENT_RESERVATIONS_DIR),
+                '{name}.json'.format(name=name),
+            ),
+            ttl=int(self.cfg.get('placement_reservations_ttl') or
+                    PLACEMENT_RESERVATIONS_TTL),
+        )
+
+    def _add_reserved_usage(self, reservations, reservation_id):
+        """
+            Add the resources reserved by other placements to the host
+            totals of _get_host_usage, and to the space used on datastores.
+        """
+        reserved_hosts, reserved_datastores = reservations.usage(
+            exclude=reservation_id)
+        usage = dict(self._get_host_usage())
+        for host_id, reserved in reserved_hosts.items():
+            memory, cpus = usage.get(host_id, HostUsage(0, 0))
+            usage[host_id] = HostUsage(
+                memory + reserved.memory, cpus + reserved.cpus)
+        self._cache['host_usage'] = usage
+        self._cache['reserved_space'] = reserved_datastores
+
+    @staticmethod
+    def _get_vm_disk_usage(template, vm_memory):
+        """
+            Space in bytes a VM cloned from template can use on its
+            datastore, with its whole virtual disk filled up.
+        """
+        return (template.summary.storage.committed +
+                template.summary.storage.uncommitted +
+                vm_memory * 1024 * 1024)
+
+    def _get_aggregated_host_usage(self, host):
+        """
+            Get the usage of host from the totals of _get_host_usage, or None
+            if they were not aggregated for this operation.
+        """
+        usage = self._cache.get('host_usage')
+        if usage is not None:
+            return usage.get(host.id, HostUsage(0, 0))
+
     def get_host_free_memory(self, host):
         """
             Get the amount of unallocated memory on a host.
         """
         total_memory = host.hardware.memorySize // 1024 // 1024
+        usage = self._get_aggregated_host_usage(host)
+        if usage is not None:
+            return total_memory - usage.memory
+
         used_memory = 0
         for vm in host.vm:
             if not vm.summary.config.template:
@@ -1451,6 +1774,9 @@ class ServerClient(VsphereClient):
             the actual impact on the one with 12 threads would be lower.
         """
         total_threads = host.hardware.cpuInfo.numCpuThreads
+        usage = self._get_aggregated_host_usage(host)
+        if usage is not None:
+            return total_threads / (vm_cpus + usage.cpus)
 
         total_assigned = vm_cpus
         for vm in host.vm:
@@ -1497,7 +1823,9 @@ class ServerClient(VsphereClient):
         # We assign memory in MB, but free space is in B
         vm_memory_e2 = vm_memory * 1024 * 1024
 
-        free_space = datastore.summary.freeSpace
+        # Less the space reserved by placements of concurrent operations
+        free_space = datastore.summary.freeSpace - \
+            self._cache.get('reserved_space', {}).get(datastore.id, 0)
         minimum_disk = template.summary.storage.committed
         maximum_disk = template.summary.storage.uncommitted
 
@@ -1514,6 +1842,11 @@ class ServerClient(VsphereClient):
             Recursively get all child resource pools given a resource pool.
             Return a list of all resource pools found.
         """
+        pools = self._cache.get('resource_pool')
+        if isinstance(pools, _ResourcePoolList) and \
+                pools.by_id.get(resource_pool.id) is resource_pool:
+            return pools.descendants(resource_pool)
+
         resource_pool_names = []
         for pool in resource_pool.resourcePool:
             resource_pool_names.append(pool)
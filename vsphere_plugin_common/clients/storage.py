@@ -60,7 +60,9 @@ class RawVolumeClient(VsphereClient):
             .format(ids=text_type(allowed_datastore_ids),
                     names=text_type(allowed_datastores)))
 
-        datastores = self._get_datastores()
+        # Only the datastores of the datacenter can hold the file
+        with self._scoped(dc.obj):
+            datastores = self._get_datastores()
         ds = None
         if not allowed_datastores and not allowed_datastore_ids and datastores:
             ds = datastores[0]
@@ -320,6 +322,7 @@ class StorageClient(VsphereClient):
             ctx.instance.runtime_properties.dirty = True
             ctx.instance.update()
             self._wait_for_task(task, max_wait_time=max_wait_time)
+        self._invalidate_snapshots('datastore')
         # remove old vm disk name
         del ctx.instance.runtime_properties['vm_disk_name']
         ctx.instance.runtime_properties.dirty = True
@@ -398,6 +401,7 @@ class StorageClient(VsphereClient):
 
         task = vm.obj.Reconfigure(spec=config_spec)
         self._wait_for_task(task, max_wait_time=max_wait_time)
+        self._invalidate_snapshots('datastore')
 
     def get_storage(self, vm_id, storage_file_name):
         self._logger.debug("Entering get storage procedure.")
@@ -461,6 +465,7 @@ class StorageClient(VsphereClient):
 
         task = vm.obj.Reconfigure(spec=config_spec)
         self._wait_for_task(task, max_wait_time=max_wait_time)
+        self._invalidate_snapshots('datastore')
         self._logger.debug(
             'Storage resized to a new size {storage_size}.'.format(
                 storage_size=storage_size))
@@ -26,6 +26,8 @@ VSPHERE_SERVER_DATASTORE = 'datastores'
 VSPHERE_SERVER_CONNECTED_NICS = 'connected_nics'
 VSPHERE_SERVER_CLUSTER_NAME = 'cluster_name'
 VSPHERE_SERVER_HYPERVISOR_HOSTNAME = 'hypervisor_hostname'
+# host and datastore planned by plan_placements, used by create_server
+VSPHERE_SERVER_PLACEMENT = 'placement'
 VSPHERE_RESOURCE_NAME = 'name'
 VSPHERE_RESOURCE_EXTERNAL = 'use_external_resource'
 SERVER_RUNTIME_PROPERTIES = [VSPHERE_SERVER_ID, PUBLIC_IP, NETWORKS, IP,
@@ -34,6 +36,7 @@ SERVER_RUNTIME_PROPERTIES = [VSPHERE_SERVER_ID, PUBLIC_IP, NETWORKS, IP,
                              VSPHERE_SERVER_CONNECTED_NICS,
                              VSPHERE_SERVER_CLUSTER_NAME,
                              VSPHERE_SERVER_HYPERVISOR_HOSTNAME,
+                             VSPHERE_SERVER_PLACEMENT,
                              VSPHERE_RESOURCE_NAME,
                              VSPHERE_RESOURCE_EXTERNAL]
 
@@ -94,12 +97,33 @@ CONTENT_LIBRARY_PROPERTIES = [CONTENT_ITEM_ID,
                               VSPHERE_SERVER_ID]
 
 TASK_CHECK_SLEEP = 15
+# maximum objects returned by each property collector call
+COLLECTOR_PAGE_SIZE = 1000
 PREFIX_RANDOM_CHARS = 3
 
 MANAGER_PLUGIN_FILES = os.path.join('/etc', 'cloudify', 'vsphere_plugin')
 DEFAULT_CONFIG_PATH = os.path.join(
     MANAGER_PLUGIN_FILES,
     'connection_config.yaml')
+# inventory snapshots shared by operations, when snapshot_cache is enabled
+SNAPSHOT_CACHE_DIR = os.path.join(MANAGER_PLUGIN_FILES, 'inventory_cache')
+# API versions negotiated with each vCenter, when api_version_cache is enabled
+API_VERSION_CACHE_DIR = os.path.join(MANAGER_PLUGIN_FILES, 'api_versions')
+# vCenter session cookies reused by operations, when session_cache is enabled
+SESSION_CACHE_DIR = os.path.join(MANAGER_PLUGIN_FILES, 'sessions')
+# resources reserved by placements, when placement_reservations is enabled
+PLACEMENT_RESERVATIONS_DIR = os.path.join(
+    MANAGER_PLUGIN_FILES, 'placement_reservations')
+# seconds a reservation is kept if the clone never finishes
+PLACEMENT_RESERVATIONS_TTL = 1800
+# seconds each entity type is served from a snapshot, VMs are always live
+SNAPSHOT_CACHE_TTL = {
+    'datacenter': 3600,
+    'cluster': 600,
+    'dvswitch': 600,
+    'vm_folder': 600,
+    'datastore': 120,
+}
 
 # Cloudify delete node action
 DELETE_NODE_ACTION = "cloudify.interfaces.lifecycle.delete"
@@ -108,6 +132,8 @@ DELETE_NODE_ACTION = "cloudify.interfaces.lifecycle.delete"
 ASYNC_TASK_ID = '_task_id'
 # field name for save resulted resource id
 ASYNC_RESOURCE_ID = '_resource_id'
+# entity of the saved task, to find it in the task history once it expires
+ASYNC_TASK_ENTITY = '_task_entity'
 
 SUPPORT_DRIFT = [
     'cloudify.nodes.vsphere.Server',
@@ -18,6 +18,7 @@ import unittest
 
 from mock import MagicMock, patch
 from pyfakefs import fake_filesystem_unittest
+import yaml
 
 from cloudify.state import current_ctx
 
@@ -94,6 +95,24 @@ class VspherePluginCommonFSTests(fake_filesystem_unittest.TestCase):
 
         self.assertEqual({'some': 'contents'}, ret)
 
+    def test_get_parses_changed_file(self):
+        self.fs.create_file(
+            '/a/pth',
+            contents="{'some': 'contents'}\n"
+        )
+        with patch.dict('os.environ', {'CFY_VSPHERE_CONFIG_PATH': '/a/pth'}):
+            with patch('yaml.safe_load',
+                       wraps=yaml.safe_load) as safe_load:
+                first = Config().get()
+                first['changed'] = True
+                self.assertEqual({'some': 'contents'}, Config().get())
+                self.assertEqual(safe_load.call_count, 1)
+
+                with open('/a/pth', 'w') as f:
+                    f.write("{'other': 'contents'}\n")
+                self.assertEqual({'other': 'contents'}, Config().get())
+                self.assertEqual(safe_load.call_count, 2)
+
 
 if __name__ == '__main__':
     unittest.main()
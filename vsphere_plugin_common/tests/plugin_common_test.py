@@ -14,7 +14,10 @@
 # limitations under the License.
 import os
 import ssl
+import json
 import time
+import shutil
+import tempfile
 import socket
 import unittest
 import subprocess
@@ -23,13 +26,16 @@ import multiprocessing
 from mock import Mock, MagicMock, patch, call
 
 from cloudify.state import current_ctx
+from cloudify.manager import DirtyTrackingDict
 from cloudify.exceptions import NonRecoverableError, OperationRetry
 
 from .. import (VsphereClient, ServerClient)
 
-from ..clients import vim
+from ..clients import (
+    vim, vmodl, HostUsage, _EntityList, _MappingResolver)
 from .._compat import (
     HTTPServer,
+    HTTPException,
     SimpleHTTPRequestHandler)
 
 
@@ -304,6 +310,43 @@ class VspherePluginsCommonTests(unittest.TestCase):
 
         self.assertEqual(result, expected_result)
 
+    @patch('vsphere_plugin_common.ServerClient.host_cpu_thread_usage_ratio')
+    @patch('vsphere_plugin_common.ServerClient.get_host_resource_pools')
+    @patch('vsphere_plugin_common.ServerClient.get_host_free_memory')
+    @patch('vsphere_plugin_common.VsphereClient._get_hosts')
+    def test_find_candidate_hosts_shared_resource_pools(
+            self,
+            mock_get_hosts,
+            mock_get_free_memory,
+            mock_get_resource_pools,
+            mock_get_cpu_ratio):
+        cluster = Mock()
+        hosts = [self._make_mock_host(name) for name in ('one', 'two')]
+        for host in hosts:
+            host.parent = cluster
+        standalone_host = self._make_mock_host('three')
+        hosts.append(standalone_host)
+        mock_get_hosts.return_value = hosts
+        mock_get_free_memory.return_value = 4096
+        mock_get_resource_pools.return_value = [
+            self._make_mock_resource_pool('rp')]
+        mock_get_cpu_ratio.return_value = 1.0
+
+        client = ServerClient()
+        result = client.find_candidate_hosts(
+            resource_pool='rp',
+            vm_cpus=1,
+            vm_memory=1024,
+            vm_networks=[],
+        )
+
+        self.assertEqual([candidate[0] for candidate in result], hosts)
+        # The pools of a cluster are only looked up for its first host
+        self.assertEqual(
+            mock_get_resource_pools.mock_calls,
+            [call(hosts[0]), call(standalone_host)],
+        )
+
     @patch('vsphere_plugin_common.ServerClient.host_cpu_thread_usage_ratio')
     @patch('vsphere_plugin_common.ServerClient.get_host_networks')
     @patch('vsphere_plugin_common.ServerClient.get_host_resource_pools')
@@ -1224,7 +1267,7 @@ class VspherePluginsCommonTests(unittest.TestCase):
         ]
         mock_datastore_is_usable.return_value = True
         template = self._make_mock_vm(name='mytemplate')
-        mock_datastore_weighting.side_effect = (1, 100, 1000)
+        mock_datastore_weighting.side_effect = (1, 100)
 
         memory = 1024
 
@@ -1246,7 +1289,6 @@ class VspherePluginsCommonTests(unittest.TestCase):
             [
                 call(wrong_datastore),
                 call(right_datastore),
-                call(wrong_datastore),
             ],
         )
         self.assertEqual(
@@ -1262,11 +1304,6 @@ class VspherePluginsCommonTests(unittest.TestCase):
                     vm_memory=memory,
                     template=template,
                 ),
-                call(
-                    datastore=wrong_datastore,
-                    vm_memory=memory,
-                    template=template,
-                ),
             ],
         )
 
@@ -1304,7 +1341,7 @@ class VspherePluginsCommonTests(unittest.TestCase):
         ]
         mock_datastore_is_usable.return_value = True
         template = self._make_mock_vm(name='mytemplate')
-        mock_datastore_weighting.side_effect = (-100, -2, -1)
+        mock_datastore_weighting.side_effect = (-100, -2)
 
         memory = 1024
 
@@ -1326,7 +1363,6 @@ class VspherePluginsCommonTests(unittest.TestCase):
             [
                 call(wrong_datastore),
                 call(right_datastore),
-                call(wrong_datastore),
             ],
         )
         self.assertEqual(
@@ -1342,11 +1378,6 @@ class VspherePluginsCommonTests(unittest.TestCase):
                     vm_memory=memory,
                     template=template,
                 ),
-                call(
-                    datastore=wrong_datastore,
-                    vm_memory=memory,
-                    template=template,
-                ),
             ],
         )
 
@@ -1384,7 +1415,7 @@ class VspherePluginsCommonTests(unittest.TestCase):
         ]
         mock_datastore_is_usable.return_value = True
         template = self._make_mock_vm(name='mytemplate')
-        mock_datastore_weighting.side_effect = (-100, -2, 1)
+        mock_datastore_weighting.side_effect = (-100, 1)
 
         memory = 1024
 
@@ -1404,7 +1435,6 @@ class VspherePluginsCommonTests(unittest.TestCase):
         self.assertEqual(
             mock_datastore_is_usable.mock_calls,
             [
-                call(wrong_datastore),
                 call(wrong_datastore),
                 call(right_datastore),
             ],
@@ -1412,11 +1442,6 @@ class VspherePluginsCommonTests(unittest.TestCase):
         self.assertEqual(
             mock_datastore_weighting.mock_calls,
             [
-                call(
-                    datastore=wrong_datastore,
-                    vm_memory=memory,
-                    template=template,
-                ),
                 call(
                     datastore=wrong_datastore,
                     vm_memory=memory,
@@ -1430,6 +1455,28 @@ class VspherePluginsCommonTests(unittest.TestCase):
             ],
         )
 
+    @patch('vsphere_plugin_common.ServerClient._wait_for_task')
+    def test_remove_nic_keys(self, mock_wait_for_task):
+        server = Mock()
+        devices = [vim.vm.device.VirtualVmxnet3(key=key)
+                   for key in (4000, 4001, 4002)]
+        server.config.hardware.device = devices
+
+        client = ServerClient()
+        client.remove_nic_keys(server, [4000, 4002])
+
+        # All of the nics are removed by one reconfiguration
+        server.obj.ReconfigVM_Task.assert_called_once()
+        spec = server.obj.ReconfigVM_Task.call_args[1]['spec']
+        self.assertEqual(
+            [change.device for change in spec.deviceChange],
+            [devices[0], devices[2]])
+        self.assertEqual(
+            set(change.operation for change in spec.deviceChange),
+            {vim.vm.device.VirtualDeviceSpec.Operation.remove})
+        mock_wait_for_task.assert_called_once_with(
+            server.obj.ReconfigVM_Task.return_value)
+
     def test_get_host_free_memory_no_vms(self):
         expected = 12345
         host = self._make_mock_host(memory=expected)
@@ -1461,6 +1508,24 @@ class VspherePluginsCommonTests(unittest.TestCase):
 
         self.assertEqual(result, expected)
 
+    def test_host_usage_aggregated(self):
+        host = self._make_mock_host(memory=4096, cpus=8, vms=[
+            self._make_mock_vm(memory=1024)])
+        host.id = 'host-1'
+        other_host = self._make_mock_host(memory=4096, cpus=8)
+        other_host.id = 'host-2'
+
+        client = ServerClient()
+        client._cache['host_usage'] = {'host-1': HostUsage(1536, 6)}
+
+        # The aggregated totals are used instead of the VMs of the host
+        self.assertEqual(client.get_host_free_memory(host), 2560)
+        self.assertEqual(client.host_cpu_thread_usage_ratio(host, 2), 1)
+        # Hosts without VMs have no usage
+        self.assertEqual(client.get_host_free_memory(other_host), 4096)
+        self.assertEqual(
+            client.host_cpu_thread_usage_ratio(other_host, 2), 4)
+
     def test_host_cpu_thread_usage_ratio_no_vms(self):
         host_cpus = 4
         new_vm_cpus = 4
@@ -1634,6 +1699,293 @@ class VspherePluginsCommonTests(unittest.TestCase):
 
         self.assertEqual(result, expected_weighting)
 
+    def test_placement_reservations(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        client = ServerClient()
+        client.cfg = {
+            'host': 'vcenter',
+            'placement_reservations': True,
+            'placement_reservations_dir': directory,
+        }
+        reservations = client._get_placement_reservations()
+        self.assertEqual(
+            reservations.path, os.path.join(directory, 'vcenter_443.json'))
+
+        reservations.reserve('server_1', host='host-1', datastore='ds-1',
+                             cpus=2, memory=1024, disk=100)
+        reservations.reserve('server_2', host='host-1', datastore='ds-2',
+                             cpus=1, memory=512, disk=50)
+        reservations.reserve('server_3', host='host-2', datastore='ds-1',
+                             cpus=4, memory=2048, disk=10)
+        reservations.release('server_3')
+
+        self.assertEqual(
+            reservations.usage(),
+            ({'host-1': HostUsage(memory=1536, cpus=3)},
+             {'ds-1': 100, 'ds-2': 50}))
+        # An operation does not count its own reservation
+        self.assertEqual(
+            reservations.usage(exclude='server_2'),
+            ({'host-1': HostUsage(memory=1024, cpus=2)}, {'ds-1': 100}))
+
+        client._cache['host_usage'] = {'host-1': HostUsage(4096, 4)}
+        client._add_reserved_usage(reservations, 'server_2')
+        self.assertEqual(client._cache['host_usage'],
+                         {'host-1': HostUsage(5120, 6)})
+        datastore = self._make_mock_datastore(free_space=1100)
+        datastore.id = 'ds-1'
+        template = self._make_mock_vm(min_space=0, extra_space=0)
+        self.assertEqual(
+            client.calculate_datastore_weighting(
+                datastore=datastore, vm_memory=0, template=template),
+            1000)
+
+        # Expired reservations are dropped
+        reservations.ttl = -1
+        reservations.reserve('server_1', host='host-1', datastore='ds-1',
+                             cpus=2, memory=1024, disk=100)
+        self.assertEqual(
+            reservations.usage(),
+            ({'host-1': HostUsage(memory=512, cpus=1)}, {'ds-2': 50}))
+
+        client.cfg['placement_reservations'] = False
+        self.assertIsNone(client._get_placement_reservations())
+
+    def test_create_server_releases_reservation(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        client = ServerClient()
+        client.cfg = {
+            'host': 'vcenter',
+            'placement_reservations': True,
+            'placement_reservations_dir': directory,
+        }
+        reservations = client._get_placement_reservations()
+        self.mock_ctx.instance.id = 'server_1'
+        runtime_properties = DirtyTrackingDict()
+        self.mock_ctx.instance.runtime_properties = runtime_properties
+        runtime_properties['placement'] = {
+            'host_id': 'host-1', 'datastore_id': 'datastore-1'}
+
+        template = self._make_mock_vm(name='template')
+        template.config.hardware.numCPU = 1
+        template.config.hardware.memoryMB = 1024
+        datastore = self._make_mock_datastore()
+        datastore.id = 'datastore-1'
+        datastore.obj = vim.Datastore('datastore-1')
+        host = self._make_mock_host(datastores=[datastore])
+        host.id = 'host-1'
+        client._prefetch_entities = Mock()
+        client._validate_inputs = Mock()
+        client._get_obj_by_name = Mock(return_value=template)
+        client._get_obj_by_id = Mock(return_value=template)
+        client._get_planned_placement = Mock(return_value=(host, datastore))
+        client._get_vm_disk_usage = Mock(return_value=10)
+        client._update_vm = Mock(return_value=[])
+        client._get_port_group_names = Mock(return_value=([], []))
+        client.get_resource_pool = Mock(
+            side_effect=NonRecoverableError('no resource pool'))
+
+        def create_server():
+            client.create_server(
+                auto_placement=True, cpus=None, datacenter_name='dc',
+                memory=None, networks=[], resource_pool_name='rp',
+                template_name='template', vm_name='server',
+                windows_password=None, windows_organization=None,
+                windows_timezone=None, agent_config=None,
+                custom_sysprep=None)
+
+        # A step between the placement and the clone fails
+        with self.assertRaises(NonRecoverableError):
+            create_server()
+        self.assertEqual(reservations.load(), {})
+        # The planned placement does not need the whole inventory
+        client._prefetch_entities.assert_not_called()
+        # and is kept for the next attempt
+        self.assertIn('placement', runtime_properties)
+
+        # The clone fails after the resources were reserved
+        client.get_resource_pool.side_effect = None
+        client.get_resource_pool.return_value = Mock(
+            obj=vim.ResourcePool('resgroup-1'))
+        reserved = []
+
+        def clone(**_):
+            reserved.append(reservations.usage())
+            raise vmodl.MethodFault()
+
+        template.obj.Clone = Mock(side_effect=clone)
+        with self.assertRaises(NonRecoverableError):
+            create_server()
+        self.assertEqual(
+            reserved,
+            [({'host-1': HostUsage(memory=1024, cpus=1)},
+              {'datastore-1': 10})])
+        self.assertEqual(reservations.load(), {})
+        # The plan is not reused once the clone was tried
+        self.assertNotIn('placement', runtime_properties)
+
+        # The clone succeeds
+        runtime_properties['placement'] = {
+            'host_id': 'host-1', 'datastore_id': 'datastore-1'}
+        template.obj.Clone = Mock()
+        client._wait_for_task = Mock()
+        client._wait_vm_running = Mock(return_value=True)
+        create_server()
+        self.assertEqual(reservations.load(), {})
+        self.assertNotIn('placement', runtime_properties)
+
+    def test_create_server_reservations_interleaved(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cfg = {
+            'host': 'vcenter',
+            'placement_reservations': True,
+            'placement_reservations_dir': directory,
+        }
+        template = self._make_mock_vm(name='template')
+        template.config.hardware.numCPU = 1
+        template.config.hardware.memoryMB = 1024
+        datastore = self._make_mock_datastore()
+        datastore.id = 'datastore-1'
+        host = self._make_mock_host(datastores=[datastore])
+        host.id = 'host-1'
+
+        def make_client():
+            client = ServerClient()
+            client.cfg = dict(cfg)
+            client._prefetch_entities = Mock()
+            client._validate_inputs = Mock()
+            client._get_obj_by_name = Mock(return_value=template)
+            client._get_obj_by_id = Mock(return_value=template)
+            client._get_planned_placement = Mock(return_value=None)
+            client._get_host_usage = Mock(return_value={})
+            client._get_vm_disk_usage = Mock(return_value=10)
+
+            def place_server(**_):
+                seen.append(dict(client._cache['host_usage']))
+                return host, datastore
+            client._place_server = Mock(side_effect=place_server)
+            client.get_resource_pool = Mock(
+                side_effect=NonRecoverableError('no resource pool'))
+            return client
+
+        def create_server(client, instance_id):
+            self.mock_ctx.instance.id = instance_id
+            with self.assertRaises(NonRecoverableError):
+                client.create_server(
+                    auto_placement=True, cpus=None, datacenter_name='dc',
+                    memory=None, networks=[], resource_pool_name='rp',
+                    template_name='template', vm_name='server',
+                    windows_password=None, windows_organization=None,
+                    windows_timezone=None, agent_config=None,
+                    custom_sysprep=None)
+
+        seen = []
+        first = make_client()
+        second = make_client()
+        reservations = first._get_placement_reservations()
+        reserved = []
+
+        def interleave(**_):
+            # The second create places its server while the first one is
+            # still getting ready to clone
+            reserved.append(sorted(reservations.load()))
+            create_server(second, 'server_2')
+            self.mock_ctx.instance.id = 'server_1'
+            raise NonRecoverableError('no resource pool')
+
+        first.get_resource_pool.side_effect = interleave
+        create_server(first, 'server_1')
+
+        self.assertEqual(reserved, [['server_1']])
+        self.assertEqual(
+            seen, [{}, {'host-1': HostUsage(memory=1024, cpus=1)}])
+        # Neither server was cloned, so nothing stays reserved
+        self.assertEqual(reservations.load(), {})
+
+    @patch('vsphere_plugin_common.ServerClient.get_host_networks')
+    @patch('vsphere_plugin_common.ServerClient.get_host_resource_pools')
+    @patch('vsphere_plugin_common.VsphereClient._get_hosts')
+    @patch('vsphere_plugin_common.VsphereClient._get_obj_by_id')
+    @patch('vsphere_plugin_common.VsphereClient._get_obj_by_name')
+    @patch('vsphere_plugin_common.VsphereClient._prefetch_entities')
+    def test_plan_placements(self,
+                             mock_prefetch,
+                             mock_get_obj_by_name,
+                             mock_get_obj_by_id,
+                             mock_get_hosts,
+                             mock_get_resource_pools,
+                             mock_get_networks):
+        datastore = self._make_mock_datastore(free_space=100 * 1024 ** 3)
+        datastore.id = 'datastore-1'
+        hosts = [
+            self._make_mock_host(name=name, memory=16384, cpus=8,
+                                 datastores=[datastore])
+            for name in ('host1', 'host2')
+        ]
+        for host_id, host in enumerate(hosts, 1):
+            host.id = 'host-{0}'.format(host_id)
+        mock_get_hosts.return_value = hosts
+        mock_get_resource_pools.return_value = [
+            self._make_mock_resource_pool('rp')]
+        mock_get_networks.return_value = []
+        mock_get_obj_by_name.return_value = Mock(id='vm-1')
+        template = self._make_mock_vm(name='template')
+        template.config.hardware.numCPU = 1
+        template.config.hardware.memoryMB = 1024
+        mock_get_obj_by_id.return_value = template
+
+        client = ServerClient()
+        client._cache['host_usage'] = {}
+        instance = Mock(runtime_properties={})
+        requests = [
+            {'template_name': 'template', 'resource_pool_name': 'rp'},
+            {'template_name': 'template', 'resource_pool_name': 'rp',
+             'cpus': 4, 'memory': 8192},
+            {'template_name': 'template', 'resource_pool_name': 'rp',
+             'cpus': 4, 'memory': 8192, 'instance': instance},
+        ]
+
+        placements = client.plan_placements(requests)
+
+        # The biggest servers are placed first, each on its own host
+        self.assertEqual(
+            [placement['host_id'] for placement in placements],
+            ['host-1', 'host-1', 'host-2'])
+        self.assertEqual(placements[2], {
+            'host': 'host2',
+            'host_id': 'host-2',
+            'datastore': datastore.name,
+            'datastore_id': 'datastore-1',
+        })
+        self.assertEqual(
+            instance.runtime_properties, {'placement': placements[2]})
+        instance.update.assert_called_once_with()
+        # The template is only looked up once
+        self.assertEqual(mock_get_obj_by_name.call_count, 1)
+        # The collected totals are kept as they were
+        self.assertEqual(client._cache['host_usage'], {})
+        self.assertNotIn('reserved_space', client._cache)
+
+    def test_get_planned_placement(self):
+        datastore = self._make_mock_datastore()
+        datastore.id = 'datastore-1'
+        host = self._make_mock_host(datastores=[datastore])
+        placement = {'host': 'host', 'host_id': 'host-1',
+                     'datastore': 'ds', 'datastore_id': 'datastore-1'}
+        client = ServerClient()
+        client._get_obj_by_id = Mock(side_effect=[host, datastore])
+
+        self.assertEqual(
+            client._get_planned_placement(placement), (host, datastore))
+        self.assertIsNone(client._get_planned_placement(None))
+
+        # The server is placed again if the planned host went away
+        client._get_obj_by_id = Mock(side_effect=[None, datastore])
+        self.assertIsNone(client._get_planned_placement(placement))
+
     def test_recurse_resource_pools_no_children(self):
         pool_name = 'pool1'
         expected = []
@@ -1951,8 +2303,8 @@ class VspherePluginsCommonTests(unittest.TestCase):
         )
 
     @patch('pyVmomi.vim.vm.ConfigSpec')
-    @patch('vsphere_plugin_common.VsphereClient._get_tasks')
-    def test_wait_for_task(self, get_tasks, configSpec):
+    @patch('vsphere_plugin_common.VsphereClient._get_task_by_id')
+    def test_wait_for_task(self, get_task, configSpec):
         client = ServerClient()
         # failed task
         task = Mock()
@@ -1966,7 +2318,7 @@ class VspherePluginsCommonTests(unittest.TestCase):
         client._wait_for_task(task=None, instance=instance)
 
         # outdated task id
-        get_tasks.return_value = []
+        get_task.return_value = None
         instance = Mock()
         instance.runtime_properties = {
             '_task_id': 42
@@ -1978,10 +2330,7 @@ class VspherePluginsCommonTests(unittest.TestCase):
         task = Mock()
         task.info.state = vim.TaskInfo.State.error
         task._moId = 42
-        task_obj = Mock()
-        task_obj.obj = task
-        task_obj.id = 42
-        get_tasks.return_value = [task_obj]
+        get_task.return_value = task
         instance = Mock()
         instance.runtime_properties = {
             '_task_id': 42,
@@ -1995,10 +2344,7 @@ class VspherePluginsCommonTests(unittest.TestCase):
         task.info.state = vim.TaskInfo.State.success
         task.info.result._moId = 404
         task._moId = 42
-        task_obj = Mock()
-        task_obj.obj = task
-        task_obj.id = 42
-        get_tasks.return_value = [task_obj]
+        get_task.return_value = task
         instance = Mock()
         instance.runtime_properties = {
             '_task_id': 42,
@@ -2012,19 +2358,287 @@ class VspherePluginsCommonTests(unittest.TestCase):
         task.info.state = vim.TaskInfo.State.queued
         task.info.result._moId = 404
         task._moId = 42
-        task_obj = Mock()
-        task_obj.obj = task
-        task_obj.id = 42
-        get_tasks.return_value = [task_obj]
+        get_task.return_value = task
         instance = Mock()
         instance.runtime_properties = {
             '_task_id': 42,
             '_resource_id': 'check_id'
         }
         with self.assertRaises(OperationRetry):
-            with patch("vsphere_plugin_common.clients.server.time", Mock()):
+            with patch("vsphere_plugin_common.clients.time", Mock()):
                 client._wait_for_task(task=None, instance=instance)
 
+    def test_get_task_by_id(self):
+        client = ServerClient()
+        client.si = MagicMock()
+
+        task = client._get_task_by_id('task-1')
+
+        self.assertIsInstance(task, vim.Task)
+        self.assertEqual(task._moId, 'task-1')
+        self.assertIs(task._stub, client.si._stub)
+        client.si.content.taskManager.CreateCollectorForTasks\
+            .assert_not_called()
+
+    def test_get_task_by_id_expired(self):
+        client = ServerClient()
+        client.si = MagicMock()
+        client.si._stub.InvokeAccessor.side_effect = \
+            vmodl.fault.ManagedObjectNotFound()
+        collector = \
+            client.si.content.taskManager.CreateCollectorForTasks()
+        info = vim.TaskInfo(
+            key='task-1', task=vim.Task('task-1'),
+            state=vim.TaskInfo.State.success)
+        collector.latestPage = [
+            vim.TaskInfo(key='task-3', task=vim.Task('task-3'))]
+        collector.ReadPreviousTasks.side_effect = [
+            [vim.TaskInfo(key='task-2', task=vim.Task('task-2'))],
+            [info],
+        ]
+
+        self.assertIsNone(client._get_task_by_id('task-1'))
+        task = client._get_task_by_id(
+            'task-1', ['VirtualMachine', 'vm-1'])
+
+        self.assertEqual(task._moId, 'task-1')
+        self.assertIs(task.info, info)
+        filter_spec = client.si.content.taskManager.CreateCollectorForTasks\
+            .call_args[0][0]
+        self.assertEqual(filter_spec.entity.entity, vim.VirtualMachine('vm-1'))
+        collector.DestroyCollector.assert_called_once_with()
+
+        # finished tasks are not waited for
+        instance = Mock()
+        instance.runtime_properties = {
+            '_task_id': 'task-1',
+            '_resource_id': None,
+            '_task_entity': ['VirtualMachine', 'vm-1'],
+        }
+        with patch.object(client, '_get_task_by_id', return_value=task):
+            client._wait_for_task(instance=instance)
+        self.assertEqual(instance.runtime_properties, {})
+
+    def test_get_task_by_id_latest_page(self):
+        client = ServerClient()
+        client.si = MagicMock()
+        client.si._stub.InvokeAccessor.side_effect = \
+            vmodl.fault.ManagedObjectNotFound()
+        collector = \
+            client.si.content.taskManager.CreateCollectorForTasks()
+        info = vim.TaskInfo(
+            key='task-1', task=vim.Task('task-1'),
+            state=vim.TaskInfo.State.success)
+        # Recent tasks are only in the latest page, not in the previous ones
+        collector.latestPage = [
+            vim.TaskInfo(key='task-2', task=vim.Task('task-2')), info]
+        collector.ReadPreviousTasks.return_value = []
+
+        task = client._get_task_by_id('task-1', ['VirtualMachine', 'vm-1'])
+
+        self.assertIs(task.info, info)
+        collector.ReadPreviousTasks.assert_not_called()
+        collector.DestroyCollector.assert_called_once_with()
+
+        # A task in neither is not found
+        self.assertIsNone(
+            client._get_task_by_id('task-9', ['VirtualMachine', 'vm-1']))
+        collector.ReadPreviousTasks.assert_called_once()
+
+    @patch('vsphere_plugin_common.clients.atexit')
+    @patch('vsphere_plugin_common.clients.SoapStubAdapter')
+    @patch('vsphere_plugin_common.clients.SmartConnectNoSSL')
+    def test_connect_session_cache(self, connect, stub_adapter, atexit):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cfg = {
+            'host': 'vcenter',
+            'port': 443,
+            'username': 'user@vsphere.local',
+            'password': 'pass',
+            'allow_insecure': True,
+            'session_cache': True,
+            'session_cache_dir': directory,
+        }
+        connect.return_value._stub.cookie = 'vmware_soap_session="1"'
+        connect.return_value._stub.version = 'vim.version.version12'
+        stub = stub_adapter.return_value
+
+        # first operation logs in and saves the session
+        client = VsphereClient().connect(cfg)
+        self.assertIs(client.si, connect.return_value)
+        path = os.path.join(directory, 'vcenter_443_user@vsphere.local.json')
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        atexit.register.assert_not_called()
+
+        # next one reuses it
+        client = VsphereClient().connect(cfg)
+        self.assertIs(client.si._stub, stub)
+        self.assertEqual(stub.cookie, 'vmware_soap_session="1"')
+        self.assertEqual(stub_adapter.call_args[1]['version'],
+                         'vim.version.version12')
+        self.assertEqual(connect.call_count, 1)
+
+        # and logs in again once it has expired
+        stub.InvokeAccessor.return_value.sessionManager.currentSession = None
+        client = VsphereClient().connect(cfg)
+        self.assertIs(client.si, connect.return_value)
+        self.assertEqual(connect.call_count, 2)
+        self.assertTrue(os.path.exists(path))
+        atexit.register.assert_not_called()
+
+    @patch('vsphere_plugin_common.clients.atexit', Mock())
+    @patch('vsphere_plugin_common.clients.SoapStubAdapter')
+    @patch('vsphere_plugin_common.clients.SmartConnectNoSSL')
+    def test_connect_session_cache_probe_fails(self, connect, stub_adapter):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cfg = {
+            'host': 'vcenter',
+            'port': 443,
+            'username': 'user',
+            'password': 'pass',
+            'allow_insecure': True,
+            'session_cache': True,
+            'session_cache_dir': directory,
+        }
+        connect.return_value._stub.cookie = 'vmware_soap_session="1"'
+        connect.return_value._stub.version = 'vim.version.version12'
+        VsphereClient().connect(cfg)
+        connect.return_value._stub.cookie = 'vmware_soap_session="2"'
+
+        # The saved session cannot be checked, so it is not reused
+        stub_adapter.return_value.InvokeAccessor.side_effect = \
+            HTTPException('503 Service Unavailable')
+        client = VsphereClient().connect(cfg)
+
+        self.assertIs(client.si, connect.return_value)
+        self.assertEqual(connect.call_count, 2)
+        with open(os.path.join(directory, 'vcenter_443_user.json')) as saved:
+            self.assertEqual(json.load(saved)['cookie'],
+                             'vmware_soap_session="2"')
+
+    @patch('vsphere_plugin_common.clients.atexit', Mock())
+    @patch('vsphere_plugin_common.clients.Connect')
+    @patch('vsphere_plugin_common.clients.SmartConnect')
+    def test_connect_api_version_cache(self, smart_connect, connect):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cfg = {
+            'host': 'vcenter',
+            'port': 443,
+            'username': 'user',
+            'password': 'pass',
+            'certificate_data': '-----BEGIN CERTIFICATE-----',
+        }
+        smart_connect.return_value._stub.version = 'vim.version.version12'
+        client = VsphereClient()
+        version_path = os.path.join(directory, 'vcenter_443')
+
+        with patch('vsphere_plugin_common.clients.API_VERSION_CACHE_DIR',
+                   directory), \
+                patch('vsphere_plugin_common.clients.ssl') as ssl_module:
+            ssl_module._create_default_https_context.return_value\
+                .verify_mode = 2
+            # nothing is saved unless the cache is enabled
+            client.connect(cfg)
+            self.assertFalse(os.path.exists(version_path))
+            connect.assert_not_called()
+
+            # the version is negotiated once
+            cfg['api_version_cache'] = True
+            client.connect(cfg)
+            with open(version_path) as saved:
+                self.assertEqual(saved.read(), 'vim.version.version12')
+            self.assertEqual(smart_connect.call_count, 2)
+
+            # and used directly after that
+            self.assertIs(client.connect(cfg).si, connect.return_value)
+            self.assertEqual(connect.call_args[1]['version'],
+                             'vim.version.version12')
+            self.assertEqual(smart_connect.call_count, 2)
+
+            # unless the server rejects it
+            connect.side_effect = vmodl.fault.NotSupported()
+            self.assertIs(client.connect(cfg).si, smart_connect.return_value)
+            self.assertEqual(smart_connect.call_count, 3)
+
+            # or the request fails before it reaches the API
+            connect.side_effect = HTTPException('404 Not Found')
+            smart_connect.side_effect = vim.fault.InvalidLogin()
+            with self.assertRaises(NonRecoverableError):
+                client.connect(cfg)
+            self.assertEqual(smart_connect.call_count, 4)
+            # and the rejected version is not tried again
+            self.assertFalse(os.path.exists(version_path))
+            smart_connect.side_effect = None
+
+            # but not for bad credentials
+            client.connect(cfg)
+            connect.side_effect = vim.fault.InvalidLogin()
+            with self.assertRaises(NonRecoverableError):
+                client.connect(cfg)
+            self.assertEqual(smart_connect.call_count, 5)
+
+    def _make_task_update(self, version, state):
+        change = vmodl.query.PropertyCollector.Change(
+            name='info.state', op='assign', val=state)
+        return Mock(version=version, filterSet=[
+            Mock(objectSet=[Mock(changeSet=[change])])])
+
+    def test_wait_for_task_updates(self):
+        client = ServerClient()
+        client.si = MagicMock()
+        collector = \
+            client.si.content.propertyCollector.CreatePropertyCollector()
+        collector.WaitForUpdatesEx.side_effect = [
+            self._make_task_update('1', vim.TaskInfo.State.queued),
+            self._make_task_update('2', vim.TaskInfo.State.running),
+            None,
+            self._make_task_update('3', vim.TaskInfo.State.success),
+        ]
+        stub = MagicMock()
+        stub.InvokeAccessor.return_value.state = \
+            vim.TaskInfo.State.success
+        task = vim.Task('task-1', stub)
+
+        with patch("vsphere_plugin_common.clients.time.sleep") as sleep:
+            client._wait_for_task(task=task, instance=None)
+
+        sleep.assert_not_called()
+        self.assertEqual(
+            [c[0][0] for c in collector.WaitForUpdatesEx.call_args_list],
+            ['', '1', '2', '2'])
+        filter_spec = collector.CreateFilter.call_args[0][0]
+        self.assertIs(filter_spec.objectSet[0].obj, task)
+        self.assertEqual(filter_spec.propSet[0].pathSet,
+                         ['info.state', 'info.error', 'info.result'])
+        collector.DestroyPropertyCollector.assert_called_once_with()
+
+    def test_wait_for_task_updates_timeout(self):
+        client = ServerClient()
+        client.si = MagicMock()
+        collector = \
+            client.si.content.propertyCollector.CreatePropertyCollector()
+        collector.WaitForUpdatesEx.side_effect = [
+            self._make_task_update('1', vim.TaskInfo.State.running),
+            None,
+        ]
+        task = vim.Task('task-1', MagicMock())
+        instance = Mock()
+        instance.runtime_properties = {}
+
+        with patch("vsphere_plugin_common.clients.time.time",
+                   side_effect=[0, 1, 31]):
+            with self.assertRaises(OperationRetry):
+                client._wait_for_task(
+                    task=task, instance=instance, max_wait_time=30)
+
+        self.assertEqual(instance.runtime_properties['_task_id'], 'task-1')
+        self.assertEqual(
+            collector.WaitForUpdatesEx.call_args[0][1].maxWaitSeconds, 15)
+        collector.DestroyPropertyCollector.assert_called_once_with()
+
     def test_add_new_custom_attr(self):
         client = ServerClient()
         client.si = MagicMock()
@@ -2744,6 +3358,1045 @@ class VspherePluginsCommonTests(unittest.TestCase):
         self.assertNotIn('name', warnings[3])
         self.assertNotIn('id', warnings[3])
 
+    def _make_object_content(self, obj, **props):
+        content = Mock()
+        content.obj = obj
+        content.propSet = []
+        for name, val in props.items():
+            prop = Mock()
+            prop.name = name
+            prop.val = val
+            content.propSet.append(prop)
+        return content
+
+    def test_get_obj_by_id_single_object(self):
+        client = VsphereClient()
+        client.si = MagicMock()
+        collector = client.si.content.propertyCollector
+        collector.RetrievePropertiesEx.return_value = Mock(
+            token=None,
+            objects=[
+                self._make_object_content(
+                    vim.Datacenter('datacenter-2'),
+                    name='dc%20two',
+                    vmFolder=vim.Folder('group-v3'),
+                ),
+            ])
+
+        datacenter = client._get_obj_by_id(vim.Datacenter, 'datacenter-2')
+
+        self.assertEqual(datacenter.id, 'datacenter-2')
+        self.assertEqual(datacenter.name, 'dc two')
+        self.assertEqual(datacenter.vmFolder._moId, 'group-v3')
+        # Only the requested object is retrieved, without a container view
+        client.si.content.viewManager.CreateContainerView.assert_not_called()
+        filter_spec = collector.RetrievePropertiesEx.call_args[0][0][0]
+        self.assertEqual(filter_spec.objectSet[0].obj._moId, 'datacenter-2')
+        self.assertFalse(filter_spec.objectSet[0].skip)
+        self.assertEqual(filter_spec.propSet[0].pathSet,
+                         ['name', 'vmFolder'])
+        # A single object does not populate the cache
+        self.assertNotIn('datacenter', client._cache)
+
+    def test_get_obj_by_id_single_object_missing(self):
+        client = VsphereClient()
+        client.si = MagicMock()
+        collector = client.si.content.propertyCollector
+        collector.RetrievePropertiesEx.side_effect = \
+            vmodl.fault.ManagedObjectNotFound()
+
+        self.assertIsNone(
+            client._get_obj_by_id(vim.Datacenter, 'datacenter-2'))
+
+    def test_get_obj_by_id_single_object_refreshes_cache(self):
+        client = VsphereClient()
+        client.si = MagicMock()
+        old_datacenter = Mock(id='datacenter-2')
+        other_datacenter = Mock(id='datacenter-3')
+        client._cache['datacenter'] = _EntityList(
+            [old_datacenter, other_datacenter])
+
+        # cached objects are used without a platform call
+        self.assertIs(
+            client._get_obj_by_id(vim.Datacenter, 'datacenter-2'),
+            old_datacenter)
+        collector = client.si.content.propertyCollector
+        collector.RetrievePropertiesEx.assert_not_called()
+
+        collector.RetrievePropertiesEx.return_value = Mock(
+            token=None,
+            objects=[
+                self._make_object_content(
+                    vim.Datacenter('datacenter-2'),
+                    name='dc',
+                    vmFolder=vim.Folder('group-v3'),
+                ),
+            ])
+        datacenter = client._get_obj_by_id(
+            vim.Datacenter, 'datacenter-2', use_cache=False)
+
+        self.assertEqual(datacenter.id, 'datacenter-2')
+        self.assertEqual(client._cache['datacenter'],
+                         [other_datacenter, datacenter])
+
+    @patch('vsphere_plugin_common.clients._ContainerView')
+    def test_collect_properties_pages(self, mock_view):
+        client = VsphereClient()
+        client.cfg['collector_page_size'] = 2
+        client.si = MagicMock()
+        collector = client.si.content.propertyCollector
+        collector.RetrievePropertiesEx.return_value = Mock(
+            token='page-2',
+            objects=[
+                self._make_object_content(vim.Datastore('ds-1'), name='a'),
+                self._make_object_content(vim.Datastore('ds-2'), name='b'),
+            ])
+        collector.ContinueRetrievePropertiesEx.return_value = Mock(
+            token=None,
+            objects=[
+                self._make_object_content(vim.Datastore('ds-3'), name='c'),
+            ])
+        view = mock_view.return_value
+        view.__enter__.return_value = vim.ContainerView('session[1]view')
+
+        results = client._collect_properties(
+            vim.Datastore, path_set=['name'], stream=True)
+
+        # Nothing is retrieved until the results are consumed
+        collector.RetrievePropertiesEx.assert_not_called()
+        self.assertEqual(next(results)['name'], 'a')
+        self.assertEqual(
+            collector.RetrievePropertiesEx.call_args[0][1].maxObjects, 2)
+        self.assertEqual(next(results)['name'], 'b')
+        collector.ContinueRetrievePropertiesEx.assert_not_called()
+        self.assertEqual(next(results)['obj']._moId, 'ds-3')
+        collector.ContinueRetrievePropertiesEx.assert_called_once_with(
+            'page-2')
+        view.__exit__.assert_not_called()
+        self.assertEqual(list(results), [])
+        view.__exit__.assert_called_once()
+        collector.CancelRetrievePropertiesEx.assert_not_called()
+
+    @patch('vsphere_plugin_common.clients._ContainerView')
+    def test_collect_properties_pages_cancelled(self, mock_view):
+        client = VsphereClient()
+        client.si = MagicMock()
+        collector = client.si.content.propertyCollector
+        collector.RetrievePropertiesEx.return_value = Mock(
+            token='page-2',
+            objects=[
+                self._make_object_content(vim.Datastore('ds-1'), name='a'),
+            ])
+        view = mock_view.return_value
+        view.__enter__.return_value = vim.ContainerView('session[1]view')
+
+        results = client._collect_properties(
+            vim.Datastore, path_set=['name'], stream=True)
+        self.assertEqual(next(results)['name'], 'a')
+        results.close()
+
+        collector.CancelRetrievePropertiesEx.assert_called_once_with(
+            'page-2')
+        collector.ContinueRetrievePropertiesEx.assert_not_called()
+        view.__exit__.assert_called_once()
+
+    @patch('vsphere_plugin_common.clients._ContainerView')
+    def test_collect_properties_batch(self, mock_view):
+        client = VsphereClient()
+        client.si = MagicMock()
+        collector = client.si.content.propertyCollector
+        mock_view.return_value.__enter__.return_value = vim.ContainerView(
+            'session[1]view')
+        collector.RetrievePropertiesEx.return_value = Mock(
+            token=None,
+            objects=[
+                self._make_object_content(
+                    vim.ClusterComputeResource('domain-c1'),
+                    name='cluster',
+                    resourcePool=vim.ResourcePool('resgroup-1'),
+                ),
+                self._make_object_content(
+                    vim.Datastore('datastore-1'),
+                    name='ds', overallStatus='green',
+                ),
+            ])
+
+        results = client._collect_properties_batch([
+            (vim.ComputeResource, ['name']),
+            (vim.ClusterComputeResource, ['name', 'resourcePool']),
+            (vim.Datastore, ['name', 'overallStatus']),
+        ])
+
+        collector.RetrievePropertiesEx.assert_called_once()
+        mock_view.assert_called_once_with(
+            [vim.ComputeResource, vim.ClusterComputeResource, vim.Datastore],
+            client.si, None)
+        filter_spec = collector.RetrievePropertiesEx.call_args[0][0][0]
+        self.assertEqual(
+            [(spec.type, spec.pathSet) for spec in filter_spec.propSet],
+            [(vim.ComputeResource, ['name']),
+             (vim.ClusterComputeResource, ['name', 'resourcePool']),
+             (vim.Datastore, ['name', 'overallStatus'])])
+
+        cluster = vim.ClusterComputeResource('domain-c1')
+        self.assertEqual(results[(vim.ComputeResource, ('name',))],
+                         [{'name': 'cluster', 'obj': cluster}])
+        self.assertEqual(
+            results[(vim.ClusterComputeResource, ('name', 'resourcePool'))],
+            [{'name': 'cluster', 'obj': cluster,
+              'resourcePool': vim.ResourcePool('resgroup-1')}])
+        self.assertEqual(
+            results[(vim.Datastore, ('name', 'overallStatus'))],
+            [{'name': 'ds', 'overallStatus': 'green',
+              'obj': vim.Datastore('datastore-1')}])
+
+    @patch('vsphere_plugin_common.clients._ContainerView')
+    def test_get_host_usage(self, mock_view):
+        client = VsphereClient()
+        client.si = MagicMock()
+        collector = client.si.content.propertyCollector
+        mock_view.return_value.__enter__.return_value = vim.ContainerView(
+            'session[1]view')
+
+        def vm_content(vm_id, host, cpus, memory, template=False):
+            return self._make_object_content(vim.VirtualMachine(vm_id), **{
+                'runtime.host': host,
+                'summary.config.numCpu': cpus,
+                'summary.config.memorySizeMB': memory,
+                'summary.config.template': template,
+            })
+
+        host = vim.HostSystem('host-1')
+        collector.RetrievePropertiesEx.return_value = Mock(
+            token=None,
+            objects=[
+                vm_content('vm-1', host, 2, 1024),
+                vm_content('vm-2', host, 4, 2048),
+                # templates only count towards vCPUs
+                vm_content('vm-3', host, 1, 512, template=True),
+                vm_content('vm-4', vim.HostSystem('host-2'), 1, None),
+                vm_content('vm-5', None, 1, 512),
+            ])
+
+        usage = client._get_host_usage()
+
+        self.assertEqual(usage, {
+            'host-1': HostUsage(memory=3072, cpus=7),
+            'host-2': HostUsage(memory=0, cpus=1),
+        })
+        filter_spec = collector.RetrievePropertiesEx.call_args[0][0][0]
+        self.assertEqual(
+            filter_spec.propSet[0].pathSet,
+            ['runtime.host', 'summary.config.numCpu',
+             'summary.config.memorySizeMB', 'summary.config.template'])
+        # The totals are cached
+        self.assertIs(client._get_host_usage(), usage)
+        collector.RetrievePropertiesEx.assert_called_once()
+
+    def test_get_hosts_in_tree(self):
+        client = VsphereClient()
+        client.si = MagicMock()
+        collector = client.si.content.propertyCollector
+        collector.RetrievePropertiesEx.return_value = Mock(
+            token=None,
+            objects=[
+                self._make_object_content(
+                    vim.HostSystem('host-1'), name='host1'),
+                self._make_object_content(
+                    vim.HostSystem('host-2'), name='host2'),
+            ])
+        host = Mock(id='host-2')
+        client._cache['host'] = _EntityList([host, Mock(id='host-3')])
+        host_folder = vim.Folder('group-h1')
+
+        # disconnected hosts are not cached, so they are skipped
+        self.assertEqual(client._get_hosts_in_tree(host_folder), [host])
+
+        collector.RetrievePropertiesEx.assert_called_once()
+        filter_spec = collector.RetrievePropertiesEx.call_args[0][0][0]
+        obj_spec = filter_spec.objectSet[0]
+        self.assertEqual(obj_spec.obj, host_folder)
+        folder_traversal = obj_spec.selectSet[0]
+        self.assertEqual(
+            (folder_traversal.type, folder_traversal.path),
+            (vim.Folder, 'childEntity'))
+        compute_traversal = folder_traversal.selectSet[1]
+        self.assertEqual(
+            (compute_traversal.type, compute_traversal.path),
+            (vim.ComputeResource, 'host'))
+        self.assertEqual(filter_spec.propSet[0].type, vim.HostSystem)
+
+    @patch('vsphere_plugin_common.clients._ContainerView')
+    def test_scoped_collection(self, mock_view):
+        client = VsphereClient()
+        client.si = MagicMock()
+        collector = client.si.content.propertyCollector
+        mock_view.return_value.__enter__.return_value = vim.ContainerView(
+            'session[1]view')
+        collector.RetrievePropertiesEx.return_value = Mock(
+            token=None,
+            objects=[
+                self._make_object_content(
+                    vim.Datastore('datastore-1'),
+                    name='ds', overallStatus='green',
+                    **{'summary.accessible': True, 'summary.freeSpace': 1}
+                ),
+            ])
+        datacenter = vim.Datacenter('datacenter-1')
+
+        with client._scoped(datacenter):
+            datastores = client._get_datastores()
+            self.assertIs(client._cache['datastore'], datastores)
+
+        mock_view.assert_called_once_with(
+            [vim.Datastore], client.si, datacenter)
+        self.assertEqual([ds.id for ds in datastores], ['datastore-1'])
+        # Each scope has a cache of its own
+        self.assertIsNone(client._scope)
+        self.assertNotIn('datastore', client._cache)
+
+    @patch('vsphere_plugin_common.VsphereClient._iter_properties')
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties_batch')
+    def test_prefetch_entities(self, mock_batch, mock_iter):
+        client = VsphereClient()
+        datacenter_spec = client._entity_properties['datacenter']
+        mock_batch.return_value = {
+            (datacenter_spec[0], tuple(datacenter_spec[1])): [
+                {'name': 'dc', 'vmFolder': vim.Folder('group-v1'),
+                 'obj': vim.Datacenter('datacenter-1')},
+            ],
+        }
+
+        client._prefetch_entities(['datacenter'])
+
+        mock_batch.assert_called_once_with([datacenter_spec])
+        mock_iter.assert_not_called()
+        self.assertEqual(
+            [dc.id for dc in client._cache['datacenter']], ['datacenter-1'])
+        self.assertEqual(client._collected, {})
+
+        # Cached entities are not collected again
+        client._prefetch_entities(['datacenter'])
+        mock_batch.assert_called_once()
+
+    def _make_object_update(self, kind, obj, **props):
+        change_set = [
+            vmodl.query.PropertyCollector.Change(
+                name=name, op='assign', val=val)
+            for name, val in props.items()
+        ]
+        return Mock(kind=kind, obj=obj, changeSet=change_set)
+
+    def test_get_datastores_incremental_cache(self):
+        client = VsphereClient()
+        client.cfg['incremental_cache'] = True
+        client.si = MagicMock()
+        client.si.content.viewManager.CreateContainerView.return_value = \
+            vim.ContainerView('session[1]view')
+        collector = \
+            client.si.content.propertyCollector.CreatePropertyCollector()
+        filter_ref = collector.CreateFilter.return_value
+        datastore_props = {
+            'overallStatus': 'green',
+            'summary.accessible': True,
+            'summary.freeSpace': 10,
+        }
+        collector.WaitForUpdatesEx.side_effect = [
+            Mock(version='1', truncated=False, filterSet=[Mock(
+                filter=filter_ref,
+                objectSet=[
+                    self._make_object_update(
+                        'enter', vim.Datastore('datastore-1'),
+                        name='ds1', **datastore_props),
+                    self._make_object_update(
+                        'enter', vim.Datastore('datastore-2'),
+                        name='ds2', **datastore_props),
+                ],
+            )]),
+            Mock(version='2', truncated=False, filterSet=[Mock(
+                filter=filter_ref,
+                objectSet=[
+                    self._make_object_update(
+                        'modify', vim.Datastore('datastore-2'),
+                        **{'summary.freeSpace': 5}),
+                    self._make_object_update(
+                        'leave', vim.Datastore('datastore-1')),
+                ],
+            )]),
+            None,
+        ]
+        with patch('vsphere_plugin_common.clients.atexit'):
+            datastores = client._get_datastores()
+
+        self.assertEqual([ds.name for ds in datastores], ['ds1', 'ds2'])
+        self.assertEqual(collector.WaitForUpdatesEx.call_count, 1)
+        self.assertEqual(collector.WaitForUpdatesEx.call_args[0][0], '')
+
+        refreshed = client._get_datastores(use_cache=False)
+        self.assertEqual(collector.WaitForUpdatesEx.call_args[0][0], '1')
+        self.assertEqual([ds.id for ds in refreshed], ['datastore-2'])
+        self.assertEqual(refreshed[0].summary.freeSpace, 5)
+        self.assertEqual(refreshed[0].name, 'ds2')
+
+        # Nothing changed, so the cached records are kept
+        self.assertIs(client._get_datastores(use_cache=False), refreshed)
+        self.assertEqual(collector.WaitForUpdatesEx.call_args[0][0], '2')
+        collector.CreateFilter.assert_called_once()
+        client.si.content.propertyCollector.RetrievePropertiesEx.\
+            assert_not_called()
+
+    def _make_incremental_client(self, *update_sets):
+        client = VsphereClient()
+        client.cfg['incremental_cache'] = True
+        client.si = MagicMock()
+        client.si.content.viewManager.CreateContainerView.return_value = \
+            vim.ContainerView('session[1]view')
+        collector = \
+            client.si.content.propertyCollector.CreatePropertyCollector()
+        filter_ref = collector.CreateFilter.return_value
+        collector.WaitForUpdatesEx.side_effect = [
+            Mock(version=str(version), truncated=False, filterSet=[Mock(
+                filter=filter_ref, objectSet=object_set)])
+            for version, object_set in enumerate(update_sets, 1)
+        ] + [None] * 3
+        return client, collector
+
+    def test_get_datastores_incremental_cache_in_place(self):
+        datastore_props = {
+            'overallStatus': 'green',
+            'summary.accessible': True,
+            'summary.freeSpace': 10,
+        }
+        client, collector = self._make_incremental_client(
+            [
+                self._make_object_update(
+                    'enter', vim.Datastore('datastore-1'),
+                    name='ds1', **datastore_props),
+                self._make_object_update(
+                    'enter', vim.Datastore('datastore-2'),
+                    name='ds2', **datastore_props),
+            ],
+            [
+                self._make_object_update(
+                    'modify', vim.Datastore('datastore-2'),
+                    **{'summary.freeSpace': 5}),
+                self._make_object_update(
+                    'enter', vim.Datastore('datastore-3'),
+                    name='ds3', **datastore_props),
+            ],
+        )
+        with patch('vsphere_plugin_common.clients.atexit'):
+            datastores = client._get_datastores()
+        first = datastores[0]
+        by_id = datastores.by_id
+        by_name = datastores.by_name
+
+        datastore = client._get_obj_by_id(
+            vim.Datastore, 'datastore-2', use_cache=False)
+
+        # Only the changed records are updated, in the same list
+        self.assertEqual(datastore.summary.freeSpace, 5)
+        self.assertIs(client._cache['datastore'], datastores)
+        self.assertEqual([ds.id for ds in datastores],
+                         ['datastore-1', 'datastore-2', 'datastore-3'])
+        self.assertIs(datastores[0], first)
+        self.assertIs(datastores.by_id, by_id)
+        self.assertIs(by_id['datastore-2'], datastore)
+        self.assertIs(datastores.by_name, by_name)
+        self.assertEqual(by_name['ds2'], [datastore])
+        self.assertEqual(datastores.positions['datastore-3'], 2)
+
+    def test_get_hosts_incremental_cache_mapped_vm_changed(self):
+        client = VsphereClient()
+        client.cfg['incremental_cache'] = True
+        client.si = MagicMock()
+        client.si.content.viewManager.CreateContainerView.return_value = \
+            vim.ContainerView('session[1]view')
+        collector = \
+            client.si.content.propertyCollector.CreatePropertyCollector()
+        host_filter = vmodl.query.PropertyCollector.Filter('filter-1')
+        vm_filter = vmodl.query.PropertyCollector.Filter('filter-2')
+        collector.CreateFilter.side_effect = [host_filter, vm_filter]
+        host_props = {
+            'parent': vim.ClusterComputeResource('domain-c1'),
+            'hardware.memorySize': 1024 ** 3,
+            'hardware.cpuInfo.numCpuThreads': 4,
+            'overallStatus': 'green',
+            'network': vim.Network.Array(),
+            'summary.runtime.connectionState': 'connected',
+            'summary.runtime.inMaintenanceMode': False,
+            'datastore': vim.Datastore.Array(),
+            'config.network.vswitch': vim.host.VirtualSwitch.Array(),
+            'configManager': None,
+        }
+        old_summary = vim.vm.Summary()
+        new_summary = vim.vm.Summary()
+        collector.WaitForUpdatesEx.side_effect = [
+            Mock(version='1', truncated=False, filterSet=[Mock(
+                filter=host_filter,
+                objectSet=[
+                    self._make_object_update(
+                        'enter', vim.HostSystem('host-1'), name='host1',
+                        vm=vim.VirtualMachine.Array(
+                            [vim.VirtualMachine('vm-1')]),
+                        **host_props),
+                    self._make_object_update(
+                        'enter', vim.HostSystem('host-2'), name='host2',
+                        vm=vim.VirtualMachine.Array(), **host_props),
+                ],
+            )]),
+            Mock(version='2', truncated=False, filterSet=[Mock(
+                filter=vm_filter,
+                objectSet=[self._make_object_update(
+                    'enter', vim.VirtualMachine('vm-1'), name='vm1',
+                    summary=old_summary)],
+            )]),
+            None,
+            None,
+            Mock(version='3', truncated=False, filterSet=[Mock(
+                filter=vm_filter,
+                objectSet=[self._make_object_update(
+                    'modify', vim.VirtualMachine('vm-1'),
+                    summary=new_summary)],
+            )]),
+            None,
+        ]
+
+        with patch('vsphere_plugin_common.clients.atexit'):
+            hosts = client._get_hosts(use_cache=False)
+            self.assertIs(hosts[0].vm[0].summary, old_summary)
+            # The VM entered after the records of the hosts were built
+            hosts = client._get_hosts(use_cache=False)
+            self.assertIs(hosts[0].vm[0].summary, old_summary)
+            unchanged = hosts[1]
+
+            refreshed = client._get_hosts(use_cache=False)
+
+        # The host itself did not change, but its VM did
+        self.assertIs(refreshed, hosts)
+        self.assertIs(refreshed[0].vm[0].summary, new_summary)
+        self.assertIs(refreshed[1], unchanged)
+
+    def test_mapping_resolver_uses_list_index(self):
+        entities = _EntityList([Mock(id='a'), Mock(id='b')])
+        resolver = _MappingResolver(entities=entities)
+
+        self.assertEqual(resolver.positions, {'a': 0, 'b': 1})
+        self.assertIs(resolver.positions, entities.positions)
+
+    def test_get_vms_incremental_cache_scoped(self):
+        datacenter = vim.Datacenter('datacenter-1')
+        client, collector = self._make_incremental_client([
+            self._make_object_update(
+                'enter', vim.VirtualMachine('vm-1'),
+                name='vm1', summary=vim.vm.Summary()),
+        ])
+
+        with client._scoped(datacenter), \
+                patch('vsphere_plugin_common.clients.atexit'):
+            vms = client._get_vms(projections=['summary'])
+            self.assertIs(client._cache['vm:identity+summary'], vms)
+
+        # Only the VMs of the datacenter are tracked, with the properties
+        # of the projection
+        client.si.content.viewManager.CreateContainerView.\
+            assert_called_once_with(container=datacenter,
+                                    type=[vim.VirtualMachine],
+                                    recursive=True)
+        filter_spec = collector.CreateFilter.call_args[0][0]
+        self.assertEqual(sorted(filter_spec.propSet[0].pathSet),
+                         ['name', 'summary'])
+        self.assertEqual([vm.id for vm in vms], ['vm-1'])
+        self.assertEqual(vms[0].name, 'vm1')
+        self.assertNotIn('vm:identity+summary', client._cache)
+        self.assertEqual(client._scopes['datacenter-1'].tracked.keys(),
+                         {'vm:identity+summary'})
+
+    def _make_snapshot_client(self, cache_dir):
+        client = VsphereClient()
+        client.cfg.update({
+            'host': 'vcenter.example',
+            'snapshot_cache': True,
+            'snapshot_cache_dir': cache_dir,
+        })
+        client.si = MagicMock()
+        return client
+
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_get_datacenters_snapshot_cache(self, mock_collect):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        mock_collect.return_value = [
+            {'name': 'dc', 'vmFolder': vim.Folder('group-v1'),
+             'obj': vim.Datacenter('datacenter-1')},
+        ]
+
+        client = self._make_snapshot_client(cache_dir)
+        client._get_datacenters()
+        mock_collect.assert_called_once()
+        self.assertTrue(os.path.isfile(os.path.join(
+            cache_dir, 'vcenter.example_443', 'datacenter.json')))
+
+        # Another operation is served from the snapshot
+        datacenters = self._make_snapshot_client(cache_dir)._get_datacenters()
+        mock_collect.assert_called_once()
+        self.assertEqual(datacenters[0].id, 'datacenter-1')
+        self.assertEqual(datacenters[0].name, 'dc')
+        self.assertIsInstance(datacenters[0].vmFolder, vim.Folder)
+        self.assertEqual(datacenters[0].vmFolder._moId, 'group-v1')
+
+        client._invalidate_snapshots('datacenter')
+        self._make_snapshot_client(cache_dir)._get_datacenters()
+        self.assertEqual(mock_collect.call_count, 2)
+
+        # VMs stay live by default
+        self.assertIsNone(client._get_inventory_snapshot('vm'))
+        client.cfg['snapshot_cache_ttl'] = {'datacenter': 0, 'vm': 30}
+        self.assertIsNone(client._get_inventory_snapshot('datacenter'))
+        self.assertEqual(client._get_inventory_snapshot('vm').ttl, 30)
+
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_invalidate_scoped_snapshots(self, mock_collect):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        mock_collect.return_value = [
+            {'name': 'ds', 'overallStatus': 'green',
+             'summary.accessible': True, 'summary.freeSpace': 1,
+             'obj': vim.Datastore('datastore-1')},
+        ]
+        datacenter = vim.Datacenter('datacenter-1')
+        client = self._make_snapshot_client(cache_dir)
+        with client._scoped(datacenter):
+            client._get_datastores()
+        path = os.path.join(
+            cache_dir, 'vcenter.example_443', 'datacenter-1', 'datastore.json')
+        self.assertTrue(os.path.isfile(path))
+
+        # A caller without a scope still drops the datacenter snapshot
+        self._make_snapshot_client(cache_dir)._invalidate_snapshots(
+            'datastore')
+        self.assertFalse(os.path.exists(path))
+
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_get_datacenters_snapshot_cache_expired(self, mock_collect):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        mock_collect.return_value = [
+            {'name': 'dc', 'vmFolder': vim.Folder('group-v1'),
+             'obj': vim.Datacenter('datacenter-1')},
+        ]
+
+        self._make_snapshot_client(cache_dir)._get_datacenters()
+        with patch('vsphere_plugin_common.clients.time.time',
+                   return_value=time.time() + 3601):
+            self._make_snapshot_client(cache_dir)._get_datacenters()
+
+        self.assertEqual(mock_collect.call_count, 2)
+
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_get_entity_shares_record_types(self, mock_collect):
+        client = VsphereClient()
+        mock_collect.return_value = [
+            {'name': 'dc1', 'vmFolder': vim.Folder('group-v1'),
+             'obj': vim.Datacenter('datacenter-1')},
+            {'name': 'dc2', 'vmFolder': vim.Folder('group-v2'),
+             'obj': vim.Datacenter('datacenter-2')},
+        ]
+
+        first, second = client._get_datacenters()
+        refreshed = VsphereClient()._get_datacenters()[0]
+
+        self.assertIs(type(first), type(second))
+        self.assertIs(type(first), type(refreshed))
+        self.assertEqual(type(first).__name__, 'datacenter')
+        self.assertEqual((second.id, second.name, second.vmFolder),
+                         ('datacenter-2', 'dc2', vim.Folder('group-v2')))
+
+    @patch('vsphere_plugin_common.VsphereClient._get_datastores')
+    @patch('vsphere_plugin_common.VsphereClient._get_networks')
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_get_vms_projections(self,
+                                 mock_collect,
+                                 mock_get_networks,
+                                 mock_get_datastores):
+        client = VsphereClient()
+        mock_get_networks.return_value = []
+        mock_get_datastores.return_value = []
+        values = {
+            'summary': 'summary',
+            'config.hardware.device': [],
+            'config.hardware.memoryMB': 1024,
+            'config.hardware.numCPU': 1,
+            'datastore': [],
+            'guest.guestState': 'running',
+            'guest.net': [],
+            'network': [],
+        }
+
+        def collect(obj_type, path_set=None, object_id=None, stream=False):
+            object_ids = [object_id] if object_id else ['vm-1', 'vm-2']
+            return [
+                dict({path: values.get(path, obj_id) for path in path_set},
+                     obj=vim.VirtualMachine(obj_id))
+                for obj_id in object_ids
+            ]
+        mock_collect.side_effect = collect
+
+        vms = client._get_vms(projections=['identity'])
+        self.assertEqual([vm.name for vm in vms], ['vm-1', 'vm-2'])
+        self.assertFalse(hasattr(vms[0], 'summary'))
+        self.assertEqual(mock_collect.call_args[1]['path_set'], ['name'])
+
+        # Only the missing properties are collected
+        vms = client._get_vms(projections=['summary'])
+        self.assertEqual([(vm.name, vm.summary) for vm in vms],
+                         [('vm-1', 'summary'), ('vm-2', 'summary')])
+        self.assertEqual(mock_collect.call_args[1]['path_set'], ['summary'])
+        self.assertIs(client._get_vms(projections=['summary']), vms)
+        self.assertEqual(mock_collect.call_count, 2)
+
+        # A VM collected on its own is collected again for the projections
+        client._get_vms(object_id='vm-2')
+        mock_collect.reset_mock()
+        client._get_vms(projections=['summary'])
+        mock_collect.assert_called_once_with(
+            vim.VirtualMachine, path_set=['name', 'summary'],
+            object_id='vm-2')
+
+        mock_collect.reset_mock()
+        vms = client._get_vms()
+        self.assertEqual(mock_collect.call_args[1]['path_set'], [
+            'config.hardware.device',
+            'config.hardware.memoryMB',
+            'config.hardware.numCPU',
+            'datastore',
+            'guest.guestState',
+            'guest.net',
+            'network',
+        ])
+        self.assertEqual(vms[1].config.hardware.numCPU, 1)
+        self.assertIs(client._cache['vm'], vms)
+        self.assertIs(client._get_vms(projections=['identity']), vms)
+
+    @patch('vsphere_plugin_common.VsphereClient._get_datastores')
+    @patch('vsphere_plugin_common.VsphereClient._get_networks')
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_get_vms_mappings_by_id(self,
+                                    mock_collect,
+                                    mock_get_networks,
+                                    mock_get_datastores):
+        client = VsphereClient()
+        id_lookups = []
+
+        class Entity(object):
+            def __init__(self, id):
+                self._id = id
+
+            @property
+            def id(self):
+                id_lookups.append(self._id)
+                return self._id
+
+        networks = [Entity('network-{0}'.format(i)) for i in range(4)]
+        mock_get_networks.return_value = networks
+        mock_get_datastores.return_value = [Entity('datastore-1')]
+        vm_properties = {
+            'summary': None,
+            'config.hardware.device': [],
+            'config.hardware.memoryMB': 1024,
+            'config.hardware.numCPU': 1,
+            'datastore': [vim.Datastore('datastore-1')],
+            'guest.guestState': 'running',
+            'guest.net': [],
+        }
+        mock_collect.return_value = [
+            dict(vm_properties, name='vm1', obj=vim.VirtualMachine('vm-1'),
+                 network=[vim.Network('network-3'), vim.Network('network-1')]),
+            dict(vm_properties, name='vm2', obj=vim.VirtualMachine('vm-2'),
+                 network=[vim.Network('network-2')]),
+            dict(vm_properties, name='vm3', obj=vim.VirtualMachine('vm-3'),
+                 network=[vim.Network('network-9')]),
+        ]
+
+        vm1, vm2, vm3 = client._get_vms()
+
+        # Mapped in the order of the other entities
+        self.assertEqual(vm1.network, [networks[1], networks[3]])
+        self.assertEqual(vm2.network, [networks[2]])
+        # Each network ID was only read to build the index
+        self.assertEqual(len(id_lookups), len(networks))
+        self.assertRaises(OperationRetry, getattr, vm3, 'network')
+
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_get_resource_pools_tree(self, mock_collect):
+        def pool(pool_id, *children):
+            return {
+                'name': pool_id,
+                'resourcePool': [vim.ResourcePool(child)
+                                 for child in children],
+                'obj': vim.ResourcePool(pool_id),
+            }
+
+        mock_collect.return_value = [
+            pool('resgroup-4'),
+            pool('resgroup-1', 'resgroup-2', 'resgroup-3'),
+            pool('resgroup-3', 'resgroup-4', 'resgroup-5'),
+            pool('resgroup-2'),
+            pool('resgroup-5'),
+        ]
+        client = ServerClient()
+
+        pools = client._get_resource_pools()
+
+        self.assertEqual(
+            [rp.id for rp in pools],
+            ['resgroup-4', 'resgroup-1', 'resgroup-3', 'resgroup-2',
+             'resgroup-5'])
+        root = pools.by_id['resgroup-1']
+        # Pools are shared, not copied into each parent
+        self.assertIs(root.resourcePool[1], pools.by_id['resgroup-3'])
+        self.assertIs(root.resourcePool[1].resourcePool[0], pools[0])
+
+        self.assertEqual(
+            [rp.id for rp in client.recurse_resource_pools(root)],
+            ['resgroup-2', 'resgroup-3', 'resgroup-4', 'resgroup-5'])
+        host = Mock()
+        host.parent.resourcePool = root
+        self.assertEqual(
+            [rp.id for rp in client.get_host_resource_pools(host)],
+            ['resgroup-1', 'resgroup-2', 'resgroup-3', 'resgroup-4',
+             'resgroup-5'])
+
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_get_resource_pools_changed(self, mock_collect):
+        mock_collect.return_value = [{
+            'name': 'Resources',
+            'resourcePool': [vim.ResourcePool('resgroup-2')],
+            'obj': vim.ResourcePool('resgroup-1'),
+        }]
+
+        self.assertRaises(OperationRetry,
+                          VsphereClient()._get_resource_pools)
+
+    def _make_named_entity(self, name, id):
+        entity = Mock(id=id)
+        entity.name = name
+        return entity
+
+    @patch('vsphere_plugin_common.VsphereClient._get_entity_datacenter')
+    def test_get_obj_by_name_index(self, mock_get_entity_datacenter):
+        client = VsphereClient()
+        folders = [
+            self._make_named_entity('Folder', 'group-1'),
+            self._make_named_entity('folder', 'group-2'),
+            self._make_named_entity('other', 'group-3'),
+        ]
+        client._cache['vm_folder'] = _EntityList(folders)
+        dc1 = Mock()
+        dc1.name = 'dc1'
+        dc2 = Mock()
+        dc2.name = 'dc2'
+        mock_get_entity_datacenter.side_effect = (dc1, dc2)
+
+        self.assertIs(client._get_obj_by_name(vim.Folder, 'FOLDER'),
+                      folders[0])
+        self.assertIs(
+            client._get_obj_by_name(vim.Folder, 'folder',
+                                    datacenter_name='dc2'),
+            folders[1])
+        self.assertIsNone(client._get_obj_by_name(vim.Folder, 'missing'))
+        # only entities with a matching name are checked for datacenter
+        self.assertEqual(
+            mock_get_entity_datacenter.mock_calls,
+            [call(folders[0]), call(folders[1])])
+        self.assertIs(client._get_obj_by_id(vim.Folder, 'group-3'),
+                      folders[2])
+
+    @patch('vsphere_plugin_common.VsphereClient.'
+           '_get_extra_dv_port_group_details')
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_get_networks_rebuilds_index(self,
+                                         mock_collect,
+                                         mock_extra_details):
+        client = VsphereClient()
+        mock_extra_details.return_value = {
+            'dvportgroup-1': {'key': 'dvpg-key', 'config': Mock()},
+        }
+        mock_collect.return_value = [
+            {'name': 'net', 'host': [], 'obj': vim.Network('network-1')},
+            {'name': 'dvnet', 'host': [],
+             'obj': vim.dvs.DistributedVirtualPortgroup('dvportgroup-1')},
+        ]
+
+        self.assertEqual(
+            client._get_obj_by_name(
+                vim.dvs.DistributedVirtualPortgroup, 'DVNet').key,
+            'dvpg-key')
+        self.assertEqual(
+            [net.id for net in client._get_standard_networks()],
+            ['network-1'])
+
+        mock_collect.return_value = [
+            {'name': 'net2', 'host': [], 'obj': vim.Network('network-2')},
+        ]
+        client._get_networks(use_cache=False)
+
+        self.assertIsNone(client._get_obj_by_name(vim.Network, 'net'))
+        self.assertEqual(
+            client._get_obj_by_name(vim.Network, 'net2').id, 'network-2')
+        self.assertEqual(client._get_dv_networks(), [])
+        self.assertEqual(
+            [net.id for net in client._get_standard_networks()],
+            ['network-2'])
+
+    def _make_host_properties(self, host_id, vm_ids):
+        return {
+            'name': host_id,
+            'parent': vim.ClusterComputeResource('domain-c1'),
+            'hardware.memorySize': 1024,
+            'hardware.cpuInfo.numCpuThreads': 4,
+            'overallStatus': 'green',
+            'network': vim.Network.Array(),
+            'summary.runtime.connectionState': 'connected',
+            'summary.runtime.inMaintenanceMode': False,
+            'vm': [vim.VirtualMachine(vm_id) for vm_id in vm_ids],
+            'datastore': vim.Datastore.Array(),
+            'config.network.vswitch': vim.host.VirtualSwitch.Array(),
+            'configManager': Mock(),
+            'obj': vim.HostSystem(host_id),
+        }
+
+    @patch('vsphere_plugin_common.VsphereClient._get_clusters')
+    @patch('vsphere_plugin_common.VsphereClient._get_computes')
+    @patch('vsphere_plugin_common.VsphereClient._get_networks')
+    @patch('vsphere_plugin_common.VsphereClient._get_vms')
+    @patch('vsphere_plugin_common.VsphereClient._get_datastores')
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_get_hosts_lazy_mappings(self,
+                                     mock_collect,
+                                     mock_get_datastores,
+                                     mock_get_vms,
+                                     mock_get_networks,
+                                     mock_get_computes,
+                                     mock_get_clusters):
+        client = VsphereClient()
+        mock_collect.return_value = [
+            self._make_host_properties('host-1', ['vm-1']),
+            self._make_host_properties('host-2', ['vm-2', 'vm-3']),
+        ]
+        vms = [Mock(id='vm-1'), Mock(id='vm-2'), Mock(id='vm-3')]
+        mock_get_vms.return_value = vms
+        mock_get_clusters.return_value = [Mock(id='domain-c1')]
+        mock_get_computes.return_value = []
+
+        hosts = client._get_hosts()
+
+        self.assertEqual([host.id for host in hosts], ['host-1', 'host-2'])
+        self.assertEqual(hosts[0].name, 'host-1')
+        mock_collect.assert_called_once()
+        for getter in (mock_get_datastores, mock_get_vms, mock_get_networks,
+                       mock_get_computes, mock_get_clusters):
+            getter.assert_not_called()
+
+        self.assertEqual(hosts[0].vm, [vms[0]])
+        self.assertEqual(hosts[1].vm, vms[1:])
+        # One fetch is shared by all of the hosts
+        mock_get_vms.assert_called_once_with(
+            use_cache=True, projections=['summary'])
+        self.assertIs(hosts[1].parent, mock_get_clusters.return_value[0])
+        mock_get_networks.assert_not_called()
+        mock_get_datastores.assert_not_called()
+
+    @patch('vsphere_plugin_common.VsphereClient._get_datastores')
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_get_hosts_lazy_mappings_changed(self,
+                                             mock_collect,
+                                             mock_get_datastores):
+        client = VsphereClient()
+        host_properties = self._make_host_properties('host-1', [])
+        host_properties['datastore'] = [vim.Datastore('datastore-1')]
+        mock_collect.return_value = [host_properties]
+        mock_get_datastores.return_value = []
+
+        host = client._get_hosts()[0]
+
+        self.assertRaises(OperationRetry, getattr, host, 'datastore')
+
+    @patch('vsphere_plugin_common.VsphereClient._get_clusters')
+    @patch('vsphere_plugin_common.VsphereClient._get_computes')
+    @patch('vsphere_plugin_common.VsphereClient._get_networks')
+    @patch('vsphere_plugin_common.VsphereClient._get_vms')
+    @patch('vsphere_plugin_common.VsphereClient._get_datastores')
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_get_hosts_lazy_mappings_tuple_access(self,
+                                                  mock_collect,
+                                                  mock_get_datastores,
+                                                  mock_get_vms,
+                                                  mock_get_networks,
+                                                  mock_get_computes,
+                                                  mock_get_clusters):
+        client = VsphereClient()
+        mock_collect.return_value = [
+            self._make_host_properties('host-1', ['vm-1'])]
+        vms = [Mock(id='vm-1')]
+        mock_get_vms.return_value = vms
+        mock_get_datastores.return_value = []
+        mock_get_networks.return_value = []
+        mock_get_computes.return_value = []
+        mock_get_clusters.return_value = [Mock(id='domain-c1')]
+
+        host = client._get_hosts()[0]
+        index = host._fields.index('vm')
+
+        self.assertEqual(host[index], vms)
+        self.assertEqual(host[index:index + 1], (vms,))
+        self.assertEqual(tuple(host)[index], vms)
+        self.assertEqual(host._asdict()['vm'], vms)
+        self.assertEqual(host._replace(name='other').vm, vms)
+        self.assertEqual(list(host)[index], vms)
+        mock_get_vms.assert_called_once_with(
+            use_cache=True, projections=['summary'])
+
+    @patch('vsphere_plugin_common.VsphereClient._get_vms')
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_get_hosts_lazy_mappings_scope(self, mock_collect, mock_get_vms):
+        client = VsphereClient()
+        mock_collect.return_value = [
+            self._make_host_properties('host-1', ['vm-1'])]
+        datacenter = vim.Datacenter('datacenter-1')
+        scopes = []
+
+        def get_vms(**_):
+            scopes.append(client._scope)
+            return [Mock(id='vm-1')]
+
+        mock_get_vms.side_effect = get_vms
+        with client._scoped(datacenter):
+            host = client._get_hosts()[0]
+
+        # The VMs are loaded from the scope the host was built in
+        self.assertEqual([vm.id for vm in host.vm], ['vm-1'])
+        self.assertEqual(scopes, [datacenter])
+        self.assertIsNone(client._scope)
+
+    @patch('vsphere_plugin_common.VsphereClient._collect_properties')
+    def test_get_hosts_lazy_mappings_cached_source(self, mock_collect):
+        client = VsphereClient()
+        host_properties = self._make_host_properties('host-1', [])
+        host_properties['datastore'] = [vim.Datastore('datastore-1')]
+        mock_collect.return_value = [host_properties]
+        datastore = Mock(id='datastore-1')
+        client._cache['datastore'] = _EntityList([datastore])
+
+        host = client._get_hosts()[0]
+        refreshed = _EntityList([Mock(id='datastore-1')])
+        client._cache['datastore'] = refreshed
+
+        # The datastores cached when the host was built are used
+        self.assertEqual(host.datastore, [datastore])
+        self.assertIs(client._cache['datastore'], refreshed)
+        mock_collect.assert_called_once()
+
 
 if __name__ == '__main__':
     unittest.main()
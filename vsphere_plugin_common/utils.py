@@ -15,15 +15,18 @@
 
 import re
 import logging
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from functools import wraps
+from contextlib import contextmanager
 try:
     from inspect import getargspec
 except ImportError:
     from inspect import getfullargspec as getargspec
 
-from deepdiff import DeepDiff
-
 from cloudify import ctx
 from cloudify.decorators import operation
 
@@ -192,6 +195,8 @@ def assign_expected_configuration(iface, runtime_props, prop=None):
 
 
 def compare_configuration(expected_configuration, remote_configuration):
+    # deepdiff is slow to import and only needed by check_drift
+    from deepdiff import DeepDiff
     return DeepDiff(expected_configuration,
                     remote_configuration,
                     ignore_order=True)
@@ -228,3 +233,21 @@ def get_plugin_properties(plugin_properties):
         if 'value' in v:
             final_props[k] = v.get('value')
     return final_props
+
+
+@contextmanager
+def locked_file(path, shared=False):
+    """
+    Hold an advisory lock on path for the duration of the block, using a
+    separate .lock file so that path itself can be replaced.
+    Locking is skipped on platforms without fcntl.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)